@@ -0,0 +1,660 @@
+"""
+Fan-out aggregation of current weather from all providers.
+
+All provider calls run at the same time under one overall deadline.
+Whatever sources finish in time are returned, together with per-source
+status and timing so slow or failing upstreams are visible in the response.
+
+Successful results are cached per city and source with a TTL matching the
+upstream update cadence, and concurrent requests for the same city share
+one upstream fetch.
+
+Several cities can be fetched at once with fetch_many(), which runs them
+concurrently under a concurrency limit shared by all batch requests.
+Sources with a bulk provider (FMI) are first fetched for all the cities
+with a few multi-city requests (fetch_bulk), and only the cities the bulk
+call had nothing for are fetched one by one.
+
+While a source's upstream circuit is open (see services/http_client.py),
+its last cached result is served instead, marked "stale": True, for up
+to STALE_MAX_AGE seconds past its expiry.
+
+Sources whose coverage region doesn't contain the city (see routing.py)
+are not called at all and are reported with status "skipped".
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import metrics
+from cache import SingleFlight, TTLCache
+from cities import normalize_city
+from routing import FINLAND, ProviderRouter
+from shared_state import create_cache
+from services.fmi import fmi_service
+from services.foreca import foreca_service
+from services.geocoding import geocoder
+from services.http_client import http_client
+from services.yr import yr_service
+
+# A provider takes a city name and returns unified weather data, or None if
+# it has no data for the city; upstream failures are raised (status "error")
+ProviderCall = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+
+# A bulk provider takes city names and returns city -> unified weather data
+# (cities without data are left out)
+BulkProviderCall = Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]]
+
+# Per-source status values
+STATUS_OK = "ok"
+STATUS_EMPTY = "empty"
+STATUS_ERROR = "error"
+STATUS_TIMEOUT = "timeout"
+STATUS_SKIPPED = "skipped"  # City outside the source's coverage
+
+PROVIDER_LATENCY = metrics.histogram(
+    "weather_provider_duration_seconds",
+    "Provider call latency by source and status",
+    ("source", "status"),
+)
+PROVIDER_IN_FLIGHT = metrics.gauge(
+    "weather_provider_in_flight", "Provider calls in flight", ("source",)
+)
+PROVIDER_ERRORS = metrics.counter(
+    "weather_provider_errors_total",
+    "Provider calls that failed or timed out",
+    ("source", "status"),
+)
+
+# Display names used when several sources are combined
+SOURCE_NAMES = {"FMI": "FMI", "Yr": "Yr.no", "Foreca": "Foreca"}
+
+# Fields filled from other sources when missing from the base source
+FILL_FIELDS = ("pressure", "wind_speed")
+
+
+class WeatherAggregator:
+    """Runs provider calls concurrently and combines their results."""
+
+    def __init__(
+        self,
+        providers: Dict[str, ProviderCall],
+        deadline: float = 10.0,
+        cache: Optional[TTLCache] = None,
+        ttls: Optional[Dict[str, float]] = None,
+        batch_concurrency: int = 8,
+        circuit_open: Optional[Callable[[str], bool]] = None,
+        stale_max_age: float = 6 * 3600,
+        router: Optional[ProviderRouter] = None,
+        bulk_providers: Optional[Dict[str, BulkProviderCall]] = None,
+    ):
+        """
+        Initialize aggregator.
+
+        Args:
+            providers: Mapping of source name (e.g. "FMI") to provider call
+            deadline: Overall time budget in seconds for one request
+            cache: Response cache keyed by (normalized city, source), a
+                TTLCache or a shared cache (see shared_state.py)
+            ttls: Cache time-to-live in seconds per source (0 = no caching)
+            batch_concurrency: Cities fetched at once by fetch_many, across
+                all batch requests
+            circuit_open: Tells whether a source's upstream circuit is open
+            stale_max_age: Seconds past expiry a cached result may be served
+                while the source's circuit is open
+            router: Chooses the sources that cover a city (default: all)
+            bulk_providers: Source name -> call fetching many cities at once,
+                used by fetch_bulk
+        """
+        self.providers = providers
+        self.deadline = deadline
+        self.cache = cache if cache is not None else TTLCache()
+        self.ttls = ttls or {}
+        self._single_flight = SingleFlight()
+        self._batch_limit = asyncio.Semaphore(batch_concurrency)
+        self.circuit_open = circuit_open or (lambda source: False)
+        self.stale_max_age = stale_max_age
+        self.router = router
+        self.bulk_providers = bulk_providers or {}
+
+    async def _run_provider(self, source: str, call: ProviderCall, city: str) -> Dict:
+        """
+        Run one provider call and record its status and timing.
+
+        Args:
+            source: Source name
+            call: Provider call
+            city: City name
+
+        Returns:
+            Result dictionary with status, elapsed_ms and data
+        """
+        started = time.perf_counter()
+        try:
+            with PROVIDER_IN_FLIGHT.track(source):
+                data = await call(city)
+            status = STATUS_OK if data else STATUS_EMPTY
+            result = {"status": status, "data": data or None}
+        except Exception as e:
+            # Upstream failures; None (status "empty") only means the
+            # source has no data for the city
+            error = str(e) or type(e).__name__
+            print(f"{source} error: {error}")
+            result = {"status": STATUS_ERROR, "data": None, "error": error}
+            PROVIDER_ERRORS.inc(source, STATUS_ERROR)
+
+        elapsed = time.perf_counter() - started
+        PROVIDER_LATENCY.observe(elapsed, source, result["status"])
+        result["elapsed_ms"] = round(elapsed * 1000, 1)
+        return result
+
+    async def _route(
+        self, city: str, sources: List[str], results: Dict[str, Dict], timeout: float
+    ) -> List[str]:
+        """
+        Drop sources that don't cover the city, marking them as skipped.
+
+        Routing may have to geocode the city, which counts against the
+        request's deadline: if it takes longer than `timeout`, every source
+        is fetched instead (the lookup keeps running and is cached).
+
+        Returns:
+            Sources to fetch
+        """
+        if self.router is None:
+            return sources
+
+        try:
+            routed = await asyncio.wait_for(self.router.route(city, sources), timeout)
+        except asyncio.TimeoutError:
+            print(f"Routing '{city}' timed out, trying all sources")
+            return sources
+        for source in sources:
+            if source not in routed:
+                results[source] = {"status": STATUS_SKIPPED, "data": None, "elapsed_ms": 0.0}
+        return routed
+
+    @staticmethod
+    def _remaining(deadline: float, started: float) -> float:
+        """Seconds left of a deadline that started at `started` (perf_counter)."""
+        return max(0.0, deadline - (time.perf_counter() - started))
+
+    async def fetch(
+        self,
+        city: str,
+        deadline: Optional[float] = None,
+        prefetched: Optional[Dict[str, Dict]] = None,
+    ) -> Dict[str, Dict]:
+        """
+        Get current weather from all providers.
+
+        Sources with a fresh cached result are served from the cache and
+        marked with "cached": True. The rest are routed (sources that don't
+        cover the city are skipped; routing counts against the deadline)
+        and fetched concurrently, and
+        concurrent requests for the same city share one upstream fetch
+        (followers also get "cached": True, so only one caller saves them).
+
+        Args:
+            city: City name
+            deadline: Time budget in seconds, routing included (default:
+                self.deadline)
+            prefetched: Results already fetched for some sources (from
+                fetch_bulk), used as they are
+
+        Returns:
+            Dictionary of source name -> result (status, elapsed_ms, data)
+        """
+        started = time.perf_counter()
+        if deadline is None:
+            deadline = self.deadline
+        key = normalize_city(city)
+        results = dict(prefetched or {})
+        missing = []
+
+        lookups = [source for source in self.providers if source not in results]
+        cached = await asyncio.gather(*(self.cache.aget((key, source)) for source in lookups))
+        for source, data in zip(lookups, cached):
+            if data is not None:
+                results[source] = {
+                    "status": STATUS_OK,
+                    "data": data,
+                    "elapsed_ms": 0.0,
+                    "cached": True,
+                }
+            else:
+                missing.append(source)
+
+        if missing:
+            missing = await self._route(city, missing, results, deadline)
+
+        if missing:
+            flight_key = (key, tuple(missing))
+            is_follower = self._single_flight.in_flight(flight_key)
+            remaining = self._remaining(deadline, started)
+            fetched = await self._single_flight.do(
+                flight_key, lambda: self._fetch_sources(city, key, missing, remaining)
+            )
+            for source, result in fetched.items():
+                if is_follower:
+                    result = dict(result, cached=True)
+                results[source] = result
+
+        # Keep provider order in the response
+        return {source: results[source] for source in self.providers}
+
+    async def refresh(
+        self, city: str, sources: Optional[List[str]] = None, deadline: Optional[float] = None
+    ) -> Dict[str, Dict]:
+        """
+        Fetch sources for a city ignoring the cache, and cache the results.
+
+        Sources that don't cover the city are skipped.
+
+        Used by the prefetch scheduler to renew cache entries before they
+        expire, so user requests don't have to wait for upstreams.
+
+        Args:
+            city: City name
+            sources: Sources to fetch (default: all providers)
+            deadline: Time budget in seconds (default: self.deadline)
+
+        Returns:
+            Dictionary of source name -> result (status, elapsed_ms, data)
+        """
+        started = time.perf_counter()
+        if deadline is None:
+            deadline = self.deadline
+        sources = [source for source in (sources or self.providers) if source in self.providers]
+        key = normalize_city(city)
+        results: Dict[str, Dict] = {}
+        sources = await self._route(city, sources, results, deadline)
+        if sources:
+            remaining = self._remaining(deadline, started)
+            results.update(
+                await self._single_flight.do(
+                    (key, tuple(sources)),
+                    lambda: self._fetch_sources(city, key, sources, remaining),
+                )
+            )
+        return results
+
+    async def fetch_many(
+        self, cities: Iterable[str], deadline: Optional[float] = None
+    ) -> Dict[str, Union[Dict[str, Dict], BaseException]]:
+        """
+        Get current weather for several cities concurrently.
+
+        Cities are deduplicated (see unique_cities). Sources with a bulk
+        provider are fetched for all cities first (see fetch_bulk). Then
+        each city goes through fetch(), so the cache and request
+        coalescing apply, and each gets what is left of the deadline after
+        the bulk phase once it is let through the concurrency limit. A
+        city that fails doesn't fail the others.
+
+        Args:
+            cities: City names
+            deadline: Time budget in seconds per city, the bulk phase
+                included (default: self.deadline)
+
+        Returns:
+            Dictionary of city -> fetch() results, or the exception raised
+            for that city (also BaseExceptions such as CancelledError)
+        """
+        started = time.perf_counter()
+        if deadline is None:
+            deadline = self.deadline
+        cities = unique_cities(cities)
+        bulk = await self.fetch_bulk(cities, deadline=deadline) if self.bulk_providers else {}
+        remaining = self._remaining(deadline, started)
+
+        async def fetch_limited(city: str) -> Dict[str, Dict]:
+            async with self._batch_limit:
+                return await self.fetch(city, deadline=remaining, prefetched=bulk.get(city))
+
+        results = await asyncio.gather(
+            *(fetch_limited(city) for city in cities), return_exceptions=True
+        )
+        return dict(zip(cities, results))
+
+    async def fetch_bulk(
+        self,
+        cities: List[str],
+        sources: Optional[List[str]] = None,
+        use_cache: bool = True,
+        deadline: Optional[float] = None,
+    ) -> Dict[str, Dict[str, Dict]]:
+        """
+        Fetch the sources that have a bulk provider for many cities at once.
+
+        Per source, cities with a fresh cached result are served from the
+        cache (unless use_cache is False), cities outside the source's
+        coverage are marked skipped, and the rest are fetched with one
+        bulk call and cached. Cities the bulk call had no data for are left
+        out, so fetch() or refresh() can still get them one by one.
+
+        Args:
+            cities: Unique city names
+            sources: Sources to fetch (default: all with a bulk provider)
+            use_cache: Serve fresh cached results instead of fetching them
+            deadline: Time budget in seconds (default: self.deadline)
+
+        Returns:
+            Dictionary of city -> {source name -> result}, usable as
+            fetch(prefetched=...)
+        """
+        started = time.perf_counter()
+        if deadline is None:
+            deadline = self.deadline
+        results: Dict[str, Dict[str, Dict]] = {city: {} for city in cities}
+        sources = [
+            source for source in (sources or self.bulk_providers)
+            if source in self.bulk_providers
+        ]
+
+        async def fetch_source(source: str):
+            wanted = []
+            if use_cache:
+                cached = await asyncio.gather(
+                    *(self.cache.aget((normalize_city(city), source)) for city in cities)
+                )
+            else:
+                cached = [None] * len(cities)
+            for city, data in zip(cities, cached):
+                if data is not None:
+                    results[city][source] = {
+                        "status": STATUS_OK,
+                        "data": data,
+                        "elapsed_ms": 0.0,
+                        "cached": True,
+                    }
+                else:
+                    wanted.append(city)
+
+            routing_budget = self._remaining(deadline, started)
+            routed = await asyncio.gather(
+                *(self._route(city, [source], results[city], routing_budget) for city in wanted)
+            )
+            wanted = [city for city, covered in zip(wanted, routed) if covered]
+            if len(wanted) < 2:
+                # Nothing to gain, fetch() gets a single city as usual
+                return
+
+            bulk_started = time.perf_counter()
+            fetched = await self._run_bulk(source, wanted, self._remaining(deadline, started))
+            elapsed_ms = round((time.perf_counter() - bulk_started) * 1000, 1)
+            ttl = self.ttls.get(source, 0)
+            for city in wanted:
+                data = fetched.get(city)
+                if data:
+                    results[city][source] = {
+                        "status": STATUS_OK,
+                        "data": data,
+                        "elapsed_ms": elapsed_ms,
+                    }
+                    if ttl > 0:
+                        await self.cache.aset((normalize_city(city), source), data, ttl)
+
+        await asyncio.gather(*(fetch_source(source) for source in sources))
+        return results
+
+    async def _run_bulk(
+        self, source: str, cities: List[str], deadline: float
+    ) -> Dict[str, Dict[str, Any]]:
+        """Run one bulk provider call under the deadline; failures give no results."""
+        started = time.perf_counter()
+        status = STATUS_OK
+        try:
+            with PROVIDER_IN_FLIGHT.track(source):
+                fetched = await asyncio.wait_for(self.bulk_providers[source](cities), deadline)
+        except asyncio.TimeoutError:
+            print(f"{source} bulk fetch timed out ({len(cities)} cities)")
+            status, fetched = STATUS_TIMEOUT, {}
+        except Exception as e:
+            print(f"{source} bulk error: {e}")
+            status, fetched = STATUS_ERROR, {}
+
+        if status != STATUS_OK:
+            PROVIDER_ERRORS.inc(source, status)
+        PROVIDER_LATENCY.observe(time.perf_counter() - started, source, status)
+        return fetched
+
+    async def _fetch_sources(
+        self, city: str, key: str, sources: List[str], deadline: Optional[float]
+    ) -> Dict[str, Dict]:
+        """
+        Fetch the given sources concurrently and cache successful results.
+
+        Providers that have not finished when the deadline passes are
+        cancelled and reported with status "timeout".
+        """
+        if deadline is None:
+            deadline = self.deadline
+
+        started = time.perf_counter()
+        tasks = {
+            asyncio.create_task(
+                self._run_provider(source, self.providers[source], city)
+            ): source
+            for source in sources
+        }
+
+        done, pending = await asyncio.wait(tasks.keys(), timeout=deadline)
+
+        for task in pending:
+            task.cancel()
+
+        results = {}
+        for task, source in tasks.items():
+            if task in done:
+                results[source] = task.result()
+            else:
+                elapsed = time.perf_counter() - started
+                PROVIDER_LATENCY.observe(elapsed, source, STATUS_TIMEOUT)
+                PROVIDER_ERRORS.inc(source, STATUS_TIMEOUT)
+                results[source] = {
+                    "status": STATUS_TIMEOUT,
+                    "data": None,
+                    "elapsed_ms": round(elapsed * 1000, 1),
+                }
+
+            ttl = self.ttls.get(source, 0)
+            if results[source]["status"] == STATUS_OK and ttl > 0:
+                await self.cache.aset((key, source), results[source]["data"], ttl)
+            elif results[source]["status"] != STATUS_OK and self.circuit_open(source):
+                stale = await self.cache.aget_stale((key, source), self.stale_max_age)
+                if stale is not None:
+                    results[source] = {
+                        "status": STATUS_OK,
+                        "data": stale,
+                        "elapsed_ms": results[source]["elapsed_ms"],
+                        "cached": True,
+                        "stale": True,
+                    }
+
+        return results
+
+
+def unique_cities(cities: Iterable[str]) -> List[str]:
+    """
+    Drop blank and duplicate city names.
+
+    Cities are compared by normalized name; the first spelling is kept.
+
+    Args:
+        cities: City names
+
+    Returns:
+        Unique city names in request order
+    """
+    unique = {}
+    for city in cities:
+        city = city.strip()
+        if city:
+            unique.setdefault(normalize_city(city), city)
+    return list(unique.values())
+
+
+def fresh_observations(city: str, results: Dict[str, Dict]) -> List[Tuple[str, str, Dict]]:
+    """
+    Observations worth saving from one fetch() result.
+
+    Cached results are left out, they are already in the database.
+
+    Returns:
+        List of (city, source, data)
+    """
+    return [
+        (city, source, result["data"])
+        for source, result in results.items()
+        if result["status"] == STATUS_OK and not result.get("cached")
+    ]
+
+
+def combine_sources(city: str, results: Dict[str, Dict]) -> Dict[str, Any]:
+    """
+    Combine per-source results into the /weather response.
+
+    The first successful source in provider order is used as base data
+    (FMI for Finnish cities), missing fields are filled from the others.
+
+    Args:
+        city: City name
+        results: Output of WeatherAggregator.fetch
+
+    Returns:
+        Response dictionary with city, source, data and per-source status
+    """
+    sources = {
+        source: result["data"]
+        for source, result in results.items()
+        if result["status"] == STATUS_OK
+    }
+    source_status = {
+        source: {
+            key: value for key, value in result.items() if key != "data"
+        }
+        for source, result in results.items()
+    }
+
+    if not sources:
+        return {"error": f"No weather data found for '{city}'", "sources": source_status}
+
+    if len(sources) > 1:
+        # Combine: Use first source as base, fill missing data from the rest
+        names = list(sources)
+        combined_data = sources[names[0]].copy()
+        for field in FILL_FIELDS:
+            for name in names[1:]:
+                if combined_data.get(field) is not None:
+                    break
+                combined_data[field] = sources[name].get(field)
+
+        return {
+            "city": city,
+            "source": " + ".join(SOURCE_NAMES.get(name, name) for name in names),
+            "data": combined_data,
+            "sources": source_status,
+        }
+
+    # Single source available
+    primary_source = next(iter(sources))
+    return {
+        "city": city,
+        "source": primary_source,
+        "data": sources[primary_source],
+        "sources": source_status,
+    }
+
+
+def combine_batch(results: Dict[str, Union[Dict[str, Dict], BaseException]]) -> Dict[str, Any]:
+    """
+    Combine fetch_many() results into the /weather/batch response.
+
+    Args:
+        results: Output of WeatherAggregator.fetch_many
+
+    Returns:
+        Response dictionary with per-city results (each like /weather,
+        or {"error": ...}) and the number of cities without data
+    """
+    cities = {}
+    for city, result in results.items():
+        if isinstance(result, BaseException):
+            # gather() also returns e.g. CancelledError, whose text is empty
+            error = str(result) or type(result).__name__
+            print(f"Batch error for '{city}': {error}")
+            cities[city] = {"error": f"Failed to fetch weather for '{city}': {error}"}
+        else:
+            cities[city] = combine_sources(city, result)
+
+    return {
+        "count": len(cities),
+        "errors": sum(1 for response in cities.values() if "error" in response),
+        "results": cities,
+    }
+
+
+# Providers in order of preference, Foreca only when credentials are set
+providers = {
+    "FMI": lambda city: fmi_service.get_current_weather(place=city),
+    "Yr": yr_service.get_current_weather,
+}
+if foreca_service.enabled:
+    providers["Foreca"] = foreca_service.get_current_weather
+
+# Upstream of each source, for circuit breaker state
+SOURCE_URLS = {
+    "FMI": fmi_service.base_url,
+    "Yr": yr_service.base_url,
+    "Foreca": foreca_service.base_url,
+}
+
+# Single instance for the app
+weather_aggregator = WeatherAggregator(
+    providers=providers,
+    deadline=float(os.getenv("WEATHER_DEADLINE_SECONDS", "10")),
+    # Shared by all workers when STATE_BACKEND is sqlite or redis
+    cache=create_cache("responses", max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))),
+    # FMI publishes 10-minute observations, Yr.no updates its forecast hourly
+    ttls={
+        "FMI": float(os.getenv("FMI_CACHE_TTL", "600")),
+        "Yr": float(os.getenv("YR_CACHE_TTL", "3600")),
+        "Foreca": float(os.getenv("FORECA_CACHE_TTL", "600")),
+    },
+    batch_concurrency=int(os.getenv("BATCH_CONCURRENCY", "8")),
+    circuit_open=lambda source: http_client.circuit_open(SOURCE_URLS[source]),
+    stale_max_age=float(os.getenv("STALE_MAX_AGE", str(6 * 3600))),
+    # FMI only has Finnish stations; the coordinates are cached and reused by Yr.no
+    router=ProviderRouter(
+        geocoder.get_coordinates,
+        regions={"FMI": FINLAND},
+        unknown_places={"FMI": fmi_service.is_unknown_place},
+    ),
+    # FMI answers for many places in one WFS request
+    bulk_providers={"FMI": fmi_service.get_current_weather_many},
+)
+
+
+def _collect_metrics():
+    """Response cache and routing numbers for /metrics."""
+    cache = weather_aggregator.cache
+    lookups = "Response cache lookups by result"
+    yield ("weather_cache_requests_total", "counter", lookups, {"result": "hit"}, cache.hits)
+    yield ("weather_cache_requests_total", "counter", lookups, {"result": "miss"}, cache.misses)
+    # Counting a shared cache is a query or a keyspace scan; not on every scrape
+    if isinstance(cache, TTLCache):
+        yield ("weather_cache_entries", "gauge", "Entries in the response cache", {}, len(cache))
+    if weather_aggregator.router is not None:
+        yield (
+            "weather_provider_skipped_total",
+            "counter",
+            "Provider calls skipped by coverage routing",
+            {},
+            weather_aggregator.router.skipped,
+        )
+
+
+metrics.register_collector(_collect_metrics)
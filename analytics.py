@@ -1,59 +1,124 @@
 """
 Weather data analytics module.
 
-Uses Pandas for data analysis:
 - Temperature trends
 - Source comparisons
 - Simple statistics
+
+Trends, comparisons and hourly averages are computed from the hourly
+rollups (see rollups.py), so their cost grows with the number of hours
+in the window rather than the number of observations. No request path
+builds a DataFrame; get_dataframe is for ad-hoc analysis and loads only
+the columns asked for. pandas is imported on the first get_dataframe
+call, so the API never pays for it unless it is used (or preloaded, see
+warmup.py).
 """
 
-import pandas as pd
-import sqlite3
-from typing import Dict, List
-from datetime import datetime, timedelta
+import time
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence
+
+import rollups
+from cities import normalize_city
+from database import ConnectionPool, since, weather_db
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Columns of weather_data that can be loaded into a DataFrame
+COLUMNS = (
+    "id", "city", "source", "temperature", "humidity", "pressure",
+    "wind_speed", "precipitation", "weather_description", "timestamp",
+)
 
 
 class WeatherAnalytics:
     """Analytics service for weather data."""
 
-    def __init__(self, db_path: str = "weather_data.db"):
+    def __init__(
+        self, db_path: str = "weather_data.db", pool: Optional[ConnectionPool] = None
+    ):
         """
         Initialize analytics service.
 
         Args:
             db_path: Path to SQLite database
+            pool: Connection pool (default: new pool for db_path)
         """
         self.db_path = db_path
-
-    def get_dataframe(self, city: str, hours: int = 168) -> pd.DataFrame:
+        self.pool = pool or ConnectionPool(db_path)
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking analytics method without blocking the event loop."""
+        return await self.pool.run(func, *args, **kwargs)
+
+    def get_dataframe(
+        self,
+        city: str,
+        hours: int = 168,
+        columns: Sequence[str] = ("source", "temperature", "timestamp"),
+    ) -> "pd.DataFrame":
         """
         Load weather data as Pandas DataFrame.
 
         Args:
             city: City name
             hours: Hours of history (default: 168 = 1 week)
+            columns: weather_data columns to load (default: source,
+                temperature and timestamp)
 
         Returns:
-            DataFrame with weather observations
+            DataFrame with weather observations, oldest first
+
+        Raises:
+            ValueError: If a column is not in weather_data
         """
-        conn = sqlite3.connect(self.db_path)
+        import pandas as pd
 
-        query = """
-            SELECT * FROM weather_data
+        unknown = [column for column in columns if column not in COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+        query = f"""
+            SELECT {", ".join(columns)} FROM weather_data
             WHERE city = ?
-            AND timestamp >= datetime('now', '-' || ? || ' hours')
+            AND timestamp >= ?
             ORDER BY timestamp ASC
         """
 
-        df = pd.read_sql_query(query, conn, params=(city, hours))
-        conn.close()
+        with self.pool.connection() as conn:
+            rows = conn.execute(query, (normalize_city(city), since(hours))).fetchall()
+
+        # Build from the row tuples directly; read_sql_query would go
+        # through a second cursor wrapper and per-column type inference
+        df = pd.DataFrame.from_records(rows, columns=list(columns))
 
         # Convert timestamp to datetime
-        if not df.empty:
-            df["timestamp"] = pd.to_datetime(df["timestamp"])
+        if "timestamp" in df:
+            df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
 
         return df
 
+    def get_summaries(self, city: str, hours: int = 24, edges: bool = True) -> Dict[str, Dict]:
+        """
+        Per-source summary of a time window from hourly rollups.
+
+        Full hours come from weather_hourly, only the partial hours at
+        the window edges are read from raw observations.
+
+        Args:
+            city: City name
+            hours: Time period
+            edges: Include first/last temperatures
+
+        Returns:
+            Dictionary of source -> summary (see rollups.summarize)
+        """
+        with self.pool.connection() as conn:
+            return rollups.summarize(
+                conn, normalize_city(city), since(hours), int(time.time()), edges
+            )
+
     def get_temperature_trend(self, city: str, hours: int = 24) -> Dict:
         """
         Calculate temperature trend (warming/cooling).
@@ -65,14 +130,18 @@ class WeatherAnalytics:
         Returns:
             Dictionary with trend information
         """
-        df = self.get_dataframe(city, hours)
+        summaries = self.get_summaries(city, hours).values()
+        observations = sum(summary["count"] for summary in summaries)
 
-        if df.empty or len(df) < 2:
-            return {"trend": "insufficient_data", "change": 0, "observations": len(df)}
+        firsts = [s for s in summaries if s["first_ts"] is not None]
+        lasts = [s for s in summaries if s["last_ts"] is not None]
 
-        # Calculate temperature change (last - first)
-        first_temp = df.iloc[0]["temperature"]
-        last_temp = df.iloc[-1]["temperature"]
+        if observations < 2 or not firsts:
+            return {"trend": "insufficient_data", "change": 0, "observations": observations}
+
+        # Calculate temperature change (last - first) over all sources
+        first_temp = min(firsts, key=lambda s: s["first_ts"])["first_temp"]
+        last_temp = max(lasts, key=lambda s: s["last_ts"])["last_temp"]
         change = round(last_temp - first_temp, 1)
 
         # Determine trend
@@ -88,7 +157,7 @@ class WeatherAnalytics:
             "change": change,
             "first_temperature": first_temp,
             "last_temperature": last_temp,
-            "observations": len(df),
+            "observations": observations,
         }
 
     def compare_sources(self, city: str, hours: int = 24) -> Dict:
@@ -102,22 +171,25 @@ class WeatherAnalytics:
         Returns:
             Dictionary with source comparison
         """
-        df = self.get_dataframe(city, hours)
+        # Grouped by source in SQL; first/last temperatures are not needed
+        summaries = self.get_summaries(city, hours, edges=False)
 
-        if df.empty:
+        if not summaries:
             return {"error": "No data available"}
 
-        # Group by source and calculate statistics
         comparison = {}
 
-        for source in df["source"].unique():
-            source_data = df[df["source"] == source]
-
+        for source, summary in summaries.items():
+            has_temp = summary["temp_count"] > 0
             comparison[source] = {
-                "count": len(source_data),
-                "avg_temperature": round(source_data["temperature"].mean(), 1),
-                "min_temperature": round(source_data["temperature"].min(), 1),
-                "max_temperature": round(source_data["temperature"].max(), 1),
+                "count": summary["count"],
+                "avg_temperature": (
+                    round(summary["temp_sum"] / summary["temp_count"], 1)
+                    if has_temp
+                    else None
+                ),
+                "min_temperature": round(summary["temp_min"], 1) if has_temp else None,
+                "max_temperature": round(summary["temp_max"], 1) if has_temp else None,
             }
 
         return comparison
@@ -131,31 +203,18 @@ class WeatherAnalytics:
             hours: Time period
 
         Returns:
-            List of hourly data points
+            List of hourly data points (hour of day in UTC)
         """
-        df = self.get_dataframe(city, hours)
-
-        if df.empty:
-            return []
-
-        # Extract hour from timestamp
-        df["hour"] = df["timestamp"].dt.hour
-
-        # Group by hour and calculate average
-        hourly = df.groupby("hour")["temperature"].mean().reset_index()
-
-        # Convert to list of dictionaries for API response
-        result = []
-        for _, row in hourly.iterrows():
-            result.append(
-                {
-                    "hour": int(row["hour"]),
-                    "avg_temperature": round(row["temperature"], 1),
-                }
+        with self.pool.connection() as conn:
+            hourly = rollups.hour_of_day_averages(
+                conn, normalize_city(city), since(hours), int(time.time())
             )
 
-        return result
+        return [
+            {"hour": hour, "avg_temperature": round(avg_temperature, 1)}
+            for hour, avg_temperature in hourly
+        ]
 
 
-# Single instance for the app
-analytics = WeatherAnalytics()
+# Single instance for the app, sharing the database connection pool
+analytics = WeatherAnalytics(db_path=weather_db.db_path, pool=weather_db.pool)
@@ -0,0 +1,103 @@
+"""
+Micro-benchmark: history, statistics and WeatherAnalytics queries.
+
+Seeds a temporary database with synthetic observations (every 10
+minutes from two sources, through save_observations so the hourly
+rollups are filled too) and times the queries behind /weather/history,
+/weather/stats, /weather/trend, /weather/compare and /weather/hourly,
+plus get_dataframe when pandas is installed.
+
+Run from the repository root:
+    python -m benchmarks.bench_analytics
+    python -m benchmarks.bench_analytics --days 30 --output analytics.json
+    python -m benchmarks.bench_analytics --baseline analytics.json
+"""
+
+import argparse
+import importlib.util
+import os
+import tempfile
+from typing import Dict
+
+from analytics import WeatherAnalytics
+from benchmarks import report
+from benchmarks.fixtures import bench_cities, observations
+from database import ConnectionPool, WeatherDatabase
+
+COLUMNS = ("mean_ms", "p50_ms", "p95_ms", "p99_ms")
+
+
+def seed(db: WeatherDatabase, cities: int, days: float, chunk_size: int = 5000) -> int:
+    """Fill the database with synthetic observations; returns rows written."""
+    written = 0
+    chunk = []
+    for observation in observations(bench_cities(cities), hours=days * 24):
+        chunk.append(observation)
+        if len(chunk) >= chunk_size:
+            written += db.save_observations(chunk)
+            chunk = []
+    if chunk:
+        written += db.save_observations(chunk)
+    return written
+
+
+def run(db_path: str, cities: int = 10, days: float = 7, repeat: int = 50) -> Dict[str, Dict[str, float]]:
+    """
+    Seed a database and run all cases.
+
+    Args:
+        db_path: New database file
+        cities: Cities seeded
+        days: Days of history per city
+        repeat: Timed calls per case
+
+    Returns:
+        Case name -> timing summary
+    """
+    db = WeatherDatabase(pool=ConnectionPool(db_path))
+    analytics = WeatherAnalytics(db_path=db_path, pool=db.pool)
+    rows = seed(db, cities, days)
+    print(f"Seeded {rows} observations ({cities} cities, {days:g} days)")
+
+    city = bench_cities(1)[0]
+    hours = int(days * 24)
+    cases = {
+        "get_history 24 h": lambda: db.get_history(city, 24),
+        "get_history_page 500": lambda: db.get_history_page(city, hours, 500),
+        f"get_statistics {hours} h": lambda: db.get_statistics(city, hours),
+        f"get_summaries {hours} h": lambda: analytics.get_summaries(city, hours),
+        f"get_temperature_trend {hours} h": lambda: analytics.get_temperature_trend(city, hours),
+        f"compare_sources {hours} h": lambda: analytics.compare_sources(city, hours),
+        f"get_hourly_averages {hours} h": lambda: analytics.get_hourly_averages(city, hours),
+    }
+    if importlib.util.find_spec("pandas") is not None:
+        cases[f"get_dataframe {hours} h"] = lambda: analytics.get_dataframe(city, hours)
+
+    try:
+        return {name: report.time_calls(func, repeat) for name, func in cases.items()}
+    finally:
+        db.pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="History and analytics query benchmark")
+    parser.add_argument("--cities", type=int, default=10, help="Cities seeded")
+    parser.add_argument("--days", type=float, default=7, help="Days of history per city")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed calls per case")
+    parser.add_argument("--output", help="Save results as JSON")
+    parser.add_argument("--baseline", help="Compare against saved results")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="weather-bench-") as data_dir:
+        results = run(os.path.join(data_dir, "weather_data.db"), args.cities, args.days, args.repeat)
+
+    report.print_table(results, COLUMNS)
+    settings = {"cities": args.cities, "days": args.days, "repeat": args.repeat}
+    if args.output:
+        report.save(args.output, "analytics", results, settings)
+    if args.baseline:
+        report.compare(args.baseline, results, COLUMNS)
+
+
+if __name__ == "__main__":
+    main()
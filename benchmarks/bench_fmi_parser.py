@@ -0,0 +1,114 @@
+"""
+Micro-benchmark: FMI WFS parsing.
+
+Compares the old full-document parse (xmltodict.parse + walking every
+wfs:member) against the streaming FMIObservationParser, both on FMI's
+default 12-hour, all-parameter response and on the narrow query
+(1 hour, only the parameters we use) that FMIService now sends.
+
+Run from the repository root:
+    python -m benchmarks.bench_fmi_parser
+    python -m benchmarks.bench_fmi_parser --output fmi.json    # Save a baseline
+    python -m benchmarks.bench_fmi_parser --baseline fmi.json  # Compare against it
+"""
+
+import argparse
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+from benchmarks import report
+from benchmarks.fixtures import fmi_simple_xml
+from services.fmi import PARAMETERS, FMIObservationParser
+
+try:
+    import xmltodict
+except ImportError:  # Only needed for the baseline
+    xmltodict = None
+
+CHUNK_SIZE = 64 * 1024
+
+COLUMNS = ("mean_ms", "peak_kib")
+
+
+def parse_xmltodict(body: bytes) -> Dict[str, str]:
+    """Old implementation: build the whole dict tree, keep last values."""
+    data = xmltodict.parse(body)
+    members = data.get("wfs:FeatureCollection", {}).get("wfs:member", [])
+    latest_data = {}
+    for member in members:
+        element = member.get("BsWfs:BsWfsElement", {})
+        param_name = element.get("BsWfs:ParameterName")
+        param_value = element.get("BsWfs:ParameterValue")
+        if param_value and param_value != "NaN":
+            latest_data[param_name] = param_value
+    return latest_data
+
+
+def parse_streaming(body: bytes) -> Dict[str, str]:
+    """New implementation: feed the body in network-sized chunks."""
+    parser = FMIObservationParser()
+    for start in range(0, len(body), CHUNK_SIZE):
+        parser.feed(body[start:start + CHUNK_SIZE])
+    return parser.close()
+
+
+def measure(func: Callable[[bytes], Dict], body: bytes, repeat: int) -> Dict[str, float]:
+    """
+    Measure mean time and peak traced memory of one parse.
+
+    Returns:
+        Dictionary with mean_ms and peak_kib
+    """
+    func(body)  # Warm-up
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(body)
+    mean_ms = (time.perf_counter() - started) / repeat * 1000
+
+    tracemalloc.start()
+    func(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"mean_ms": round(mean_ms, 3), "peak_kib": round(peak / 1024, 1)}
+
+
+def run(repeat: int = 20) -> Dict[str, Dict[str, float]]:
+    """
+    Run all cases.
+
+    Returns:
+        Case name -> measurement
+    """
+    default_body = fmi_simple_xml(hours=12)
+    narrow_body = fmi_simple_xml(hours=1, parameters=PARAMETERS)
+
+    results = {}
+    if xmltodict is not None:
+        results["xmltodict, default query"] = measure(parse_xmltodict, default_body, repeat)
+    results["streaming, default query"] = measure(parse_streaming, default_body, repeat)
+    results["streaming, narrow query"] = measure(parse_streaming, narrow_body, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FMI parsing benchmark")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed parses per case")
+    parser.add_argument("--output", help="Save results as JSON")
+    parser.add_argument("--baseline", help="Compare against saved results")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    report.print_table(results, COLUMNS)
+    if xmltodict is None:
+        print("(install xmltodict to include the old baseline)")
+    if args.output:
+        report.save(args.output, "fmi_parser", results, {"repeat": args.repeat})
+    if args.baseline:
+        report.compare(args.baseline, results, COLUMNS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: Yr.no forecast parsing and slicing.
+
+Times decoding a locationforecast document, building the columnar
+ForecastSeries from it, and the two reads served from the series:
+current weather (the step covering now) and a /weather/forecast window.
+
+Run from the repository root:
+    python -m benchmarks.bench_yr_parser
+    python -m benchmarks.bench_yr_parser --output yr.json    # Save a baseline
+    python -m benchmarks.bench_yr_parser --baseline yr.json  # Compare against it
+"""
+
+import argparse
+import json
+import time
+from typing import Dict
+
+from benchmarks import report
+from benchmarks.fixtures import yr_compact_json
+from forecast import ForecastSeries
+from services.yr import YrService
+
+COLUMNS = ("mean_ms", "p50_ms", "p95_ms", "p99_ms")
+
+
+def run(repeat: int = 200) -> Dict[str, Dict[str, float]]:
+    """
+    Run all cases.
+
+    Returns:
+        Case name -> timing summary
+    """
+    body = json.dumps(yr_compact_json()).encode()
+    data = json.loads(body)
+    series = ForecastSeries.from_yr(data)
+    service = YrService()
+    now = time.time()
+
+    return {
+        "json decode": report.time_calls(lambda: json.loads(body), repeat),
+        "ForecastSeries.from_yr": report.time_calls(lambda: ForecastSeries.from_yr(data), repeat),
+        "decode + from_yr": report.time_calls(
+            lambda: ForecastSeries.from_yr(json.loads(body)), repeat
+        ),
+        "current weather": report.time_calls(lambda: service._current_weather(series), repeat),
+        "window 48 h": report.time_calls(lambda: series.window(now, 48), repeat),
+        "window 240 h": report.time_calls(lambda: series.window(now, 240), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Yr.no parsing benchmark")
+    parser.add_argument("--repeat", type=int, default=200, help="Timed calls per case")
+    parser.add_argument("--output", help="Save results as JSON")
+    parser.add_argument("--baseline", help="Compare against saved results")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    report.print_table(results, COLUMNS)
+    if args.output:
+        report.save(args.output, "yr_parser", results, {"repeat": args.repeat})
+    if args.baseline:
+        report.compare(args.baseline, results, COLUMNS)
+
+
+if __name__ == "__main__":
+    main()
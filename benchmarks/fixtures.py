@@ -0,0 +1,223 @@
+"""
+Synthetic upstream payloads for benchmarks.
+
+Generates documents with the same structure as the real FMI WFS
+"simple" and Yr.no locationforecast responses, city names with stable
+coordinates for the mock geocoder, and stored observations for the
+history and analytics benchmarks.
+"""
+
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Parameters returned by FMI's default fmi::observations::weather::simple query
+FMI_DEFAULT_PARAMETERS = (
+    "t2m", "ws_10min", "wg_10min", "wd_10min", "rh", "td", "r_1h",
+    "ri_10min", "snow_aws", "p_sea", "vis", "n_man", "wawa",
+)
+
+FMI_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<wfs:FeatureCollection timeStamp="{now}" numberMatched="{count}" '
+    'numberReturned="{count}" '
+    'xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink" '
+    'xmlns:gml="http://www.opengis.net/gml/3.2" '
+    'xmlns:BsWfs="http://xml.fmi.fi/schema/wfs/2.0">\n'
+)
+
+FMI_MEMBER = (
+    "  <wfs:member>\n"
+    '    <BsWfs:BsWfsElement gml:id="BsWfsElement.1.{index}">\n'
+    "      <BsWfs:Location>\n"
+    '        <gml:Point gml:id="BsWfsElementP.1.{index}" srsDimension="2" '
+    'srsName="http://www.opengis.net/def/crs/EPSG/0/4258">\n'
+    "          <gml:pos>{lat:.5f} {lon:.5f} </gml:pos>\n"
+    "        </gml:Point>\n"
+    "      </BsWfs:Location>\n"
+    "      <BsWfs:Time>{time}</BsWfs:Time>\n"
+    "      <BsWfs:ParameterName>{name}</BsWfs:ParameterName>\n"
+    "      <BsWfs:ParameterValue>{value}</BsWfs:ParameterValue>\n"
+    "    </BsWfs:BsWfsElement>\n"
+    "  </wfs:member>\n"
+)
+
+# Station coordinates used when several places are requested
+FMI_STATIONS = [
+    (60.17523, 24.94459),  # Helsinki
+    (61.49911, 23.78712),  # Tampere
+    (65.01236, 25.46816),  # Oulu
+    (60.45148, 22.26869),  # Turku
+    (62.24147, 25.72088),  # Jyväskylä
+]
+
+# Cities at the stations above, in the same order
+FMI_CITIES = ("Helsinki", "Tampere", "Oulu", "Turku", "Jyväskylä")
+
+
+def bench_cities(count: int) -> List[str]:
+    """
+    City names for load tests: the FMI station cities, then "Town N".
+
+    Even-numbered towns are in Finland (FMI and Yr.no), odd ones elsewhere
+    in Europe (Yr.no only), see city_coordinates().
+    """
+    cities = list(FMI_CITIES[:count])
+    cities.extend(f"Town {n}" for n in range(1, count - len(cities) + 1))
+    return cities
+
+
+def city_coordinates(city: str) -> Tuple[float, float]:
+    """
+    Stable (lat, lon) for a city name.
+
+    Station cities get their station's coordinates; other names get a
+    point derived from the name's checksum.
+    """
+    if city in FMI_CITIES:
+        return FMI_STATIONS[FMI_CITIES.index(city)]
+    checksum = zlib.crc32(city.encode())
+    fraction_lat = (checksum & 0xFFFF) / 0xFFFF
+    fraction_lon = (checksum >> 16) / 0xFFFF
+    number = city.rsplit(" ", 1)[-1]
+    if number.isdigit() and int(number) % 2 == 0:
+        # Inland Finland
+        return (round(61.0 + 2.5 * fraction_lat, 5), round(24.0 + 4.0 * fraction_lon, 5))
+    # Central Europe
+    return (round(46.0 + 8.0 * fraction_lat, 5), round(2.0 + 16.0 * fraction_lon, 5))
+
+
+def fmi_simple_xml(
+    hours: float = 12,
+    parameters: Sequence[str] = FMI_DEFAULT_PARAMETERS,
+    step_minutes: int = 10,
+    stations: int = 1,
+    positions: Optional[Sequence[Tuple[float, float]]] = None,
+) -> bytes:
+    """
+    Build an FMI WFS simple observation document.
+
+    Args:
+        hours: Length of the time window
+        parameters: Parameters included for every time step
+        step_minutes: Time step between observations
+        stations: Number of stations (members are grouped per station)
+        positions: Station coordinates (default: FMI_STATIONS, repeated
+            with an offset when there are more stations)
+
+    Returns:
+        XML document as bytes
+    """
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    steps = int(hours * 60 / step_minutes)
+    members: List[str] = []
+
+    if positions is None:
+        positions = []
+        for station in range(stations):
+            lat, lon = FMI_STATIONS[station % len(FMI_STATIONS)]
+            positions.append((lat + station // len(FMI_STATIONS) * 0.01, lon))
+
+    for lat, lon in positions:
+        for step in range(steps):
+            time = now - timedelta(minutes=(steps - step - 1) * step_minutes)
+            for p, name in enumerate(parameters):
+                value = "NaN" if (step + p) % 17 == 0 else f"{(step + p) % 30 - 5:.1f}"
+                members.append(
+                    FMI_MEMBER.format(
+                        index=len(members) + 1,
+                        lat=lat,
+                        lon=lon,
+                        time=time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                        name=name,
+                        value=value,
+                    )
+                )
+
+    header = FMI_HEADER.format(
+        now=now.strftime("%Y-%m-%dT%H:%M:%SZ"), count=len(members)
+    )
+    return (header + "".join(members) + "</wfs:FeatureCollection>\n").encode()
+
+
+def yr_compact_json(hours: int = 216) -> Dict:
+    """
+    Build a Yr.no locationforecast/2.0/compact document.
+
+    Args:
+        hours: Number of forecast time steps
+
+    Returns:
+        Document as a dictionary (serialize with json.dumps)
+    """
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    timeseries = []
+    for hour in range(hours):
+        time = now + timedelta(hours=hour)
+        timeseries.append(
+            {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "data": {
+                    "instant": {
+                        "details": {
+                            "air_pressure_at_sea_level": 1010.0 + hour % 10,
+                            "air_temperature": round(5 + (hour % 24) / 3, 1),
+                            "cloud_area_fraction": 50.0,
+                            "relative_humidity": 70.0 + hour % 20,
+                            "wind_from_direction": 180.0,
+                            "wind_speed": 3.0 + hour % 5,
+                        }
+                    },
+                    "next_1_hours": {
+                        "summary": {"symbol_code": "cloudy"},
+                        "details": {"precipitation_amount": 0.1 * (hour % 3)},
+                    },
+                },
+            }
+        )
+
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [25.47, 65.01, 10]},
+        "properties": {
+            "meta": {"updated_at": now.strftime("%Y-%m-%dT%H:%M:%SZ")},
+            "timeseries": timeseries,
+        },
+    }
+
+
+def observations(
+    cities: Sequence[str],
+    sources: Sequence[str] = ("FMI", "Yr"),
+    hours: float = 168,
+    step_minutes: int = 10,
+) -> Iterator[Tuple[str, str, Dict, int]]:
+    """
+    Generate stored observations ending now, oldest first.
+
+    Yields:
+        (city, source, weather_data, timestamp) tuples, as taken by
+        WeatherDatabase.save_observations
+    """
+    now = int(datetime.now(timezone.utc).timestamp())
+    steps = int(hours * 60 / step_minutes)
+    for step in range(steps):
+        timestamp = now - (steps - step - 1) * step_minutes * 60
+        for c, city in enumerate(cities):
+            for s, source in enumerate(sources):
+                hour = timestamp // 3600
+                yield (
+                    city,
+                    source,
+                    {
+                        "temperature": round((hour + c) % 24 / 2 - 3 + s * 0.4, 1),
+                        "humidity": 60 + (step + c) % 30,
+                        "pressure": 1000.0 + (hour + s) % 25,
+                        "wind_speed": round((step + c) % 12 * 0.7, 1),
+                        "precipitation": 0.1 * ((step + s) % 4),
+                        "weather": "cloudy or partly cloudy",
+                    },
+                    timestamp,
+                )
@@ -0,0 +1,298 @@
+"""
+Load test of the API against mock upstreams.
+
+Starts the mock upstream server (mock_upstreams.py) and the app
+(serve_app.py, in a temporary directory with seeded history), then runs
+each scenario for a fixed time with a fixed number of concurrent clients.
+Every client sends its next request as soon as the previous one is
+answered. Reports throughput, errors and p50/p95/p99 latency per
+scenario and per endpoint, plus how many upstream requests the scenario
+caused.
+
+Run from the repository root:
+    python -m benchmarks.load                                # All scenarios
+    python -m benchmarks.load --scenario current --concurrency 50
+    python -m benchmarks.load --latency fmi=300 --failure-rate yr=0.05
+    python -m benchmarks.load --output baseline.json         # Save a baseline
+    python -m benchmarks.load --baseline baseline.json       # Compare against it
+    python -m benchmarks.load --app-url http://127.0.0.1:8000  # Already running app
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from benchmarks import report
+from benchmarks.fixtures import bench_cities
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (endpoint name, path template, weight, reads seeded history)
+Endpoint = Tuple[str, str, int, bool]
+
+ENDPOINTS: Dict[str, Endpoint] = {
+    "weather": ("weather", "/weather?city={city}", 1, False),
+    "forecast": ("forecast", "/weather/forecast/{city}?hours=48", 1, False),
+    "history": ("history", "/weather/history/{city}?hours=24", 1, True),
+    "history_page": ("history_page", "/weather/history/{city}?hours=168&limit=500", 1, True),
+    "stats": ("stats", "/weather/stats/{city}?hours=168", 1, True),
+    "trend": ("trend", "/weather/trend/{city}?hours=168", 1, True),
+    "compare": ("compare", "/weather/compare/{city}?hours=168", 1, True),
+    "hourly": ("hourly", "/weather/hourly/{city}?hours=168", 1, True),
+}
+
+SCENARIOS: Dict[str, List[Endpoint]] = {
+    "current": [ENDPOINTS["weather"]],
+    "forecast": [ENDPOINTS["forecast"]],
+    "history": [ENDPOINTS["history"], ENDPOINTS["history_page"]],
+    "stats": [ENDPOINTS["stats"]],
+    "analytics": [ENDPOINTS["trend"], ENDPOINTS["compare"], ENDPOINTS["hourly"]],
+    # Roughly what the frontend sends: current weather first, charts after
+    "mixed": [
+        ("weather", ENDPOINTS["weather"][1], 6, False),
+        ("forecast", ENDPOINTS["forecast"][1], 2, False),
+        ("history", ENDPOINTS["history"][1], 1, True),
+        ("stats", ENDPOINTS["stats"][1], 1, True),
+        ("trend", ENDPOINTS["trend"][1], 1, True),
+        ("hourly", ENDPOINTS["hourly"][1], 1, True),
+    ],
+}
+
+COLUMNS = ("count", "rps", "errors", "p50_ms", "p95_ms", "p99_ms", "upstream")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(url: str, timeout: float = 60.0):
+    """Poll a URL until it answers."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} did not start in {timeout:.0f} s")
+                await asyncio.sleep(0.2)
+
+
+async def upstream_calls(client: httpx.AsyncClient, mock_url: Optional[str]) -> int:
+    """Requests the mock upstreams have answered so far (0 without a mock)."""
+    if mock_url is None:
+        return 0
+    stats = (await client.get(f"{mock_url}/stats")).json()
+    return sum(stats["served"].values()) + sum(stats["failed"].values())
+
+
+async def run_scenario(
+    app_url: str,
+    endpoints: Sequence[Endpoint],
+    cities: Sequence[str],
+    seeded_cities: Sequence[str],
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    seed: int,
+    mock_url: Optional[str] = None,
+) -> Dict[str, Dict]:
+    """
+    Run one scenario.
+
+    Args:
+        app_url: Base URL of the app
+        endpoints: Endpoints to call, picked at random by weight
+        cities: Cities for current weather and forecasts
+        seeded_cities: Cities with stored history
+        concurrency: Clients sending requests at once
+        duration: Measured seconds
+        warmup: Seconds of unmeasured requests first
+        seed: Random seed (same seed, same request sequence per client)
+        mock_url: Mock upstream server, for counting upstream requests
+
+    Returns:
+        "all" and each endpoint name -> summary with rps and errors
+    """
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    weights = [endpoint[2] for endpoint in endpoints]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=30.0) as client:
+        started = time.monotonic()
+        measure_from = started + warmup
+        end = measure_from + duration
+        upstream_before = None
+
+        async def client_loop(number: int):
+            rng = random.Random(seed * 1000 + number)
+            while True:
+                name, template, _, seeded = rng.choices(endpoints, weights)[0]
+                city = rng.choice(seeded_cities if seeded else cities)
+                sent = time.monotonic()
+                if sent >= end:
+                    return
+                try:
+                    response = await client.get(template.format(city=city))
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                if sent < measure_from:
+                    continue
+                latencies[name].append(time.monotonic() - sent)
+                if failed:
+                    errors[name] += 1
+
+        async def count_upstream():
+            nonlocal upstream_before
+            await asyncio.sleep(warmup)
+            upstream_before = await upstream_calls(client, mock_url)
+
+        await asyncio.gather(count_upstream(), *(client_loop(n) for n in range(concurrency)))
+        upstream = await upstream_calls(client, mock_url) - (upstream_before or 0)
+
+    results = {}
+    all_latencies = [value for values in latencies.values() for value in values]
+    for name, values in [("all", all_latencies)] + sorted(latencies.items()):
+        summary = report.summarize_ms(values)
+        summary["rps"] = round(len(values) / duration, 1)
+        summary["errors"] = sum(errors.values()) if name == "all" else errors[name]
+        results[name] = summary
+    results["all"]["upstream"] = upstream
+    return results
+
+
+def start_servers(args, data_dir: str) -> Tuple[List[subprocess.Popen], str, str]:
+    """
+    Start the mock upstreams and the app.
+
+    Returns:
+        Processes, app URL and mock URL
+    """
+    mock_port, app_port = free_port(), free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    mock = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.mock_upstreams",
+            "--port", str(mock_port),
+            "--latency", args.latency,
+            "--jitter", args.jitter,
+            "--failure-rate", args.failure_rate,
+        ],
+        cwd=REPO_ROOT,
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    env.setdefault("GEOCODE_RATE", str(args.geocode_rate))
+    app = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.serve_app",
+            "--port", str(app_port),
+            "--upstream", mock_url,
+            "--seed-cities", str(args.seed_cities),
+            "--seed-hours", str(args.seed_hours),
+        ],
+        cwd=data_dir,
+        env=env,
+    )
+    return [app, mock], app_url, mock_url
+
+
+async def run(args) -> Dict[str, Dict]:
+    """Run the selected scenarios, starting the servers unless --app-url is given."""
+    processes: List[subprocess.Popen] = []
+    data_dir = tempfile.TemporaryDirectory(prefix="weather-bench-")
+    mock_url = None
+    try:
+        if args.app_url:
+            app_url = args.app_url.rstrip("/")
+        else:
+            processes, app_url, mock_url = start_servers(args, data_dir.name)
+            await wait_ready(f"{mock_url}/stats")
+        await wait_ready(f"{app_url}/metrics")
+
+        cities = bench_cities(args.cities)
+        seeded_cities = bench_cities(args.seed_cities)
+        results = {}
+        for name in args.scenario:
+            print(f"Running '{name}' ({args.concurrency} clients, {args.duration:.0f} s)...")
+            scenario = await run_scenario(
+                app_url,
+                SCENARIOS[name],
+                cities,
+                seeded_cities,
+                args.concurrency,
+                args.duration,
+                args.warmup,
+                args.seed,
+                mock_url,
+            )
+            results[name] = scenario.pop("all")
+            if len(scenario) > 1:
+                for endpoint, summary in scenario.items():
+                    results[f"{name} / {endpoint}"] = summary
+        return results
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        data_dir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test against mock upstreams")
+    parser.add_argument(
+        "--scenario", action="append", choices=list(SCENARIOS),
+        help="Scenario to run (repeatable, default: all)",
+    )
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="Unmeasured seconds first")
+    parser.add_argument("--cities", type=int, default=50, help="Cities asked for current weather")
+    parser.add_argument("--seed-cities", type=int, default=10, help="Cities with seeded history")
+    parser.add_argument("--seed-hours", type=float, default=168, help="Hours of seeded history")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the request mix")
+    parser.add_argument("--latency", default="fmi=80,yr=120,nominatim=200", help="Mock delay in ms")
+    parser.add_argument("--jitter", default="20", help="Mock delay standard deviation in ms")
+    parser.add_argument("--failure-rate", default="0", help="Share of mock 503 responses")
+    parser.add_argument("--geocode-rate", type=float, default=50, help="Nominatim requests per second")
+    parser.add_argument("--app-url", help="Test an already running app instead")
+    parser.add_argument("--output", help="Save results as JSON")
+    parser.add_argument("--baseline", help="Compare against saved results")
+    args = parser.parse_args()
+    args.scenario = args.scenario or list(SCENARIOS)
+
+    results = asyncio.run(run(args))
+    report.print_table(results, COLUMNS)
+
+    settings = {
+        key: value for key, value in vars(args).items() if key not in ("output", "baseline")
+    }
+    if args.output:
+        report.save(args.output, "load", results, settings)
+    if args.baseline:
+        report.compare(args.baseline, results, ("rps", "p50_ms", "p95_ms", "p99_ms"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Local mock of the upstream APIs for load tests.
+
+One HTTP server answers like the three upstreams the app calls:
+
+- /fmi/wfs                 FMI WFS simple observations (one station per place)
+- /yr/compact              Yr.no locationforecast/2.0/compact, with Expires,
+                           Last-Modified and 304 on If-Modified-Since
+- /nominatim/search        Nominatim search (coordinates from fixtures.city_coordinates)
+
+Each upstream has a configurable latency (mean and jitter, in ms) and
+failure rate (share of requests answered with 503). Requests served per
+upstream are counted at /stats, so a load test can report how many
+upstream calls its requests caused.
+
+Run from the repository root:
+    python -m benchmarks.mock_upstreams --port 8801 --latency fmi=80,yr=120,nominatim=200
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from email.utils import formatdate
+from typing import Dict, Tuple
+
+from fastapi import FastAPI, Request, Response
+
+from benchmarks.fixtures import city_coordinates, fmi_simple_xml, yr_compact_json
+
+UPSTREAMS = ("fmi", "yr", "nominatim")
+
+# Parameters FMIService asks for (kept here so the mock doesn't import the app)
+FMI_PARAMETERS = ("t2m", "ws_10min", "rh", "p_sea", "ri_10min")
+
+
+class UpstreamBehavior:
+    """Latency and failure rate of one mocked upstream."""
+
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 10.0, failure_rate: float = 0.0):
+        """
+        Args:
+            latency_ms: Mean response delay
+            jitter_ms: Standard deviation of the delay
+            failure_rate: Share of requests answered with 503
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+
+    async def delay(self):
+        """Wait for one response delay."""
+        delay_ms = max(0.0, random.gauss(self.latency_ms, self.jitter_ms))
+        await asyncio.sleep(delay_ms / 1000)
+
+    def fails(self) -> bool:
+        return random.random() < self.failure_rate
+
+
+def parse_values(text: str) -> Dict[str, float]:
+    """
+    Parse "upstream=value,...". A bare value applies to every upstream.
+
+    Raises:
+        ValueError: If an entry is malformed or names an unknown upstream
+    """
+    values = {}
+    for entry in text.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if "=" not in entry:
+            values.update({upstream: float(entry) for upstream in UPSTREAMS})
+            continue
+        name, value = entry.split("=")
+        if name.strip() not in UPSTREAMS:
+            raise ValueError(f"Unknown upstream '{name}' (expected one of {', '.join(UPSTREAMS)})")
+        values[name.strip()] = float(value)
+    return values
+
+
+def create_app(behaviors: Dict[str, UpstreamBehavior], yr_expires: float = 1800) -> FastAPI:
+    """
+    Build the mock server.
+
+    Args:
+        behaviors: Upstream name -> behavior
+        yr_expires: Seconds until a Yr.no document expires
+    """
+    app = FastAPI(title="Mock upstreams")
+    served: Counter = Counter()
+    failed: Counter = Counter()
+
+    # Documents are generated once and reused: building them is not what
+    # a load test should measure
+    fmi_documents: Dict[Tuple[str, ...], bytes] = {}
+    yr_document = json.dumps(yr_compact_json()).encode()
+    yr_last_modified = formatdate(time.time(), usegmt=True)
+
+    async def respond(upstream: str) -> bool:
+        """Delay like the upstream; False if this request should fail."""
+        behavior = behaviors[upstream]
+        await behavior.delay()
+        if behavior.fails():
+            failed[upstream] += 1
+            return False
+        served[upstream] += 1
+        return True
+
+    @app.get("/fmi/wfs")
+    async def fmi_wfs(request: Request):
+        if not await respond("fmi"):
+            return Response(status_code=503)
+        places = tuple(request.query_params.getlist("place"))
+        if places not in fmi_documents:
+            fmi_documents[places] = fmi_simple_xml(
+                hours=1,
+                parameters=FMI_PARAMETERS,
+                positions=[city_coordinates(place) for place in places],
+            )
+        return Response(fmi_documents[places], media_type="application/xml")
+
+    @app.get("/yr/compact")
+    async def yr_compact(request: Request):
+        if not await respond("yr"):
+            return Response(status_code=503)
+        headers = {
+            "Expires": formatdate(time.time() + yr_expires, usegmt=True),
+            "Last-Modified": yr_last_modified,
+        }
+        if request.headers.get("If-Modified-Since") == yr_last_modified:
+            return Response(status_code=304, headers=headers)
+        return Response(yr_document, media_type="application/json", headers=headers)
+
+    @app.get("/nominatim/search")
+    async def nominatim_search(q: str):
+        if not await respond("nominatim"):
+            return Response(status_code=503)
+        lat, lon = city_coordinates(q)
+        return [
+            {
+                "place_id": zlib.crc32(q.encode()),
+                "lat": str(lat),
+                "lon": str(lon),
+                "display_name": q,
+                "class": "place",
+                "type": "city",
+                "importance": 0.5,
+            }
+        ]
+
+    @app.get("/stats")
+    async def stats():
+        return {"served": dict(served), "failed": dict(failed)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock FMI, Yr.no and Nominatim servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8801)
+    parser.add_argument("--latency", default="fmi=80,yr=120,nominatim=200", help="Mean delay in ms")
+    parser.add_argument("--jitter", default="20", help="Delay standard deviation in ms")
+    parser.add_argument("--failure-rate", default="0", help="Share of 503 responses")
+    parser.add_argument("--yr-expires", type=float, default=1800, help="Yr.no Expires in seconds")
+    args = parser.parse_args()
+
+    latency = parse_values(args.latency)
+    jitter = parse_values(args.jitter)
+    failure_rate = parse_values(args.failure_rate)
+    behaviors = {
+        upstream: UpstreamBehavior(
+            latency.get(upstream, 50.0), jitter.get(upstream, 10.0), failure_rate.get(upstream, 0.0)
+        )
+        for upstream in UPSTREAMS
+    }
+
+    import uvicorn
+
+    uvicorn.run(
+        create_app(behaviors, args.yr_expires), host=args.host, port=args.port, log_level="warning"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Result helpers shared by the benchmarks.
+
+Latencies are summarized as p50/p95/p99 (nearest-rank percentiles) and
+results are saved as JSON, so a run can be kept as a baseline and later
+runs compared against it:
+
+    python -m benchmarks.load --output before.json
+    ... change something ...
+    python -m benchmarks.load --baseline before.json
+"""
+
+import json
+import math
+import platform
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values: Sequence[float], p: float) -> float:
+    """Nearest-rank percentile of already sorted values (0 if empty)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize_ms(seconds: List[float]) -> Dict[str, float]:
+    """
+    Summarize durations.
+
+    Args:
+        seconds: Durations in seconds
+
+    Returns:
+        Dictionary with count, mean_ms, p50_ms, p95_ms, p99_ms and max_ms
+    """
+    values = sorted(seconds)
+    summary = {"count": len(values)}
+    summary["mean_ms"] = round(sum(values) / len(values) * 1000, 3) if values else 0.0
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(percentile(values, p) * 1000, 3)
+    summary["max_ms"] = round(values[-1] * 1000, 3) if values else 0.0
+    return summary
+
+
+def time_calls(func: Callable[[], object], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """
+    Time a function call by call.
+
+    Args:
+        func: Function called without arguments
+        repeat: Timed calls
+        warmup: Untimed calls first
+
+    Returns:
+        summarize_ms() of the timed calls
+    """
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return summarize_ms(durations)
+
+
+def print_table(results: Dict[str, Dict[str, float]], columns: Sequence[str]):
+    """Print case name and the given columns of each result."""
+    width = max([len("case")] + [len(case) for case in results])
+    print(f"{'case':<{width}} " + " ".join(f"{column:>10}" for column in columns))
+    for case, result in results.items():
+        print(f"{case:<{width}} " + " ".join(f"{result.get(column, ''):>10}" for column in columns))
+
+
+def save(path: str, name: str, results: Dict, settings: Optional[Dict] = None):
+    """
+    Save results as a JSON baseline.
+
+    Args:
+        path: Output file
+        name: Benchmark name
+        results: Case name -> measurements
+        settings: Parameters of the run (concurrency, latency...)
+    """
+    document = {
+        "benchmark": name,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "settings": settings or {},
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+    print(f"Saved results to {path}")
+
+
+def compare(path: str, results: Dict[str, Dict[str, float]], columns: Sequence[str]):
+    """
+    Print the change of each column against a saved baseline.
+
+    Negative changes of *_ms columns are improvements; for throughput
+    (rps) positive changes are.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get("settings"):
+        print(f"Baseline {path} ({baseline.get('created')}), settings {baseline['settings']}")
+
+    rows = {}
+    for case, result in results.items():
+        old = baseline.get("results", {}).get(case)
+        if old is None:
+            continue
+        rows[case] = {}
+        for column in columns:
+            if old.get(column) and column in result:
+                change = (result[column] - old[column]) / old[column] * 100
+                rows[case][column] = f"{change:+.1f}%"
+    if rows:
+        print_table(rows, columns)
+    else:
+        print(f"No cases in common with {path}")
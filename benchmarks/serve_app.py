@@ -0,0 +1,93 @@
+"""
+Run the app against the mock upstreams (see mock_upstreams.py).
+
+The provider services are pointed at the mock server instead of
+opendata.fmi.fi, api.met.no and Nominatim, and the database is seeded
+with synthetic history so /weather/history, /weather/stats and the
+analytics endpoints have data to read. The database and state files are
+created in the working directory, so run it in an empty one:
+
+    cd $(mktemp -d) && PYTHONPATH=/path/to/repo \\
+        python -m benchmarks.serve_app --port 8800 --upstream http://127.0.0.1:8801
+
+Per-host upstream rate limits (HTTP_RATE_LIMITS) name the real hosts, so
+they don't apply to the mock; the Nominatim limit does (GEOCODE_RATE).
+"""
+
+import argparse
+import os
+import time
+
+from benchmarks.fixtures import bench_cities, observations
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED_CHUNK = 5000
+
+
+def use_mock_upstreams(upstream: str):
+    """Point the FMI, Yr.no and geocoding services at the mock server."""
+    from geopy.geocoders import Nominatim
+
+    from services.fmi import fmi_service
+    from services.geocoding import geocoder
+    from services.yr import yr_service
+
+    base = upstream.rstrip("/")
+    scheme, address = base.split("://", 1)
+    fmi_service.base_url = f"{base}/fmi/wfs"
+    yr_service.base_url = f"{base}/yr/compact"
+    geocoder.geolocator = Nominatim(
+        user_agent="weather-api-benchmark", domain=f"{address}/nominatim", scheme=scheme
+    )
+
+
+def seed_history(cities: int, hours: float) -> int:
+    """
+    Write synthetic observations (FMI and Yr, every 10 minutes) for the
+    first `cities` load test cities.
+
+    Returns:
+        Number of rows written
+    """
+    from database import weather_db
+
+    written = 0
+    chunk = []
+    for observation in observations(bench_cities(cities), hours=hours):
+        chunk.append(observation)
+        if len(chunk) >= SEED_CHUNK:
+            written += weather_db.save_observations(chunk)
+            chunk = []
+    if chunk:
+        written += weather_db.save_observations(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weather API against mock upstreams")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--upstream", default="http://127.0.0.1:8801", help="Mock upstream server")
+    parser.add_argument("--seed-cities", type=int, default=10, help="Cities with seeded history")
+    parser.add_argument("--seed-hours", type=float, default=168, help="Hours of seeded history")
+    args = parser.parse_args()
+
+    use_mock_upstreams(args.upstream)
+    if args.seed_cities and args.seed_hours:
+        started = time.perf_counter()
+        rows = seed_history(args.seed_cities, args.seed_hours)
+        print(f"Seeded {rows} observations in {time.perf_counter() - started:.1f} s")
+
+    # main.py serves ./frontend as static files
+    if not os.path.exists("frontend"):
+        os.symlink(os.path.join(REPO_ROOT, "frontend"), "frontend")
+
+    import uvicorn
+    from main import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+In-process caching helpers.
+
+- TTLCache: size-bounded LRU cache with per-entry expiry
+- SingleFlight: collapses concurrent calls for the same key into one
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Size-bounded LRU cache where every entry has its own time-to-live."""
+
+    def __init__(self, max_size: int = 1000):
+        """
+        Initialize cache.
+
+        Args:
+            max_size: Maximum number of entries, least recently used go first
+        """
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a value if it exists and has not expired.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached value or None
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        """
+        Store a value for ttl seconds.
+
+        Args:
+            key: Cache key
+            value: Value to store
+            ttl: Time-to-live in seconds
+        """
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_stale(self, key: Hashable, max_age: float) -> Optional[Any]:
+        """
+        Get a value even if it has expired, as long as it expired less
+        than max_age seconds ago (expired entries stay until evicted).
+
+        Args:
+            key: Cache key
+            max_age: Seconds past expiry the value is still usable
+
+        Returns:
+            Cached value or None
+        """
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > max_age:
+            return None
+        return entry[1]
+
+    def delete(self, key: Hashable):
+        """Remove a key if present."""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries."""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # Async versions, so callers can use this cache and the shared ones in
+    # shared_state.py (which do I/O off the event loop) the same way
+    async def aget(self, key: Hashable) -> Optional[Any]:
+        return self.get(key)
+
+    async def aset(self, key: Hashable, value: Any, ttl: float):
+        self.set(key, value, ttl)
+
+    async def aget_stale(self, key: Hashable, max_age: float) -> Optional[Any]:
+        return self.get_stale(key, max_age)
+
+    async def adelete(self, key: Hashable):
+        self.delete(key)
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one.
+
+    While a call for a key is running, other callers for the same key
+    wait for its result instead of starting their own. The call runs in
+    its own task, so a caller that is cancelled (e.g. by its deadline)
+    stops waiting without cancelling the call for the others.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run func() once per key at a time.
+
+        Args:
+            key: Key identifying the call (e.g. normalized city name)
+            func: Coroutine function to run if no call is in flight
+
+        Returns:
+            Result of func(), shared by all concurrent callers
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved if every caller had given up
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self, key: Hashable) -> bool:
+        """Check whether a call for key is currently running."""
+        return key in self._inflight
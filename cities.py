@@ -0,0 +1,13 @@
+"""
+City name handling shared by caches and the database.
+"""
+
+
+def normalize_city(city: str) -> str:
+    """
+    Normalize a city name: collapse whitespace and casefold.
+
+    "  New  York", "new york" and "NEW YORK" all become "new york", so
+    they share cache entries and database rows.
+    """
+    return " ".join(city.split()).casefold()
@@ -5,51 +5,247 @@ Uses SQLite for simplicity. Stores each weather observation with:
 - City name
 - Data source (FMI, Foreca, Yr)
 - Weather parameters (temperature, humidity, wind, etc.)
-- Timestamp
+- Timestamp (integer epoch seconds, UTC)
+
+City names are stored normalized (see cities.normalize_city) and the
+schema is versioned (see migrations.py).
+
+Connections are pooled and reused, run in WAL mode with tuned pragmas,
+and queries from async endpoints run in a worker thread via run().
 """
 
+import asyncio
+import os
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Optional
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import metrics
+import migrations
+import rollups
+from cities import normalize_city
+
+
+# Columns returned by history queries, in order
+HISTORY_COLUMNS = (
+    "id", "city", "source", "temperature", "humidity", "pressure",
+    "wind_speed", "precipitation", "weather_description", "timestamp",
+)
+
+
+def encode_cursor(timestamp: int, row_id: int) -> str:
+    """Pagination cursor pointing just past the row (timestamp, id)."""
+    return f"{timestamp}-{row_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """
+    Parse a cursor made by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    timestamp, row_id = cursor.split("-")
+    return int(timestamp), int(row_id)
+
+
+def format_timestamp(timestamp: int) -> str:
+    """Epoch seconds as "YYYY-MM-DD HH:MM:SS" (UTC), the history API format."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp))
+
+
+def since(hours: float) -> int:
+    """Epoch seconds of the start of a window covering the last N hours."""
+    return int(time.time() - hours * 3600)
+
+
+def history_row_to_dict(row: Tuple) -> Dict:
+    """Convert a history row tuple to the dictionary returned by the API."""
+    observation = dict(zip(HISTORY_COLUMNS, row))
+    observation["timestamp"] = format_timestamp(observation["timestamp"])
+    return observation
+
+
+class ConnectionPool:
+    """
+    Pool of reusable SQLite connections.
+
+    Every connection uses WAL journaling (readers don't block the writer),
+    synchronous=NORMAL (no fsync per commit in WAL mode), a larger page
+    cache and memory-mapped I/O. Blocking queries can be run from async
+    code with run(), which uses a thread pool the same size as the pool.
+
+    An optional setup function (e.g. schema migration) runs once, on the
+    first connection handed out, so creating a pool does no I/O.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "weather_data.db",
+        size: int = 4,
+        cache_size_kib: int = 16384,
+        mmap_size: int = 64 * 1024 * 1024,
+        busy_timeout: float = 5.0,
+        setup: Optional[Callable[[sqlite3.Connection], Any]] = None,
+    ):
+        """
+        Initialize pool. Connections are opened on first use.
+
+        Args:
+            db_path: Path to SQLite database file
+            size: Maximum number of open connections
+            cache_size_kib: Page cache per connection in KiB
+            mmap_size: Bytes of the database file to memory-map
+            busy_timeout: Seconds to wait for a lock before failing
+            setup: Run once with the first connection before it is used
+        """
+        self.db_path = db_path
+        self.size = size
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.setup = setup
+        self._setup_done = False
+        self._setup_lock = threading.Lock()
+        self._idle: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sqlite")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection with tuned pragmas."""
+        conn = sqlite3.connect(
+            self.db_path, timeout=self.busy_timeout, check_same_thread=False
+        )
+        # Only takes effect for new database files (existing ones need a
+        # one-time VACUUM, see retention.py)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection from the pool.
+
+        Waits for a free connection when all of them are in use.
+        Uncommitted changes are rolled back when the connection is returned.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._idle.get()
+
+        try:
+            if not self._setup_done:
+                self._run_setup(conn)
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            self._idle.put(conn)
+
+    def _run_setup(self, conn: sqlite3.Connection):
+        """Run the setup function once (other threads wait for it)."""
+        with self._setup_lock:
+            if not self._setup_done:
+                if self.setup is not None:
+                    self.setup(conn)
+                self._setup_done = True
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run a blocking database function in the pool's worker threads.
+
+        Args:
+            func: Function to run (e.g. weather_db.get_history)
+            *args, **kwargs: Arguments for func
+
+        Returns:
+            Return value of func
+        """
+        loop = asyncio.get_running_loop()
+        with DB_CALL_LATENCY.time(getattr(func, "__name__", "call")):
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def close(self):
+        """Close all idle connections (new ones are opened on next use)."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+DB_CALL_LATENCY = metrics.histogram(
+    "weather_db_call_duration_seconds",
+    "Database calls from async code, including the wait for a worker thread",
+    ("operation",),
+)
+DB_COMMIT_LATENCY = metrics.histogram(
+    "weather_db_commit_duration_seconds", "Commits of observation batches"
+)
 
 
 class WeatherDatabase:
     """Simple SQLite database for weather observations."""
 
-    def __init__(self, db_path: str = "weather_data.db"):
+    def __init__(
+        self, db_path: str = "weather_data.db", pool: Optional[ConnectionPool] = None
+    ):
         """
-        Initialize database connection.
+        Initialize database connection pool.
+
+        The schema is migrated when the first connection is used (or by
+        calling migrate()), not when the database object is created.
 
         Args:
             db_path: Path to SQLite database file
+            pool: Connection pool (default: new pool for db_path)
         """
         self.db_path = db_path
-        self.create_table()
-
-    def create_table(self):
-        """Create weather_data table if it doesn't exist."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS weather_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                city TEXT NOT NULL,
-                source TEXT NOT NULL,
-                temperature REAL,
-                humidity INTEGER,
-                pressure REAL,
-                wind_speed REAL,
-                precipitation REAL,
-                weather_description TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
+        self.pool = pool or ConnectionPool(db_path)
+        self.pool.setup = migrations.migrate
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking database method without blocking the event loop."""
+        return await self.pool.run(func, *args, **kwargs)
+
+    def migrate(self) -> int:
         """
-        )
+        Create or upgrade the schema to the latest version.
 
-        conn.commit()
-        conn.close()
+        Returns:
+            Schema version
+        """
+        with self.pool.connection() as conn:
+            return migrations.migrate(conn)
 
     def save_observation(self, city: str, source: str, weather_data: Dict) -> bool:
         """
@@ -64,35 +260,58 @@ class WeatherDatabase:
             True if saved successfully
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            self.save_observations([(city, source, weather_data, int(time.time()))])
+            return True
+
+        except Exception as e:
+            print(f"Error saving to database: {e}")
+            return False
+
+    def save_observations(self, observations: List[Tuple[str, str, Dict, int]]) -> int:
+        """
+        Save many observations in one transaction.
+
+        Hourly rollups (see rollups.py) are updated in the same transaction.
 
-            cursor.execute(
+        Args:
+            observations: List of (city, source, weather_data, timestamp),
+                timestamp in epoch seconds
+
+        Returns:
+            Number of rows written
+        """
+        rows = [
+            (
+                normalize_city(city),
+                source,
+                weather_data.get("temperature"),
+                weather_data.get("humidity"),
+                weather_data.get("pressure"),
+                weather_data.get("wind_speed"),
+                weather_data.get("precipitation"),
+                weather_data.get("weather"),
+                timestamp,
+            )
+            for city, source, weather_data, timestamp in observations
+        ]
+
+        with self.pool.connection() as conn:
+            conn.executemany(
                 """
                 INSERT INTO weather_data
                 (city, source, temperature, humidity, pressure,
-                 wind_speed, precipitation, weather_description)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                 wind_speed, precipitation, weather_description, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
-                (
-                    city,
-                    source,
-                    weather_data.get("temperature"),
-                    weather_data.get("humidity"),
-                    weather_data.get("pressure"),
-                    weather_data.get("wind_speed"),
-                    weather_data.get("precipitation"),
-                    weather_data.get("weather"),
-                ),
+                rows,
             )
+            rollups.add_observations(
+                conn, [(row[0], row[1], row[2], row[8]) for row in rows]
+            )
+            with DB_COMMIT_LATENCY.time():
+                conn.commit()
 
-            conn.commit()
-            conn.close()
-            return True
-
-        except Exception as e:
-            print(f"Error saving to database: {e}")
-            return False
+        return len(rows)
 
     def get_history(self, city: str, hours: int = 24) -> List[Dict]:
         """
@@ -103,32 +322,74 @@ class WeatherDatabase:
             hours: How many hours of history to fetch
 
         Returns:
-            List of weather observations
+            List of weather observations, newest first
+        """
+        rows, _ = self.get_history_page(city, hours, limit=-1)
+        return [history_row_to_dict(row) for row in rows]
+
+    def get_history_page(
+        self,
+        city: str,
+        hours: int = 24,
+        limit: int = 1000,
+        cursor: Optional[str] = None,
+        oldest_first: bool = False,
+    ) -> Tuple[List[Tuple], Optional[str]]:
         """
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
-        cursor = conn.cursor()
+        Get one page of weather history using keyset pagination.
 
-        cursor.execute(
-            """
-            SELECT * FROM weather_data
+        Pages are ordered by (timestamp, id) and the cursor is the last
+        row of the previous page, so every page is an index range scan
+        no matter how deep it is.
+
+        Args:
+            city: City name
+            hours: How many hours of history to fetch
+            limit: Maximum rows per page (-1 = no limit)
+            cursor: next_cursor of the previous page (None = first page)
+            oldest_first: Page forward in time instead of newest first
+
+        Returns:
+            (rows as tuples in HISTORY_COLUMNS order with epoch timestamps,
+            cursor for the next page or None when this was the last page)
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        op, order = (">", "ASC") if oldest_first else ("<", "DESC")
+        query = f"""
+            SELECT {", ".join(HISTORY_COLUMNS)}
+            FROM weather_data
             WHERE city = ?
-            AND timestamp >= datetime('now', '-' || ? || ' hours')
-            ORDER BY timestamp DESC
-        """,
-            (city, hours),
-        )
+            AND timestamp >= ?
+        """
+        params: List[Any] = [normalize_city(city), since(hours)]
+
+        if cursor is not None:
+            timestamp, row_id = decode_cursor(cursor)
+            query += f" AND (timestamp {op} ? OR (timestamp = ? AND id {op} ?))"
+            params += [timestamp, timestamp, row_id]
 
-        rows = cursor.fetchall()
-        conn.close()
+        query += f" ORDER BY timestamp {order}, id {order} LIMIT ?"
+        params.append(limit)
 
-        # Convert to list of dictionaries
-        return [dict(row) for row in rows]
+        with self.pool.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        next_cursor = None
+        if limit > 0 and len(rows) == limit:
+            last = rows[-1]
+            next_cursor = encode_cursor(last[-1], last[0])
+
+        return rows, next_cursor
 
     def get_statistics(self, city: str, hours: int = 24) -> Dict:
         """
         Calculate simple statistics for a city.
 
+        Uses hourly rollups for full hours and raw rows only for the
+        partial hours at the window edges.
+
         Args:
             city: City name
             hours: Time period for statistics
@@ -136,32 +397,28 @@ class WeatherDatabase:
         Returns:
             Dictionary with min, max, average temperatures
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT
-                MIN(temperature) as min_temp,
-                MAX(temperature) as max_temp,
-                AVG(temperature) as avg_temp,
-                COUNT(*) as observation_count
-            FROM weather_data
-            WHERE city = ?
-            AND timestamp >= datetime('now', '-' || ? || ' hours')
-        """,
-            (city, hours),
-        )
+        with self.pool.connection() as conn:
+            summaries = rollups.summarize(
+                conn, normalize_city(city), since(hours), int(time.time()), edges=False
+            )
 
-        result = cursor.fetchone()
-        conn.close()
+        count = sum(summary["count"] for summary in summaries.values())
+        temp_count = sum(summary["temp_count"] for summary in summaries.values())
+        mins = [s["temp_min"] for s in summaries.values() if s["temp_min"] is not None]
+        maxs = [s["temp_max"] for s in summaries.values() if s["temp_max"] is not None]
 
-        if result and result[3] > 0:  # If we have observations
+        if count > 0:  # If we have observations
             return {
-                "min_temperature": round(result[0], 1) if result[0] else None,
-                "max_temperature": round(result[1], 1) if result[1] else None,
-                "avg_temperature": round(result[2], 1) if result[2] else None,
-                "observation_count": result[3],
+                "min_temperature": round(min(mins), 1) if mins else None,
+                "max_temperature": round(max(maxs), 1) if maxs else None,
+                "avg_temperature": (
+                    round(
+                        sum(s["temp_sum"] for s in summaries.values()) / temp_count, 1
+                    )
+                    if temp_count
+                    else None
+                ),
+                "observation_count": count,
             }
         else:
             return {
@@ -173,4 +430,11 @@ class WeatherDatabase:
 
 
 # Create a single instance to use throughout the app
-weather_db = WeatherDatabase()
+weather_db = WeatherDatabase(
+    pool=ConnectionPool(
+        "weather_data.db",
+        size=int(os.getenv("DB_POOL_SIZE", "4")),
+        cache_size_kib=int(os.getenv("DB_CACHE_SIZE_KIB", "16384")),
+        mmap_size=int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024))),
+    )
+)
@@ -0,0 +1,225 @@
+"""
+Streaming export of historical observations.
+
+Rows are read with keyset pagination (see WeatherDatabase.get_history_page)
+one chunk at a time, oldest first, and each chunk is encoded and sent
+before the next one is read. A chunk is a short query of its own, so no
+connection or read transaction is held while a slow client downloads,
+and memory stays the same whatever the window size.
+
+Formats:
+- ndjson: one JSON object per line
+- csv: header row and one line per observation
+- arrow: Arrow IPC stream, one record batch per chunk (needs pyarrow)
+- parquet: Parquet file, one row group per chunk (needs pyarrow)
+"""
+
+import csv
+import io
+import json
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from database import HISTORY_COLUMNS, WeatherDatabase, history_row_to_dict
+
+
+class NDJSONEncoder:
+    """Newline-delimited JSON, timestamps formatted as in /weather/history."""
+
+    media_type = "application/x-ndjson"
+
+    def encode(self, rows: List[Tuple]) -> bytes:
+        return "".join(
+            json.dumps(history_row_to_dict(row)) + "\n" for row in rows
+        ).encode()
+
+    def close(self) -> bytes:
+        return b""
+
+
+class CSVEncoder:
+    """CSV with a header row, timestamps formatted as in /weather/history."""
+
+    media_type = "text/csv"
+
+    def __init__(self):
+        self._header_sent = False
+
+    def encode(self, rows: List[Tuple]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not self._header_sent:
+            writer.writerow(HISTORY_COLUMNS)
+            self._header_sent = True
+        for row in rows:
+            writer.writerow(history_row_to_dict(row).values())
+        return buffer.getvalue().encode()
+
+    def close(self) -> bytes:
+        # Empty exports still get the header
+        return self.encode([]) if not self._header_sent else b""
+
+
+class _ChunkSink:
+    """
+    Write-only file object that hands written bytes back in pieces.
+
+    pyarrow keeps track of file offsets with tell(), so the position
+    counts everything written even after the buffer has been drained.
+    """
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+class _ArrowEncoderBase:
+    """Shared column conversion for the Arrow and Parquet encoders."""
+
+    def __init__(self):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.schema = pa.schema(
+            [
+                ("id", pa.int64()),
+                ("city", pa.string()),
+                ("source", pa.string()),
+                ("temperature", pa.float64()),
+                ("humidity", pa.int64()),
+                ("pressure", pa.float64()),
+                ("wind_speed", pa.float64()),
+                ("precipitation", pa.float64()),
+                ("weather_description", pa.string()),
+                ("timestamp", pa.timestamp("s", tz="UTC")),
+            ]
+        )
+        self.sink = _ChunkSink()
+        self.writer = None
+
+    def _table(self, rows: List[Tuple]):
+        columns = list(zip(*rows)) if rows else [[] for _ in HISTORY_COLUMNS]
+        return self.pa.Table.from_arrays(
+            [
+                self.pa.array(column, type=field.type)
+                for column, field in zip(columns, self.schema)
+            ],
+            schema=self.schema,
+        )
+
+    def encode(self, rows: List[Tuple]) -> bytes:
+        if rows:
+            self.writer.write_table(self._table(rows))
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+class ArrowEncoder(_ArrowEncoderBase):
+    """Arrow IPC stream format."""
+
+    media_type = "application/vnd.apache.arrow.stream"
+
+    def __init__(self):
+        super().__init__()
+        self.writer = self.pa.ipc.new_stream(self.sink, self.schema)
+
+
+class ParquetEncoder(_ArrowEncoderBase):
+    """Parquet file, one row group per chunk."""
+
+    media_type = "application/vnd.apache.parquet"
+
+    def __init__(self):
+        super().__init__()
+        import pyarrow.parquet as pq
+
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression="zstd")
+
+
+# Format name -> encoder class
+ENCODERS: Dict[str, Callable] = {
+    "ndjson": NDJSONEncoder,
+    "csv": CSVEncoder,
+    "arrow": ArrowEncoder,
+    "parquet": ParquetEncoder,
+}
+
+FILE_EXTENSIONS = {"ndjson": "ndjson", "csv": "csv", "arrow": "arrows", "parquet": "parquet"}
+
+
+def get_encoder(fmt: str):
+    """
+    Create an encoder for an export format.
+
+    Args:
+        fmt: ndjson, csv, arrow or parquet
+
+    Returns:
+        Encoder with media_type, encode(rows) and close()
+
+    Raises:
+        ValueError: If the format is unknown
+        ImportError: If the format needs pyarrow and it isn't installed
+    """
+    if fmt not in ENCODERS:
+        raise ValueError(f"Unknown format '{fmt}', use one of: {', '.join(ENCODERS)}")
+    return ENCODERS[fmt]()
+
+
+async def stream_history(
+    db: WeatherDatabase,
+    encoder,
+    city: str,
+    hours: int,
+    chunk_size: int = 5000,
+) -> AsyncIterator[bytes]:
+    """
+    Stream a city's history, oldest first, as encoded chunks.
+
+    Args:
+        db: Database to read from
+        encoder: Encoder from get_encoder
+        city: City name
+        hours: How many hours of history to export
+        chunk_size: Rows read and encoded at a time
+
+    Yields:
+        Encoded bytes
+    """
+    cursor: Optional[str] = None
+    while True:
+        rows, cursor = await db.run(
+            db.get_history_page, city, hours, chunk_size, cursor, True
+        )
+        data = encoder.encode(rows)
+        if data:
+            yield data
+        if cursor is None:
+            break
+
+    data = encoder.close()
+    if data:
+        yield data
@@ -0,0 +1,120 @@
+"""
+Columnar storage of forecast timeseries.
+
+A Yr.no forecast document has hourly steps for the next days and 6-hour
+steps after that, each a nested JSON object. Once parsed, a forecast is
+kept as one typed array per parameter instead of a list of dictionaries,
+which takes a fraction of the memory and makes slicing a time window
+cheap. The same series answers "current weather" (the step covering now)
+and /weather/forecast (a window of steps).
+
+Missing values are stored as NaN and returned as None.
+"""
+
+import math
+import time
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+# Parameters kept per time step
+COLUMNS = ("temperature", "wind_speed", "humidity", "pressure", "precipitation")
+
+# Yr.no compact field for each column, and where it is in a time step
+YR_FIELDS = {
+    "temperature": ("instant", "air_temperature"),
+    "wind_speed": ("instant", "wind_speed"),
+    "humidity": ("instant", "relative_humidity"),
+    "pressure": ("instant", "air_pressure_at_sea_level"),
+    "precipitation": ("next_1_hours", "precipitation_amount"),
+}
+
+NAN = float("nan")
+
+
+def _value(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def parse_time(text: str) -> int:
+    """Convert an ISO 8601 UTC time ("2024-01-01T12:00:00Z") to epoch seconds."""
+    return int(datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp())
+
+
+class ForecastSeries:
+    """Forecast time steps stored as one array per parameter."""
+
+    def __init__(
+        self, times: Iterable[int] = (), columns: Optional[Dict[str, Iterable[float]]] = None
+    ):
+        """
+        Args:
+            times: Step times in epoch seconds, ascending
+            columns: Column name -> values, one per step (NaN = missing)
+        """
+        self.times = array("q", times)
+        columns = columns or {}
+        self.columns: Dict[str, array] = {
+            name: array("d", columns.get(name, [NAN] * len(self.times))) for name in COLUMNS
+        }
+
+    @classmethod
+    def from_yr(cls, data: Dict[str, Any]) -> "ForecastSeries":
+        """
+        Parse a Yr.no locationforecast (compact) document.
+
+        Args:
+            data: Decoded JSON document
+
+        Returns:
+            Series with one step per timeseries entry
+        """
+        series = cls()
+        for step in data.get("properties", {}).get("timeseries", []):
+            try:
+                timestamp = parse_time(step["time"])
+            except (KeyError, ValueError):
+                continue
+            step_data = step.get("data", {})
+            series.times.append(timestamp)
+            for name, (block, field) in YR_FIELDS.items():
+                value = step_data.get(block, {}).get("details", {}).get(field)
+                series.columns[name].append(NAN if value is None else float(value))
+        return series
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def index_at(self, timestamp: float) -> int:
+        """Index of the step covering a time (the last one not after it, or the first)."""
+        return max(0, bisect_right(self.times, timestamp) - 1)
+
+    def row(self, index: int) -> Dict[str, Optional[float]]:
+        """One time step as a dictionary of column values."""
+        return {name: _value(self.columns[name][index]) for name in COLUMNS}
+
+    def window(self, start: float, hours: float) -> Dict[str, List]:
+        """
+        Get the steps from the one covering `start` up to `hours` later.
+
+        Args:
+            start: Epoch seconds (usually now)
+            hours: Length of the window
+
+        Returns:
+            Dictionary with "time" (ISO 8601 UTC strings) and one list per
+            column, all the same length
+        """
+        first = self.index_at(start)
+        last = bisect_right(self.times, start + hours * 3600)
+        return {
+            "time": [
+                time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
+                for t in self.times[first:last]
+            ],
+            **{
+                name: [_value(v) for v in self.columns[name][first:last]]
+                for name in COLUMNS
+            },
+        }
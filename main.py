@@ -8,19 +8,83 @@ Aggregates weather data from multiple sources:
 Stores historical data for analysis and trends.
 """
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+import hmac
+import os
+import re
+import time
+from typing import List, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from dotenv import load_dotenv
+from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
+import metrics
+import ratelimit
+
 # Load environment variables
 load_dotenv()
 
+REQUEST_LATENCY = metrics.histogram(
+    "weather_http_request_duration_seconds",
+    "API request latency by route, method and status",
+    ("route", "method", "status"),
+)
+REQUESTS_IN_FLIGHT = metrics.gauge(
+    "weather_http_requests_in_flight", "API requests being handled"
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    App startup and shutdown.
+
+    Preloads the app modules and runs deferred database setup (PRELOAD=1,
+    see warmup.py), opens the shared HTTP connection pool used by all
+    weather services, joins the leader election (see shared_state.py)
+    and starts the background observation writer, retention job and hot
+    city prefetching. On shutdown, queued observations are flushed before
+    the lease is given up and the connections are closed.
+    """
+    if os.getenv("PRELOAD", "1") == "1":
+        from warmup import preload
+
+        report = preload(include_pandas=os.getenv("PRELOAD_PANDAS", "0") == "1")
+        print(f"Preloaded in {report['total_ms']} ms")
+
+    from services.http_client import http_client
+    from database import weather_db
+    from observation_writer import observation_writer
+    from retention import retention_manager
+    from prefetch import prefetch_scheduler
+    from shared_state import leader_election, open_backends
+
+    await http_client.start()
+    await open_backends()
+    await leader_election.start()
+    observation_writer.start()
+    retention_manager.start()
+    prefetch_scheduler.start()
+    yield
+    await prefetch_scheduler.stop()
+    await retention_manager.stop()
+    await observation_writer.stop()
+    await leader_election.stop()
+    await http_client.close()
+    weather_db.pool.close()
+
+
 app = FastAPI(
     title="Weather API Aggregator",
     version="1.0.0",
     description="Automatic deployment via GitHub Actions - TEST",
     root_path="/api",  # Tell FastAPI it's behind /api/ reverse proxy
+    lifespan=lifespan,
 )
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +100,22 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time each request, labeled with the route template (not the raw path)."""
+    started = time.perf_counter()
+    with REQUESTS_IN_FLIGHT.track():
+        response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_LATENCY.observe(
+        time.perf_counter() - started,
+        getattr(route, "path", None) or "other",
+        request.method,
+        str(response.status_code),
+    )
+    return response
+
+
 @app.get("/weather")
 async def get_weather(city: str):
     """
@@ -50,81 +130,230 @@ async def get_weather(city: str):
 
     Returns:
         Weather data with temperature, humidity, wind, pressure, etc.
+        and per-source status and timing under "sources"
     """
-    from services.fmi import fmi_service
-    from services.yr import yr_service
-    from database import weather_db
+    from aggregator import weather_aggregator, combine_sources, fresh_observations
+    from observation_writer import observation_writer
+    from prefetch import prefetch_scheduler
 
-    sources = {}
+    prefetch_scheduler.note_request(city)
 
-    # Fetch from FMI (Finnish Meteorological Institute)
-    # Only works for Finnish cities
-    try:
-        fmi_data = await fmi_service.get_current_weather(place=city)
-        if fmi_data:
-            sources["FMI"] = fmi_data
-            weather_db.save_observation(city, "FMI", fmi_data)
-    except Exception as e:
-        print(f"FMI error: {e}")
+    # Fetch from all sources concurrently under one overall deadline:
+    # - FMI (Finnish Meteorological Institute) only works for Finnish cities,
+    #   so it is skipped for cities outside Finland
+    # - Yr.no (Norwegian Meteorological Institute) works worldwide
+    results = await weather_aggregator.fetch(city)
+
+    # Save fresh observations for historical analysis (cached ones are
+    # already in the database)
+    await observation_writer.submit_many(fresh_observations(city, results))
+
+    return combine_sources(city, results)
+
+
+@app.get("/weather/forecast/{city}")
+async def get_forecast(city: str, hours: int = Query(default=48, ge=1, le=240)):
+    """
+    Get the Yr.no forecast for a city.
+
+    Served from the same cached forecast document as current weather;
+    Yr.no is only called again when the document expires.
+
+    Args:
+        city: City name (any city worldwide)
+        hours: How many hours ahead (1-240; hourly steps for about 2.5
+            days, then 6-hourly)
+
+    Returns:
+        Forecast run time, expiry and the timeseries as columns: "time"
+        and one list each for temperature, wind_speed, humidity, pressure
+        and precipitation (mm in the next hour)
+    """
+    from services.yr import yr_service
 
-    # Fetch from Yr.no (Norwegian Meteorological Institute)
-    # Works worldwide with automatic geocoding
     try:
-        yr_data = await yr_service.get_current_weather(city)
-        if yr_data:
-            sources["Yr"] = yr_data
-            weather_db.save_observation(city, "Yr", yr_data)
+        forecast = await yr_service.get_forecast(city, hours)
     except Exception as e:
-        print(f"Yr error: {e}")
-
-    # Combine data from both sources if available
-    # Use FMI pressure if available, otherwise Yr.no pressure
-    if sources:
-        if "FMI" in sources and "Yr" in sources:
-            # Combine: Use FMI as base, fill missing data from Yr.no
-            combined_data = sources["FMI"].copy()
-            if combined_data.get("pressure") is None:
-                combined_data["pressure"] = sources["Yr"].get("pressure")
-            if combined_data.get("wind_speed") is None:
-                combined_data["wind_speed"] = sources["Yr"].get("wind_speed")
-
-            return {"city": city, "source": "FMI + Yr.no", "data": combined_data}
-        else:
-            # Single source available
-            primary_source = "FMI" if "FMI" in sources else "Yr"
-            return {
-                "city": city,
-                "source": primary_source,
-                "data": sources[primary_source],
-            }
-    else:
-        return {"error": f"No weather data found for '{city}'"}
+        print(f"❌ Yr.no forecast fetch failed: {e}")
+        raise HTTPException(status_code=502, detail="Forecast unavailable")
+
+    if forecast is None:
+        raise HTTPException(status_code=404, detail=f"City '{city}' not found")
+
+    return {"city": city, "source": "Yr.no", "period_hours": hours, **forecast}
+
+
+class BatchRequest(BaseModel):
+    """Body of POST /weather/batch."""
+
+    cities: List[str]
+
+
+async def fetch_batch(cities: List[str]) -> dict:
+    """
+    Fetch current weather for several cities and save fresh observations.
+
+    Args:
+        cities: City names (duplicates and blanks are dropped)
+
+    Returns:
+        Batch response (see aggregator.combine_batch)
+    """
+    from aggregator import weather_aggregator, combine_batch, fresh_observations, unique_cities
+    from observation_writer import observation_writer
+    from prefetch import prefetch_scheduler
+
+    cities = unique_cities(cities)
+    if not cities:
+        raise HTTPException(status_code=400, detail="No cities given")
+
+    max_cities = int(os.getenv("BATCH_MAX_CITIES", "50"))
+    if len(cities) > max_cities:
+        raise HTTPException(
+            status_code=400, detail=f"At most {max_cities} cities per batch"
+        )
+
+    for city in cities:
+        prefetch_scheduler.note_request(city)
+    # Rate limited upstreams serve single-city requests first
+    with ratelimit.priority(ratelimit.BATCH):
+        results = await weather_aggregator.fetch_many(cities)
+
+    # All observations of the batch are queued at once
+    await observation_writer.submit_many(
+        observation
+        for city, result in results.items()
+        if not isinstance(result, BaseException)
+        for observation in fresh_observations(city, result)
+    )
+
+    return combine_batch(results)
+
+
+@app.get("/weather/batch")
+async def get_weather_batch(cities: str):
+    """
+    Get current weather for several cities in one request.
+
+    Cities are fetched concurrently (at most BATCH_CONCURRENCY at a time)
+    and served from the response cache when fresh. A city without data
+    gets an "error" entry instead of failing the whole batch.
+
+    Args:
+        cities: Comma-separated city names (e.g., "Oulu,Helsinki,Tampere")
+
+    Returns:
+        Per-city weather data (as in /weather) and the number of errors
+    """
+    return await fetch_batch(cities.split(","))
+
+
+@app.post("/weather/batch")
+async def post_weather_batch(request: BatchRequest):
+    """
+    Get current weather for several cities in one request.
+
+    Same as GET /weather/batch, for city lists that don't fit in a URL
+    or contain commas.
+
+    Args:
+        request: {"cities": ["Oulu", "Helsinki", ...]}
+
+    Returns:
+        Per-city weather data (as in /weather) and the number of errors
+    """
+    return await fetch_batch(request.cities)
 
 
 @app.get("/weather/history/{city}")
-async def get_weather_history(city: str, hours: int = 24):
+async def get_weather_history(
+    city: str,
+    hours: int = 24,
+    limit: Optional[int] = Query(default=None, ge=1, le=10000),
+    cursor: Optional[str] = None,
+):
     """
     Get historical weather data for a city.
 
+    Without limit, returns the whole window. With limit, returns one
+    page and a next_cursor to pass as cursor for the next page (None on
+    the last page).
+
     Args:
         city: City name
         hours: Number of hours of history (default: 24)
+        limit: Page size
+        cursor: next_cursor from the previous page
 
     Returns:
-        List of past weather observations
+        List of past weather observations, newest first
     """
-    from database import weather_db
+    from database import weather_db, history_row_to_dict
 
-    history = weather_db.get_history(city, hours)
+    next_cursor = None
+    if limit is None and cursor is None:
+        history = await weather_db.run(weather_db.get_history, city, hours)
+    else:
+        try:
+            rows, next_cursor = await weather_db.run(
+                weather_db.get_history_page, city, hours, limit or 1000, cursor
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        history = [history_row_to_dict(row) for row in rows]
 
     return {
         "city": city,
         "hours": hours,
         "observation_count": len(history),
         "data": history,
+        "next_cursor": next_cursor,
     }
 
 
+@app.get("/weather/export/{city}")
+async def export_weather_history(city: str, hours: int = 24, format: str = "ndjson"):
+    """
+    Stream historical weather data for a city, oldest first.
+
+    Rows are read and sent in chunks, so memory use doesn't depend on
+    the window size.
+
+    Args:
+        city: City name
+        hours: Number of hours of history (default: 24)
+        format: ndjson (default), csv, arrow or parquet
+
+    Returns:
+        Streamed file in the requested format
+    """
+    from database import weather_db
+    from export import FILE_EXTENSIONS, get_encoder, stream_history
+
+    try:
+        encoder = get_encoder(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImportError:
+        raise HTTPException(
+            status_code=501, detail=f"Format '{format}' needs pyarrow installed"
+        )
+
+    safe_city = re.sub(r"[^\w-]+", "-", city)
+    filename = f"{safe_city}-{hours}h.{FILE_EXTENSIONS[format]}"
+    return StreamingResponse(
+        stream_history(
+            weather_db,
+            encoder,
+            city,
+            hours,
+            chunk_size=int(os.getenv("EXPORT_CHUNK_SIZE", "5000")),
+        ),
+        media_type=encoder.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.get("/weather/stats/{city}")
 async def get_weather_stats(city: str, hours: int = 24):
     """
@@ -141,7 +370,7 @@ async def get_weather_stats(city: str, hours: int = 24):
     """
     from database import weather_db
 
-    stats = weather_db.get_statistics(city, hours)
+    stats = await weather_db.run(weather_db.get_statistics, city, hours)
 
     return {"city": city, "period_hours": hours, "statistics": stats}
 
@@ -160,7 +389,7 @@ async def get_temperature_trend(city: str, hours: int = 24):
     """
     from analytics import analytics
 
-    trend = analytics.get_temperature_trend(city, hours)
+    trend = await analytics.run(analytics.get_temperature_trend, city, hours)
 
     return {"city": city, "period_hours": hours, "trend_analysis": trend}
 
@@ -181,7 +410,7 @@ async def compare_sources(city: str, hours: int = 24):
     """
     from analytics import analytics
 
-    comparison = analytics.compare_sources(city, hours)
+    comparison = await analytics.run(analytics.compare_sources, city, hours)
 
     return {"city": city, "period_hours": hours, "source_comparison": comparison}
 
@@ -200,10 +429,76 @@ async def get_hourly_data(city: str, hours: int = 24):
     """
     from analytics import analytics
 
-    hourly = analytics.get_hourly_averages(city, hours)
+    hourly = await analytics.run(analytics.get_hourly_averages, city, hours)
 
     return {"city": city, "period_hours": hours, "hourly_data": hourly}
 
 
+def check_admin_token(token: str):
+    """
+    Reject admin requests without the right X-Admin-Token.
+
+    Admin endpoints are closed when ADMIN_TOKEN is not set.
+
+    Raises:
+        HTTPException: 403 if ADMIN_TOKEN is unset or the token doesn't match
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(
+            status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)"
+        )
+    if not hmac.compare_digest(token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.get("/admin/storage")
+async def get_storage_report(x_admin_token: str = Header(default="")):
+    """
+    Report database size and row counts per storage tier.
+
+    Requires the X-Admin-Token header; closed when ADMIN_TOKEN is not set.
+
+    Returns:
+        File sizes, page statistics, rows per tier (raw, hourly, daily)
+        and the retention policy
+    """
+    check_admin_token(x_admin_token)
+
+    from retention import retention_manager
+
+    return await retention_manager.db.run(retention_manager.report)
+
+
+@app.get("/admin/startup")
+async def get_startup_report(x_admin_token: str = Header(default="")):
+    """
+    Report module import and setup times from startup preloading.
+
+    Requires the X-Admin-Token header; closed when ADMIN_TOKEN is not set.
+
+    Returns:
+        Import time per module, database and geocoding cache setup time
+        and the total (only "preloaded": False when PRELOAD=0)
+    """
+    check_admin_token(x_admin_token)
+
+    from warmup import startup_report
+
+    return startup_report
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Metrics in the Prometheus text format.
+
+    Request, provider, geocoding and database latency histograms, cache
+    hit/miss counts, requests in flight, provider errors, circuit breaker
+    states and writer/prefetch totals (see metrics.py).
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # Serve frontend static files
 app.mount("/", StaticFiles(directory="frontend", html=True), name="frontend")
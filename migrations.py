@@ -0,0 +1,217 @@
+"""
+Versioned schema migrations for the weather database.
+
+The schema version is stored in SQLite's PRAGMA user_version. On startup,
+every migration newer than the stored version is applied in order, in one
+transaction, so existing weather_data.db files are upgraded in place.
+
+To change the schema, append a new (version, description, function) entry
+to MIGRATIONS. Never edit a migration that has already been released.
+"""
+
+import sqlite3
+from typing import Callable, List, Tuple
+
+from cities import normalize_city
+
+
+def _create_weather_data(conn: sqlite3.Connection):
+    """Original schema (databases created before migrations have this)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS weather_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            city TEXT NOT NULL,
+            source TEXT NOT NULL,
+            temperature REAL,
+            humidity INTEGER,
+            pressure REAL,
+            wind_speed REAL,
+            precipitation REAL,
+            weather_description TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+
+
+def _epoch_timestamps_and_indexes(conn: sqlite3.Connection):
+    """
+    Store timestamps as integer epoch seconds, normalize city names and
+    add indexes for the (city, time range) queries.
+    """
+    conn.execute(
+        """
+        CREATE TABLE weather_data_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            city TEXT NOT NULL,
+            source TEXT NOT NULL,
+            temperature REAL,
+            humidity INTEGER,
+            pressure REAL,
+            wind_speed REAL,
+            precipitation REAL,
+            weather_description TEXT,
+            timestamp INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    """
+    )
+    conn.execute(
+        """
+        INSERT INTO weather_data_new
+        (id, city, source, temperature, humidity, pressure,
+         wind_speed, precipitation, weather_description, timestamp)
+        SELECT
+            id, normalize_city(city), source, temperature, humidity, pressure,
+            wind_speed, precipitation, weather_description,
+            COALESCE(
+                CAST(strftime('%s', timestamp) AS INTEGER),
+                CAST(strftime('%s', 'now') AS INTEGER)
+            )
+        FROM weather_data
+    """
+    )
+    conn.execute("DROP TABLE weather_data")
+    conn.execute("ALTER TABLE weather_data_new RENAME TO weather_data")
+    conn.execute(
+        "CREATE INDEX idx_weather_data_city_time ON weather_data (city, timestamp)"
+    )
+    conn.execute(
+        "CREATE INDEX idx_weather_data_city_source_time "
+        "ON weather_data (city, source, timestamp)"
+    )
+
+
+def _hourly_rollups(conn: sqlite3.Connection):
+    """Create weather_hourly rollups and fill them from existing rows."""
+    conn.execute(
+        """
+        CREATE TABLE weather_hourly (
+            city TEXT NOT NULL,
+            source TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            temp_count INTEGER NOT NULL,
+            temp_sum REAL,
+            temp_min REAL,
+            temp_max REAL,
+            first_ts INTEGER,
+            first_temp REAL,
+            last_ts INTEGER,
+            last_temp REAL,
+            PRIMARY KEY (city, source, hour)
+        ) WITHOUT ROWID
+    """
+    )
+    conn.execute(
+        """
+        INSERT INTO weather_hourly
+        (city, source, hour, count, temp_count, temp_sum, temp_min, temp_max,
+         first_ts, last_ts)
+        SELECT
+            city, source, timestamp - timestamp % 3600 AS hour,
+            COUNT(*), COUNT(temperature), SUM(temperature),
+            MIN(temperature), MAX(temperature),
+            MIN(CASE WHEN temperature IS NOT NULL THEN timestamp END),
+            MAX(CASE WHEN temperature IS NOT NULL THEN timestamp END)
+        FROM weather_data
+        GROUP BY city, source, hour
+    """
+    )
+    conn.execute(
+        """
+        UPDATE weather_hourly SET
+            first_temp = (
+                SELECT temperature FROM weather_data AS w
+                WHERE w.city = weather_hourly.city
+                AND w.source = weather_hourly.source
+                AND w.timestamp = weather_hourly.first_ts
+                AND w.temperature IS NOT NULL
+                ORDER BY w.id LIMIT 1
+            ),
+            last_temp = (
+                SELECT temperature FROM weather_data AS w
+                WHERE w.city = weather_hourly.city
+                AND w.source = weather_hourly.source
+                AND w.timestamp = weather_hourly.last_ts
+                AND w.temperature IS NOT NULL
+                ORDER BY w.id DESC LIMIT 1
+            )
+        WHERE first_ts IS NOT NULL
+    """
+    )
+
+
+def _daily_rollups(conn: sqlite3.Connection):
+    """Create weather_daily, the long-term tier for compacted hourly rollups."""
+    conn.execute(
+        """
+        CREATE TABLE weather_daily (
+            city TEXT NOT NULL,
+            source TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            temp_count INTEGER NOT NULL,
+            temp_sum REAL,
+            temp_min REAL,
+            temp_max REAL,
+            first_ts INTEGER,
+            first_temp REAL,
+            last_ts INTEGER,
+            last_temp REAL,
+            PRIMARY KEY (city, source, day)
+        ) WITHOUT ROWID
+    """
+    )
+    conn.execute("CREATE INDEX idx_weather_hourly_hour ON weather_hourly (hour)")
+
+
+# (version, description, migration) in order
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "create weather_data", _create_weather_data),
+    (2, "epoch timestamps, normalized cities, indexes", _epoch_timestamps_and_indexes),
+    (3, "hourly rollups", _hourly_rollups),
+    (4, "daily rollups", _daily_rollups),
+]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    """Get the current schema version of a database."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Apply all pending migrations in one transaction.
+
+    The write lock is taken before the version is read, so several
+    processes starting at once don't run the same migration twice.
+
+    Args:
+        conn: Database connection
+
+    Returns:
+        Schema version after migrating
+    """
+    conn.create_function("normalize_city", 1, normalize_city, deterministic=True)
+
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # Manage the transaction explicitly
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        version = get_version(conn)
+        for migration_version, description, migration in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            print(f"Migrating database to version {migration_version}: {description}")
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {migration_version}")
+            version = migration_version
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+
+    return version
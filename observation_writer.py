@@ -0,0 +1,230 @@
+"""
+Background writer for weather observations.
+
+Instead of one INSERT and commit per source per request, observations are
+put on a queue and written in batches: one transaction per flush interval
+or when the batch is full. When the queue is full, submit() waits, which
+slows down producers instead of growing memory without limit.
+
+With several workers (see shared_state.py) only the leader writes to the
+database. Followers push their batches to a shared queue, and the leader
+takes them from there and writes them together with its own.
+"""
+
+import asyncio
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from database import WeatherDatabase, weather_db
+from shared_state import LeaderElection, create_queue, leader_election
+
+# Queue item: (city, source, weather_data, epoch timestamp)
+Observation = Tuple[str, str, Dict, int]
+
+
+class ObservationWriter:
+    """Batches observations and writes them in a background task."""
+
+    def __init__(
+        self,
+        db: WeatherDatabase,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_queue: int = 10000,
+        leader: Optional[LeaderElection] = None,
+        relay=None,
+    ):
+        """
+        Initialize writer. The background task is started with start().
+
+        Args:
+            db: Database to write to
+            batch_size: Maximum observations per transaction
+            flush_interval: Seconds to wait for more observations before a flush
+            max_queue: Queue size after which submit() waits
+            leader: Leader election; only the leader writes (default: always write)
+            relay: Shared queue from followers to the leader (SQLiteQueue or
+                RedisQueue), needed when leader is given
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.leader = leader
+        self.relay = relay
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.relayed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the background writer task (called from the FastAPI lifespan)."""
+        if not self.running:
+            self.queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued and stop the writer."""
+        if not self.running:
+            return
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, city: str, source: str, weather_data: Dict):
+        """
+        Queue one observation for writing.
+
+        Waits if the queue is full. If the writer isn't running (e.g. in
+        scripts), the observation is written directly.
+
+        Args:
+            city: City name
+            source: Data source (FMI, Foreca, or Yr)
+            weather_data: Dictionary with weather parameters
+        """
+        timestamp = int(time.time())
+        observation = (city, source, weather_data, timestamp)
+
+        if not self.running:
+            await self._write([observation])
+            return
+
+        await self.queue.put(observation)
+
+    async def submit_many(self, observations: Iterable[Tuple[str, str, Dict]]):
+        """
+        Queue several observations for writing.
+
+        If the writer isn't running, they are written directly in one
+        transaction.
+
+        Args:
+            observations: (city, source, weather_data)
+        """
+        timestamp = int(time.time())
+        batch = [(city, source, data, timestamp) for city, source, data in observations]
+
+        if not self.running:
+            if batch:
+                await self._write(batch)
+            return
+
+        for observation in batch:
+            await self.queue.put(observation)
+
+    async def _run(self):
+        """Collect observations into batches and flush them."""
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            if self.relay is None:
+                item = await self.queue.get()
+            else:
+                # Wake up regularly to write what followers have relayed
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    await self._drain_relay()
+                    continue
+            if item is None:
+                break
+
+            batch: List[Observation] = [item]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            await self._drain_relay()
+
+    @property
+    def is_writer(self) -> bool:
+        """True if this worker writes to the database itself."""
+        return self.relay is None or self.leader is None or self.leader.is_leader
+
+    async def _drain_relay(self):
+        """Write observations relayed by followers (leader only)."""
+        if self.relay is None or not self.is_writer:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                items = await loop.run_in_executor(None, self.relay.pop, self.batch_size)
+            except Exception as e:
+                print(f"Error reading relayed observations: {e}")
+                return
+            if not items:
+                return
+            await self._write([tuple(item) for item in items])
+
+    async def _flush(self, batch: List[Observation]):
+        """Write one batch, or hand it to the leader when this worker is a follower."""
+        if not self.is_writer:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.relay.push, batch)
+                self.relayed += len(batch)
+                return
+            except Exception as e:
+                # The database is still there; better a second writer than lost data
+                print(f"Error relaying {len(batch)} observations, writing directly: {e}")
+        await self._write(batch)
+
+    async def _write(self, batch: List[Observation]):
+        """Write one batch in a single transaction."""
+        try:
+            self.written += await self.db.run(self.db.save_observations, batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Error saving {len(batch)} observations to database: {e}")
+
+
+# Single instance for the app
+observation_writer = ObservationWriter(
+    weather_db,
+    batch_size=int(os.getenv("DB_WRITE_BATCH_SIZE", "100")),
+    flush_interval=float(os.getenv("DB_WRITE_FLUSH_INTERVAL", "1.0")),
+    max_queue=int(os.getenv("DB_WRITE_QUEUE_SIZE", "10000")),
+    leader=leader_election,
+    relay=create_queue("observations"),
+)
+
+
+def _collect_metrics():
+    """Writer totals and queue length for /metrics."""
+    writer = observation_writer
+    yield ("weather_observations_written_total", "counter", "Observations saved", {}, writer.written)
+    yield ("weather_observations_failed_total", "counter", "Observations that failed to save", {}, writer.failed)
+    yield ("weather_observation_batches_total", "counter", "Write transactions", {}, writer.batches)
+    yield ("weather_observations_relayed_total", "counter", "Observations handed to the leader", {}, writer.relayed)
+    yield (
+        "weather_observation_queue_size",
+        "gauge",
+        "Observations waiting to be written",
+        {},
+        writer.queue.qsize() if writer.queue is not None else 0,
+    )
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,324 @@
+"""
+Background prefetching of current weather for hot cities.
+
+Hot cities are the ones configured in PREFETCH_CITIES plus, optionally,
+the cities users ask for most often (PREFETCH_AUTO_CITIES). Each source
+of each hot city is refreshed shortly before its response cache entry
+expires, so /weather requests for them are served from the cache and
+the history has no gaps. Refreshes are spread out with jitter and all
+of them share one rate limit; observations go through the batched
+observation writer.
+
+For sources with a bulk provider (FMI), refreshes due within batch_window
+seconds of each other are done together with one bulk fetch.
+"""
+
+import asyncio
+import heapq
+import os
+import random
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from aggregator import (
+    STATUS_OK,
+    STATUS_SKIPPED,
+    WeatherAggregator,
+    fresh_observations,
+    weather_aggregator,
+)
+import metrics
+import ratelimit
+from cities import normalize_city
+from observation_writer import ObservationWriter, observation_writer
+from shared_state import LeaderElection, leader_election
+
+
+class PrefetchPacer:
+    """
+    Lets through at most `rate` calls per second, evenly spaced.
+
+    Unlike ratelimit.RateLimiter (per upstream host, with priorities and
+    a bounded queue), callers always wait their turn: this only spreads
+    the scheduler's own refreshes out.
+    """
+
+    def __init__(self, rate: float):
+        """
+        Args:
+            rate: Calls per second
+        """
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for the next free slot."""
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class PrefetchScheduler:
+    """Keeps the response cache warm for hot cities."""
+
+    def __init__(
+        self,
+        aggregator: WeatherAggregator,
+        writer: ObservationWriter,
+        cities: Iterable[str] = (),
+        sources: Iterable[str] = ("FMI", "Yr"),
+        auto_cities: int = 0,
+        refresh_fraction: float = 0.8,
+        jitter: float = 0.1,
+        rate: float = 2.0,
+        max_concurrency: int = 4,
+        detect_interval: float = 300.0,
+        batch_window: float = 30.0,
+        leader: Optional[LeaderElection] = None,
+    ):
+        """
+        Initialize scheduler. The background task is started with start().
+
+        Args:
+            aggregator: Aggregator whose cache is kept warm
+            writer: Writer for prefetched observations
+            cities: Cities that are always prefetched
+            sources: Sources to prefetch (each at its cache TTL cadence)
+            auto_cities: Also prefetch this many most requested cities
+            refresh_fraction: Refresh when this fraction of the TTL has passed
+            jitter: Random fraction taken off each refresh interval
+            rate: Maximum upstream refreshes per second, all cities together
+            max_concurrency: Refreshes running at once
+            detect_interval: Seconds between updates of the auto-detected cities
+            batch_window: Refreshes of a bulk source due this many seconds
+                early are done together with the one that is due
+            leader: Only prefetch while this worker is the leader (default: always)
+        """
+        self.aggregator = aggregator
+        self.writer = writer
+        self.cities = {normalize_city(city): city for city in cities if city.strip()}
+        self.sources = [source for source in sources if source in aggregator.providers]
+        self.auto_cities = auto_cities
+        self.refresh_fraction = refresh_fraction
+        self.jitter = jitter
+        self.pacer = PrefetchPacer(rate)
+        self.max_concurrency = max_concurrency
+        self.detect_interval = detect_interval
+        self.batch_window = batch_window
+        self.leader = leader
+
+        # Requests per city since the last detection (halved at each detection)
+        self.requests: Counter = Counter()
+        self.names: Dict[str, str] = {}
+        self.hot: Dict[str, str] = dict(self.cities)
+
+        self._schedule: List[Tuple[float, str, str]] = []
+        self._scheduled: Set[Tuple[str, str]] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.refreshes = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sources) and bool(self.cities or self.auto_cities)
+
+    def note_request(self, city: str):
+        """Count a user request for a city (for auto-detection)."""
+        if self.auto_cities:
+            key = normalize_city(city)
+            self.requests[key] += 1
+            self.names.setdefault(key, city)
+
+    def detect_hot_cities(self) -> Dict[str, str]:
+        """
+        Update the hot cities: configured ones plus the most requested.
+
+        Returns:
+            Dictionary of normalized name -> city name
+        """
+        hot = dict(self.cities)
+        for key, _ in self.requests.most_common(self.auto_cities):
+            hot.setdefault(key, self.names[key])
+
+        # Decay, so cities nobody asks for anymore drop out
+        for key in list(self.requests):
+            self.requests[key] //= 2
+            if not self.requests[key]:
+                del self.requests[key]
+                if key not in hot:
+                    self.names.pop(key, None)
+
+        self.hot = hot
+        return hot
+
+    def _interval(self, source: str) -> float:
+        """Seconds until the next refresh of a source, with jitter."""
+        ttl = self.aggregator.ttls.get(source, 600)
+        return ttl * self.refresh_fraction * (1 - self.jitter * random.random())
+
+    def _schedule_new(self, now: float):
+        """Add hot (city, source) pairs that aren't scheduled yet."""
+        for key in self.hot:
+            for source in self.sources:
+                if (key, source) not in self._scheduled:
+                    self._scheduled.add((key, source))
+                    # First refreshes are spread over the jitter window
+                    delay = random.random() * self.jitter * self.aggregator.ttls.get(source, 600)
+                    heapq.heappush(self._schedule, (now + delay, key, source))
+
+    async def _save(self, city: str, source: str, results: Dict[str, Dict]):
+        """Save a refreshed observation and count the outcome."""
+        await self.writer.submit_many(fresh_observations(city, results))
+        status = results[source]["status"]
+        if status == STATUS_OK:
+            self.refreshes += 1
+        elif status != STATUS_SKIPPED:
+            self.failures += 1
+
+    async def refresh(self, key: str, source: str):
+        """Refresh one source of one city and save the observation."""
+        await self.pacer.acquire()
+        city = self.hot.get(key, key)
+        try:
+            await self._save(city, source, await self.aggregator.refresh(city, [source]))
+        except Exception as e:
+            self.failures += 1
+            print(f"Prefetch failed for '{city}' ({source}): {e}")
+
+    async def refresh_bulk(self, keys: List[str], source: str):
+        """
+        Refresh one source of several cities with a bulk fetch.
+
+        Cities the bulk fetch had no data for are refreshed one by one.
+        """
+        await self.pacer.acquire()
+        cities = [self.hot.get(key, key) for key in keys]
+        try:
+            fetched = await self.aggregator.fetch_bulk(cities, [source], use_cache=False)
+        except Exception as e:
+            print(f"Bulk prefetch failed ({source}, {len(cities)} cities): {e}")
+            fetched = {}
+
+        for key, city in zip(keys, cities):
+            results = fetched.get(city, {})
+            if source in results:
+                await self._save(city, source, results)
+            else:
+                await self.refresh(key, source)
+
+    async def _refresh_limited(self, keys: List[str], source: str):
+        async with self._slots:
+            # Waits behind user requests at rate limited upstreams
+            with ratelimit.priority(ratelimit.BACKGROUND):
+                if len(keys) > 1:
+                    await self.refresh_bulk(keys, source)
+                else:
+                    await self.refresh(keys[0], source)
+
+    def _pop_due(self, now: float) -> Tuple[str, List[str]]:
+        """
+        Take the next due refresh off the schedule, together with the
+        refreshes of the same source due within batch_window if the source
+        has a bulk provider.
+
+        Returns:
+            Source and the normalized city names to refresh
+        """
+        _, key, source = heapq.heappop(self._schedule)
+        keys = [key]
+        if source in self.aggregator.bulk_providers:
+            others = []
+            while self._schedule and self._schedule[0][0] <= now + self.batch_window:
+                entry = heapq.heappop(self._schedule)
+                if entry[2] == source:
+                    keys.append(entry[1])
+                else:
+                    others.append(entry)
+            for entry in others:
+                heapq.heappush(self._schedule, entry)
+        return source, keys
+
+    async def _run(self):
+        """Refresh due (city, source) pairs until cancelled."""
+        loop = asyncio.get_running_loop()
+        next_detect = 0.0
+
+        while True:
+            if self.leader is not None and not self.leader.is_leader:
+                # Another worker prefetches; take over if it goes away
+                await asyncio.sleep(self.leader.seconds / 3)
+                continue
+
+            now = loop.time()
+            if now >= next_detect:
+                if self.auto_cities:
+                    self.detect_hot_cities()
+                self._schedule_new(now)
+                next_detect = now + self.detect_interval
+
+            if not self._schedule or self._schedule[0][0] > now:
+                wake = self._schedule[0][0] if self._schedule else next_detect
+                await asyncio.sleep(max(0.0, min(wake, next_detect) - now))
+                continue
+
+            source, keys = self._pop_due(now)
+            for key in keys:
+                if key in self.hot:
+                    heapq.heappush(self._schedule, (now + self._interval(source), key, source))
+                else:
+                    self._scheduled.discard((key, source))
+            keys = [key for key in keys if key in self.hot]
+            if not keys:
+                continue
+
+            task = asyncio.create_task(self._refresh_limited(keys, source))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def start(self):
+        """Start prefetching (called from the FastAPI lifespan)."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop prefetching and cancel refreshes still running."""
+        for task in list(self._running):
+            task.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Single instance for the app
+prefetch_scheduler = PrefetchScheduler(
+    weather_aggregator,
+    observation_writer,
+    cities=os.getenv("PREFETCH_CITIES", "").split(","),
+    sources=os.getenv("PREFETCH_SOURCES", "FMI,Yr").split(","),
+    auto_cities=int(os.getenv("PREFETCH_AUTO_CITIES", "0")),
+    rate=float(os.getenv("PREFETCH_RATE", "2")),
+    leader=leader_election,
+)
+
+
+def _collect_metrics():
+    """Prefetch totals for /metrics."""
+    scheduler = prefetch_scheduler
+    yield ("weather_prefetch_refreshes_total", "counter", "Successful prefetches", {}, scheduler.refreshes)
+    yield ("weather_prefetch_failures_total", "counter", "Failed prefetches", {}, scheduler.failures)
+    yield ("weather_prefetch_hot_cities", "gauge", "Cities being prefetched", {}, len(scheduler.hot))
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,207 @@
+"""
+Per-upstream rate limiting with priorities.
+
+api.met.no and Nominatim ban clients that send too many requests, so
+every request to a limited host first takes a token from that host's
+token bucket. When there are no tokens, callers wait in a priority
+queue: interactive requests (user-facing endpoints) go before batch
+requests, and batch before background work (prefetching). Within a
+priority, callers are served in arrival order.
+
+When the queue for a host is already max_queue deep, acquire() fails
+immediately with RateLimitExceeded instead of making the caller wait for
+a token that is far away; if a less urgent caller is waiting, that one
+fails instead and the new caller takes its place. A 429 response pauses
+the host for its Retry-After time (see pause()), so load drops off
+smoothly instead of turning into a stream of 429s.
+
+The priority of the current request is a context variable, so it is
+set once where work starts (an endpoint, the prefetch scheduler) and
+applies to every upstream call made underneath:
+
+    with ratelimit.priority(ratelimit.BACKGROUND):
+        await aggregator.refresh(city)
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import metrics
+
+# Priorities, most urgent first
+INTERACTIVE = 0
+BATCH = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch", BACKGROUND: "background"}
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("priority", default=INTERACTIVE)
+
+QUEUE_WAIT = metrics.histogram(
+    "weather_upstream_queue_wait_seconds",
+    "Time spent waiting for a rate limit token, by host and priority",
+    ("host", "priority"),
+)
+REJECTED = metrics.counter(
+    "weather_upstream_rate_limited_total",
+    "Requests failed fast because the host's rate limit queue was full",
+    ("host", "priority"),
+)
+
+
+class RateLimitExceeded(Exception):
+    """Raised instead of queueing when a host's rate limit queue is full."""
+
+
+def current_priority() -> int:
+    """Priority of the request being handled (INTERACTIVE unless set)."""
+    return _priority.get()
+
+
+@contextmanager
+def priority(value: int) -> Iterator[None]:
+    """Run the block (and tasks started in it) with the given priority."""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimiter:
+    """Token bucket for one host with a priority queue of waiting callers."""
+
+    def __init__(self, name: str, rate: float, burst: float = 1.0, max_queue: int = 50):
+        """
+        Args:
+            name: Host name, for errors and metrics
+            rate: Requests per second
+            burst: Bucket size (requests that may go out at once after a quiet period)
+            max_queue: Waiting callers after which acquire() fails fast
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_queue = max_queue
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # (priority, arrival order, future)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def _refill(self, now: float):
+        if now > self._paused_until:
+            start = max(self._updated, self._paused_until)
+            self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+        self._updated = now
+
+    def _try_take(self) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def _next_token_in(self) -> float:
+        """Seconds until the next token is available."""
+        now = time.monotonic()
+        return max(0.0, self._paused_until - now) + (1.0 - self.tokens) / self.rate
+
+    async def acquire(self, priority: Optional[int] = None):
+        """
+        Wait for a token.
+
+        Args:
+            priority: INTERACTIVE, BATCH or BACKGROUND (default: the
+                current context's priority)
+
+        Raises:
+            RateLimitExceeded: If max_queue callers are already waiting
+        """
+        if priority is None:
+            priority = current_priority()
+        label = PRIORITY_NAMES.get(priority, str(priority))
+
+        if not self._waiters and self._try_take():
+            QUEUE_WAIT.observe(0.0, self.name, label)
+            return
+
+        if self.queue_depth >= self.max_queue and not self._shed(priority):
+            self._reject(label)
+            raise self._full_error()
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        finally:
+            QUEUE_WAIT.observe(time.perf_counter() - started, self.name, label)
+
+    def _full_error(self) -> RateLimitExceeded:
+        return RateLimitExceeded(
+            f"Rate limit queue for {self.name} is full ({self.max_queue} waiting)"
+        )
+
+    def _reject(self, label: str):
+        self.rejected += 1
+        REJECTED.inc(self.name, label)
+
+    def _shed(self, priority: int) -> bool:
+        """Fail the least urgent, most recent waiter if it is less urgent than `priority`."""
+        waiting = [entry for entry in self._waiters if not entry[2].done()]
+        worst = max(waiting, key=lambda entry: (entry[0], entry[1]), default=None)
+        if worst is None or worst[0] <= priority:
+            return False
+        self._reject(PRIORITY_NAMES.get(worst[0], str(worst[0])))
+        worst[2].set_exception(self._full_error())
+        return True
+
+    async def _dispatch(self):
+        """Hand out tokens to waiters, most urgent first, as they become available."""
+        while self._waiters:
+            if self._waiters[0][2].done():
+                # Cancelled or shed while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if self._try_take():
+                _, _, future = heapq.heappop(self._waiters)
+                future.set_result(None)
+            else:
+                await asyncio.sleep(self._next_token_in())
+
+    def pause(self, seconds: float):
+        """Send nothing for `seconds` (e.g. after a 429 with Retry-After)."""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = 0.0
+        self._paused_until = max(self._paused_until, now + seconds)
+
+
+def parse_limits(text: str) -> Dict[str, float]:
+    """
+    Parse "host=rate,host=rate" (requests per second).
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    limits = {}
+    for entry in text.split(","):
+        if entry.strip():
+            host, rate = entry.split("=")
+            limits[host.strip()] = float(rate)
+    return limits
@@ -0,0 +1,170 @@
+"""
+Resilience helpers for upstream calls.
+
+- CircuitBreaker: stops calling an upstream after consecutive failures and
+  lets a single probe through after a cool-down
+- RetryBudget: caps retries (and hedged requests) to a fraction of normal
+  traffic, shared by all upstreams, so retries can't multiply load on an
+  upstream that is already struggling
+- LatencyTracker: recent latencies of an upstream, for the hedging delay
+"""
+
+import time
+from collections import deque
+from typing import Deque, Optional
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed -> open after failure_threshold failures in a row. While open,
+    calls fail immediately. After reset_timeout seconds one probe call is
+    let through (half-open): success closes the circuit, failure opens it
+    again for another reset_timeout. A probe that never reports back (e.g.
+    cancelled) is replaced by a new one after reset_timeout.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            name: Upstream name for error messages (e.g. the host)
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds to wait before the probe call
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probing = False
+        self._probe_started = 0.0
+
+    def allow(self) -> bool:
+        """Check whether a call may go out now (claims the probe when half-open)."""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN and (
+            not self._probing or now - self._probe_started >= self.reset_timeout
+        ):
+            self._probing = True
+            self._probe_started = now
+            return True
+        return False
+
+    def check(self):
+        """
+        Raise CircuitOpenError unless a call may go out now.
+
+        Raises:
+            CircuitOpenError: If the circuit is open
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit open for {self.name}")
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls are being refused (open, or half-open with a probe out)."""
+        return self.state != CLOSED
+
+
+class RetryBudget:
+    """
+    Token bucket for retries.
+
+    Every request adds `ratio` tokens and every retry or hedge takes one,
+    so retries stay below roughly ratio x normal traffic. min_per_second
+    tokens are added over time so a quiet service can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 10.0):
+        """
+        Args:
+            ratio: Tokens added per request
+            min_per_second: Tokens added per second regardless of traffic
+            max_tokens: Bucket size
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._updated = time.monotonic()
+        self.spent = 0
+        self.denied = 0
+
+    def _refill(self, amount: float = 0.0):
+        now = time.monotonic()
+        amount += (now - self._updated) * self.min_per_second
+        self._updated = now
+        self.tokens = min(self.max_tokens, self.tokens + amount)
+
+    def deposit(self):
+        """Record a normal request."""
+        self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take a token for a retry or hedge, if there is one."""
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.spent += 1
+            return True
+        self.denied += 1
+        return False
+
+
+class LatencyTracker:
+    """Latencies of the most recent successful calls to one upstream."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        """
+        Args:
+            size: Number of recent latencies kept
+            min_samples: Samples needed before percentiles are reported
+        """
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """
+        Latency below which `fraction` of recent calls finished.
+
+        Returns:
+            Seconds, or None if there are not enough samples yet
+        """
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
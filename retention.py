@@ -0,0 +1,376 @@
+"""
+Retention, downsampling and compaction for the observation store.
+
+Data moves through three tiers:
+- weather_data: raw observations, kept RAW_RETENTION_DAYS
+- weather_hourly: hourly rollups (updated on write), kept HOURLY_RETENTION_DAYS,
+  then compacted into whole days
+- weather_daily: daily rollups, kept DAILY_RETENTION_DAYS (0 = forever)
+
+All work is done in small chunks, each in its own short transaction with a
+pause in between, so the writer is never blocked for long. Freed pages are
+returned to the OS with incremental vacuum.
+
+Usage:
+    python retention.py report     # Database size and rows per tier
+    python retention.py compact    # Run one full retention pass
+    python retention.py vacuum     # One-time full VACUUM (enables incremental vacuum)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+import rollups
+from database import WeatherDatabase, weather_db
+from shared_state import LeaderElection, leader_election
+
+
+class RetentionPolicy:
+    """How long each tier is kept."""
+
+    def __init__(self, raw_days: float = 30, hourly_days: float = 365, daily_days: float = 0):
+        """
+        Args:
+            raw_days: Days raw observations are kept
+            hourly_days: Days hourly rollups are kept before compaction to days
+            daily_days: Days daily rollups are kept (0 = forever)
+
+        Raises:
+            ValueError: If a tier is kept longer than the next coarser one.
+                Statistics read raw rows only for the edges of the hourly
+                tier and days from the daily tier, so raw rows older than
+                the hourly tier would be counted twice.
+        """
+        if raw_days > hourly_days:
+            raise ValueError(
+                f"RAW_RETENTION_DAYS ({raw_days:g}) must not exceed "
+                f"HOURLY_RETENTION_DAYS ({hourly_days:g})"
+            )
+        if daily_days and hourly_days > daily_days:
+            raise ValueError(
+                f"HOURLY_RETENTION_DAYS ({hourly_days:g}) must not exceed "
+                f"DAILY_RETENTION_DAYS ({daily_days:g}, 0 = forever)"
+            )
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self.daily_days = daily_days
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "raw_days": self.raw_days,
+            "hourly_days": self.hourly_days,
+            "daily_days": self.daily_days,
+        }
+
+
+class RetentionManager:
+    """Applies a RetentionPolicy in small chunks, in the background or on demand."""
+
+    def __init__(
+        self,
+        db: WeatherDatabase,
+        policy: RetentionPolicy,
+        chunk_size: int = 2000,
+        pause: float = 0.05,
+        interval: float = 3600,
+        vacuum_pages: int = 500,
+        leader: Optional[LeaderElection] = None,
+    ):
+        """
+        Initialize retention manager.
+
+        Args:
+            db: Database to maintain
+            policy: Retention policy
+            chunk_size: Rows deleted per transaction
+            pause: Seconds to wait between chunks (lets other writers in)
+            interval: Seconds between background retention passes
+            vacuum_pages: Pages freed per incremental vacuum step
+            leader: Background passes only run on the leader (default: always)
+        """
+        self.db = db
+        self.policy = policy
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self.leader = leader
+        self._task: Optional[asyncio.Task] = None
+
+    # -- Chunked steps (blocking, run in database worker threads) --
+
+    def delete_raw_chunk(self, now: Optional[float] = None) -> int:
+        """
+        Delete one chunk of raw observations older than raw_days.
+
+        They are already included in the hourly rollups.
+
+        Returns:
+            Number of rows deleted
+        """
+        cutoff = int((now or time.time()) - self.policy.raw_days * rollups.DAY)
+        with self.db.pool.connection() as conn:
+            # Rows are inserted in time order, so the oldest ids come first
+            deleted = conn.execute(
+                """
+                DELETE FROM weather_data WHERE id IN (
+                    SELECT id FROM weather_data
+                    WHERE timestamp < ?
+                    ORDER BY id
+                    LIMIT ?
+                )
+            """,
+                (cutoff, self.chunk_size),
+            ).rowcount
+            conn.commit()
+        return deleted
+
+    def compact_hourly_day(self, now: Optional[float] = None) -> int:
+        """
+        Compact the oldest expired day of hourly rollups into weather_daily.
+
+        Whole days are moved at once, so a day is never split between the
+        hourly and daily tiers.
+
+        Returns:
+            Number of hourly rows compacted
+        """
+        cutoff = int((now or time.time()) - self.policy.hourly_days * rollups.DAY)
+        cutoff -= cutoff % rollups.DAY  # Only whole days
+
+        with self.db.pool.connection() as conn:
+            oldest = conn.execute("SELECT MIN(hour) FROM weather_hourly").fetchone()[0]
+            if oldest is None or oldest >= cutoff:
+                return 0
+
+            day = oldest - oldest % rollups.DAY
+            rows = conn.execute(
+                """
+                SELECT city, source, count, temp_count, temp_sum, temp_min,
+                       temp_max, first_ts, first_temp, last_ts, last_temp
+                FROM weather_hourly
+                WHERE hour >= ? AND hour < ?
+                ORDER BY hour
+            """,
+                (day, day + rollups.DAY),
+            ).fetchall()
+
+            daily: Dict = defaultdict(lambda: [0, 0, None, None, None, None, None, None, None])
+            for (city, source, count, temp_count, temp_sum, temp_min, temp_max,
+                 first_ts, first_temp, last_ts, last_temp) in rows:
+                d = daily[(city, source)]
+                d[0] += count
+                d[1] += temp_count
+                if temp_sum is not None:
+                    d[2] = (d[2] or 0.0) + temp_sum
+                if temp_min is not None and (d[3] is None or temp_min < d[3]):
+                    d[3] = temp_min
+                if temp_max is not None and (d[4] is None or temp_max > d[4]):
+                    d[4] = temp_max
+                if first_ts is not None and (d[5] is None or first_ts < d[5]):
+                    d[5], d[6] = first_ts, first_temp
+                if last_ts is not None and (d[7] is None or last_ts >= d[7]):
+                    d[7], d[8] = last_ts, last_temp
+
+            rollups.add_daily(
+                conn,
+                [(city, source, day, *values) for (city, source), values in daily.items()],
+            )
+            conn.execute(
+                "DELETE FROM weather_hourly WHERE hour >= ? AND hour < ?",
+                (day, day + rollups.DAY),
+            )
+            conn.commit()
+
+        return len(rows)
+
+    def delete_daily_chunk(self, now: Optional[float] = None) -> int:
+        """
+        Delete the oldest expired day of daily rollups.
+
+        Returns:
+            Number of rows deleted (always 0 if daily rollups are kept forever)
+        """
+        if not self.policy.daily_days:
+            return 0
+
+        cutoff = int((now or time.time()) - self.policy.daily_days * rollups.DAY)
+        with self.db.pool.connection() as conn:
+            # One day at a time (one row per city and source)
+            deleted = conn.execute(
+                """
+                DELETE FROM weather_daily WHERE day = (
+                    SELECT MIN(day) FROM weather_daily WHERE day < ?
+                )
+            """,
+                (cutoff,),
+            ).rowcount
+            conn.commit()
+        return deleted
+
+    def incremental_vacuum(self) -> int:
+        """
+        Return up to vacuum_pages free pages to the OS.
+
+        Does nothing unless the database uses auto_vacuum=INCREMENTAL.
+
+        Returns:
+            Number of free pages left
+        """
+        with self.db.pool.connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            conn.execute(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})").fetchall()
+            conn.commit()
+            return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    # -- Passes --
+
+    async def run_once(self) -> Dict[str, int]:
+        """
+        Run one full retention pass in small chunks.
+
+        Returns:
+            Rows processed per step
+        """
+        totals = {"raw_deleted": 0, "hourly_compacted": 0, "daily_deleted": 0}
+        steps = [
+            ("raw_deleted", self.delete_raw_chunk),
+            ("hourly_compacted", self.compact_hourly_day),
+            ("daily_deleted", self.delete_daily_chunk),
+        ]
+
+        for name, step in steps:
+            while True:
+                done = await self.db.run(step)
+                totals[name] += done
+                if not done:
+                    break
+                await asyncio.sleep(self.pause)
+
+        # Vacuum in steps until there are no free pages left
+        free_pages = await self.db.run(self.incremental_vacuum)
+        while free_pages:
+            await asyncio.sleep(self.pause)
+            left = await self.db.run(self.incremental_vacuum)
+            if left >= free_pages:
+                break
+            free_pages = left
+
+        return totals
+
+    async def _run_forever(self):
+        while True:
+            if self.leader is not None and not self.leader.is_leader:
+                await asyncio.sleep(self.leader.seconds)
+                continue
+            try:
+                totals = await self.run_once()
+                if any(totals.values()):
+                    print(f"Retention pass: {totals}")
+            except Exception as e:
+                print(f"Retention pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start background retention passes (called from the FastAPI lifespan)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        """Stop background retention passes."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # -- Reporting --
+
+    def report(self) -> Dict:
+        """
+        Report database size and row counts per tier.
+
+        Returns:
+            Dictionary with file sizes, page statistics, tiers and policy
+        """
+        wal_path = f"{self.db.db_path}-wal"
+        tiers = {}
+
+        with self.db.pool.connection() as conn:
+            for tier, table, column in (
+                ("raw", "weather_data", "timestamp"),
+                ("hourly", "weather_hourly", "hour"),
+                ("daily", "weather_daily", "day"),
+            ):
+                rows, oldest, newest = conn.execute(
+                    f"SELECT COUNT(*), MIN({column}), MAX({column}) FROM {table}"
+                ).fetchone()
+                tiers[tier] = {"rows": rows, "oldest": oldest, "newest": newest}
+
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+        return {
+            "file_size_bytes": os.path.getsize(self.db.db_path),
+            "wal_size_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+            "page_size": page_size,
+            "page_count": page_count,
+            "freelist_count": freelist_count,
+            "incremental_vacuum": auto_vacuum == 2,
+            "tiers": tiers,
+            "policy": self.policy.as_dict(),
+        }
+
+
+def full_vacuum(db: WeatherDatabase):
+    """
+    Rebuild the database file once and switch it to incremental vacuum.
+
+    Holds an exclusive lock for the whole run; do this during maintenance.
+    """
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    conn.close()
+
+
+# Single instance for the app
+retention_manager = RetentionManager(
+    weather_db,
+    RetentionPolicy(
+        raw_days=float(os.getenv("RAW_RETENTION_DAYS", "30")),
+        hourly_days=float(os.getenv("HOURLY_RETENTION_DAYS", "365")),
+        daily_days=float(os.getenv("DAILY_RETENTION_DAYS", "0")),
+    ),
+    chunk_size=int(os.getenv("RETENTION_CHUNK_SIZE", "2000")),
+    interval=float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600")),
+    leader=leader_election,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weather database retention")
+    parser.add_argument("command", choices=["report", "compact", "vacuum"])
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        print(json.dumps(asyncio.run(retention_manager.run_once()), indent=2))
+    elif args.command == "vacuum":
+        full_vacuum(weather_db)
+
+    print(json.dumps(retention_manager.report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+Hourly rollups of weather observations.
+
+weather_hourly keeps, per city, source and hour: observation count,
+temperature count/sum/min/max and the first and last temperature of the
+hour. Rows are updated in the same transaction as the raw observations.
+
+Range queries combine rollups for the full hours inside the window with
+raw rows only for the partial hours at its edges, so the cost of a query
+depends on the number of hours, not on the number of observations.
+
+weather_daily has the same columns per day. The retention job (see
+retention.py) compacts whole days of old hourly rows into it, so a day
+is always in exactly one of the two tables. Windows that reach into the
+daily tier count the first day in full.
+"""
+
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+HOUR = 3600
+
+DAY = 24 * HOUR
+
+
+def _merge_sql(table: str, key: str) -> str:
+    """
+    Upsert that merges one aggregate row into a rollup table.
+
+    Args:
+        table: weather_hourly or weather_daily
+        key: Time bucket column ("hour" or "day")
+    """
+    return f"""
+    INSERT INTO {table}
+    (city, source, {key}, count, temp_count, temp_sum, temp_min, temp_max,
+     first_ts, first_temp, last_ts, last_temp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (city, source, {key}) DO UPDATE SET
+        count = count + excluded.count,
+        temp_count = temp_count + excluded.temp_count,
+        temp_sum = CASE
+            WHEN excluded.temp_sum IS NULL THEN temp_sum
+            WHEN temp_sum IS NULL THEN excluded.temp_sum
+            ELSE temp_sum + excluded.temp_sum END,
+        temp_min = CASE
+            WHEN excluded.temp_min IS NULL THEN temp_min
+            WHEN temp_min IS NULL OR excluded.temp_min < temp_min THEN excluded.temp_min
+            ELSE temp_min END,
+        temp_max = CASE
+            WHEN excluded.temp_max IS NULL THEN temp_max
+            WHEN temp_max IS NULL OR excluded.temp_max > temp_max THEN excluded.temp_max
+            ELSE temp_max END,
+        first_temp = CASE
+            WHEN excluded.first_ts IS NOT NULL
+                 AND (first_ts IS NULL OR excluded.first_ts < first_ts)
+            THEN excluded.first_temp ELSE first_temp END,
+        first_ts = CASE
+            WHEN excluded.first_ts IS NOT NULL
+                 AND (first_ts IS NULL OR excluded.first_ts < first_ts)
+            THEN excluded.first_ts ELSE first_ts END,
+        last_temp = CASE
+            WHEN excluded.last_ts IS NOT NULL
+                 AND (last_ts IS NULL OR excluded.last_ts >= last_ts)
+            THEN excluded.last_temp ELSE last_temp END,
+        last_ts = CASE
+            WHEN excluded.last_ts IS NOT NULL
+                 AND (last_ts IS NULL OR excluded.last_ts >= last_ts)
+            THEN excluded.last_ts ELSE last_ts END
+"""
+
+
+HOURLY_UPSERT_SQL = _merge_sql("weather_hourly", "hour")
+DAILY_UPSERT_SQL = _merge_sql("weather_daily", "day")
+
+
+def hour_start(timestamp: int) -> int:
+    """Start of the hour (epoch seconds) containing timestamp."""
+    return timestamp - timestamp % HOUR
+
+
+def add_observations(
+    conn: sqlite3.Connection,
+    observations: Iterable[Tuple[str, str, Optional[float], int]],
+):
+    """
+    Add observations to the hourly rollups (caller commits).
+
+    Args:
+        conn: Database connection (in the same transaction as the raw insert)
+        observations: (normalized city, source, temperature, timestamp)
+    """
+    rows = []
+    for city, source, temperature, timestamp in observations:
+        has_temp = temperature is not None
+        temp_ts = timestamp if has_temp else None
+        rows.append(
+            (
+                city, source, hour_start(timestamp),
+                1, 1 if has_temp else 0, temperature, temperature, temperature,
+                temp_ts, temperature, temp_ts, temperature,
+            )
+        )
+    conn.executemany(HOURLY_UPSERT_SQL, rows)
+
+
+def add_daily(conn: sqlite3.Connection, rows: Iterable[Tuple]):
+    """
+    Merge aggregate rows into the daily rollups (caller commits).
+
+    Args:
+        conn: Database connection
+        rows: (city, source, day, count, temp_count, temp_sum, temp_min,
+            temp_max, first_ts, first_temp, last_ts, last_temp)
+    """
+    conn.executemany(DAILY_UPSERT_SQL, rows)
+
+
+def _full_hours(start: int, end: int) -> Tuple[int, int]:
+    """
+    Split a window into full hours covered by rollups.
+
+    Returns:
+        (full_start, full_end): rollup hours are full_start <= hour < full_end,
+        raw rows cover [start, full_start) and [full_end, end]
+    """
+    full_start = -(-start // HOUR) * HOUR  # Round up to the next hour
+    full_end = hour_start(end)
+    if full_end < full_start:
+        full_end = full_start
+    return full_start, full_end
+
+
+def summarize(
+    conn: sqlite3.Connection, city: str, start: int, end: int, edges: bool = True
+) -> Dict[str, Dict]:
+    """
+    Summarize observations of a city per source over [start, end].
+
+    Args:
+        conn: Database connection
+        city: Normalized city name
+        start: Window start (epoch seconds)
+        end: Window end (epoch seconds, usually now)
+        edges: Also look up the first and last temperature (skipping this
+            saves six queries when only counts and min/avg/max are needed)
+
+    Returns:
+        Dictionary of source -> {count, temp_count, temp_sum, temp_min,
+        temp_max, first_ts, first_temp, last_ts, last_temp}
+    """
+    full_start, full_end = _full_hours(start, end)
+    summaries: Dict[str, Dict] = {}
+
+    def merge(source, count, temp_count, temp_sum, temp_min, temp_max):
+        summary = summaries.setdefault(
+            source,
+            {
+                "count": 0, "temp_count": 0, "temp_sum": 0.0,
+                "temp_min": None, "temp_max": None,
+                "first_ts": None, "first_temp": None,
+                "last_ts": None, "last_temp": None,
+            },
+        )
+        summary["count"] += count
+        summary["temp_count"] += temp_count or 0
+        summary["temp_sum"] += temp_sum or 0.0
+        if temp_min is not None and (summary["temp_min"] is None or temp_min < summary["temp_min"]):
+            summary["temp_min"] = temp_min
+        if temp_max is not None and (summary["temp_max"] is None or temp_max > summary["temp_max"]):
+            summary["temp_max"] = temp_max
+
+    def merge_edge(source, first_ts, first_temp, last_ts, last_temp):
+        summary = summaries[source]
+        if first_ts is not None and (summary["first_ts"] is None or first_ts < summary["first_ts"]):
+            summary["first_ts"], summary["first_temp"] = first_ts, first_temp
+        if last_ts is not None and (summary["last_ts"] is None or last_ts >= summary["last_ts"]):
+            summary["last_ts"], summary["last_temp"] = last_ts, last_temp
+
+    # Full hours from rollups
+    if full_end > full_start:
+        for row in conn.execute(
+            """
+            SELECT source, SUM(count), SUM(temp_count), SUM(temp_sum),
+                   MIN(temp_min), MAX(temp_max)
+            FROM weather_hourly
+            WHERE city = ? AND hour >= ? AND hour < ?
+            GROUP BY source
+        """,
+            (city, full_start, full_end),
+        ):
+            merge(*row)
+
+    # Days that were compacted out of the hourly tier
+    for row in conn.execute(
+        """
+        SELECT source, SUM(count), SUM(temp_count), SUM(temp_sum),
+               MIN(temp_min), MAX(temp_max)
+        FROM weather_daily
+        WHERE city = ? AND day > ? AND day <= ?
+        GROUP BY source
+    """,
+        (city, start - DAY, end),
+    ):
+        merge(*row)
+
+    # Partial hours at the edges from raw rows
+    raw_where = """
+        WHERE city = ?
+        AND ((timestamp >= ? AND timestamp < ?) OR (timestamp >= ? AND timestamp <= ?))
+    """
+    raw_params = (city, start, full_start, full_end, end)
+    for row in conn.execute(
+        f"""
+        SELECT source, COUNT(*), COUNT(temperature), SUM(temperature),
+               MIN(temperature), MAX(temperature)
+        FROM weather_data {raw_where}
+        GROUP BY source
+    """,
+        raw_params,
+    ):
+        merge(*row)
+
+    if not summaries or not edges:
+        return summaries
+
+    # First and last temperature per source. SQLite returns the bare
+    # columns from the row that holds the MIN()/MAX() value.
+    for source, first_ts, first_temp in conn.execute(
+        """
+        SELECT source, MIN(first_ts), first_temp FROM weather_daily
+        WHERE city = ? AND day > ? AND day <= ? AND first_ts IS NOT NULL
+        GROUP BY source
+    """,
+        (city, start - DAY, end),
+    ):
+        merge_edge(source, first_ts, first_temp, None, None)
+    for source, last_ts, last_temp in conn.execute(
+        """
+        SELECT source, MAX(last_ts), last_temp FROM weather_daily
+        WHERE city = ? AND day > ? AND day <= ? AND last_ts IS NOT NULL
+        GROUP BY source
+    """,
+        (city, start - DAY, end),
+    ):
+        merge_edge(source, None, None, last_ts, last_temp)
+
+    if full_end > full_start:
+        for source, first_ts, first_temp in conn.execute(
+            """
+            SELECT source, MIN(first_ts), first_temp FROM weather_hourly
+            WHERE city = ? AND hour >= ? AND hour < ? AND first_ts IS NOT NULL
+            GROUP BY source
+        """,
+            (city, full_start, full_end),
+        ):
+            merge_edge(source, first_ts, first_temp, None, None)
+        for source, last_ts, last_temp in conn.execute(
+            """
+            SELECT source, MAX(last_ts), last_temp FROM weather_hourly
+            WHERE city = ? AND hour >= ? AND hour < ? AND last_ts IS NOT NULL
+            GROUP BY source
+        """,
+            (city, full_start, full_end),
+        ):
+            merge_edge(source, None, None, last_ts, last_temp)
+
+    for source, first_ts, first_temp in conn.execute(
+        f"""
+        SELECT source, MIN(timestamp), temperature FROM weather_data {raw_where}
+        AND temperature IS NOT NULL
+        GROUP BY source
+    """,
+        raw_params,
+    ):
+        merge_edge(source, first_ts, first_temp, None, None)
+    for source, last_ts, last_temp in conn.execute(
+        f"""
+        SELECT source, MAX(timestamp), temperature FROM weather_data {raw_where}
+        AND temperature IS NOT NULL
+        GROUP BY source
+    """,
+        raw_params,
+    ):
+        merge_edge(source, None, None, last_ts, last_temp)
+
+    return summaries
+
+
+def hour_of_day_averages(
+    conn: sqlite3.Connection, city: str, start: int, end: int
+) -> List[Tuple[int, float]]:
+    """
+    Average temperature per hour of day (UTC) over [start, end].
+
+    Only the raw and hourly tiers have hour-of-day information, so days
+    already compacted into weather_daily are not included.
+
+    Args:
+        conn: Database connection
+        city: Normalized city name
+        start: Window start (epoch seconds)
+        end: Window end (epoch seconds)
+
+    Returns:
+        List of (hour of day, average temperature), sorted by hour
+    """
+    full_start, full_end = _full_hours(start, end)
+    sums: Dict[int, List[float]] = {}
+
+    rows = []
+    if full_end > full_start:
+        rows += conn.execute(
+            """
+            SELECT (hour / 3600) % 24, SUM(temp_sum), SUM(temp_count)
+            FROM weather_hourly
+            WHERE city = ? AND hour >= ? AND hour < ?
+            GROUP BY 1
+        """,
+            (city, full_start, full_end),
+        ).fetchall()
+    rows += conn.execute(
+        """
+        SELECT (timestamp / 3600) % 24, SUM(temperature), COUNT(temperature)
+        FROM weather_data
+        WHERE city = ?
+        AND ((timestamp >= ? AND timestamp < ?) OR (timestamp >= ? AND timestamp <= ?))
+        GROUP BY 1
+    """,
+        (city, start, full_start, full_end, end),
+    ).fetchall()
+
+    for hour, temp_sum, temp_count in rows:
+        total = sums.setdefault(hour, [0.0, 0])
+        total[0] += temp_sum or 0.0
+        total[1] += temp_count or 0
+
+    return [
+        (hour, total[0] / total[1])
+        for hour, total in sorted(sums.items())
+        if total[1] > 0
+    ]
@@ -0,0 +1,134 @@
+"""
+Provider routing by coverage region.
+
+Some providers only cover part of the world (FMI: Finland). Before the
+providers are called, the city is geocoded once (the coordinates are
+cached and reused by Yr.no) and providers whose region doesn't contain
+it are skipped, so e.g. "Tokyo" never reaches opendata.fmi.fi.
+
+Regions are a bounding box for a quick reject plus a coarse polygon
+that follows the land borders and runs through the sea on the coasts,
+so coastal cities and islands (Åland) are inside.
+"""
+
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# (lon, lat) vertices
+Polygon = Sequence[Tuple[float, float]]
+
+
+def point_in_polygon(lat: float, lon: float, polygon: Polygon) -> bool:
+    """Ray casting test: is the point inside the polygon?"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lon_i, lat_i = polygon[i]
+        lon_j, lat_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if lon < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+
+class Region:
+    """Coverage area of a provider."""
+
+    def __init__(self, name: str, polygon: Polygon):
+        """
+        Args:
+            name: Region name
+            polygon: Outline as (lon, lat) vertices
+        """
+        self.name = name
+        self.polygon = polygon
+        lons = [lon for lon, _ in polygon]
+        lats = [lat for _, lat in polygon]
+        self.bbox = (min(lats), min(lons), max(lats), max(lons))
+
+    def contains(self, lat: float, lon: float) -> bool:
+        """Check whether coordinates are inside the region."""
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+            return False
+        return point_in_polygon(lat, lon, self.polygon)
+
+
+# Finland: Swedish and Norwegian land border from Tornio round to the
+# Russian border, down to the Gulf of Finland, then through the Baltic
+# Sea and the middle of the Gulf of Bothnia back to Tornio
+FINLAND = Region(
+    "Finland",
+    [
+        (24.00, 65.75), (23.50, 66.40), (23.55, 67.20), (23.30, 67.90),
+        (22.35, 68.50), (21.00, 68.95), (20.50, 69.05), (21.30, 69.35),
+        (22.40, 68.80), (23.90, 68.85), (24.90, 68.65), (25.70, 68.95),
+        (25.80, 69.45), (26.40, 69.95), (27.00, 70.15), (28.20, 70.15),
+        (28.45, 69.85), (29.05, 69.05), (28.80, 68.90), (28.45, 68.50),
+        (29.35, 68.10), (30.05, 67.70), (29.15, 66.90), (30.15, 65.70),
+        (29.70, 64.90), (30.65, 64.20), (30.05, 63.80), (31.65, 62.90),
+        (31.25, 62.40), (29.75, 61.50), (28.85, 61.20), (27.85, 60.55),
+        (27.00, 59.90), (22.50, 59.50), (19.50, 59.60), (18.80, 60.20),
+        (19.50, 61.50), (19.80, 63.00), (21.00, 63.80), (23.00, 64.90),
+    ],
+)
+
+# Returns cached coordinates {"lat", "lon"} for a city, or None
+Geocode = Callable[[str], Awaitable[Optional[Dict[str, float]]]]
+
+
+class ProviderRouter:
+    """Chooses the providers that can answer for a city."""
+
+    def __init__(
+        self,
+        geocode: Geocode,
+        regions: Dict[str, Region],
+        unknown_places: Optional[Dict[str, Callable[[str], Awaitable[bool]]]] = None,
+    ):
+        """
+        Args:
+            geocode: City-to-coordinates lookup (shared, cached geocoder)
+            regions: Source name -> coverage region (sources not listed
+                cover the whole world)
+            unknown_places: Source name -> async check for places the
+                source is known not to have (negative cache)
+        """
+        self.geocode = geocode
+        self.regions = regions
+        self.unknown_places = unknown_places or {}
+        self.skipped = 0
+
+    async def route(self, city: str, sources: Iterable[str]) -> List[str]:
+        """
+        Get the sources that cover a city.
+
+        The city is only geocoded if some source has a region. If it can't
+        be geocoded, regional sources are still tried (by place name)
+        unless they are known not to have the place.
+
+        Args:
+            city: City name
+            sources: Candidate sources, in order of preference
+
+        Returns:
+            Sources to call, in the same order
+        """
+        sources = list(sources)
+        routed = [
+            source for source in sources
+            if not (source in self.unknown_places and await self.unknown_places[source](city))
+        ]
+
+        if any(source in self.regions for source in routed):
+            coords = await self.geocode(city)
+            if coords is not None:
+                routed = [
+                    source for source in routed
+                    if source not in self.regions
+                    or self.regions[source].contains(coords["lat"], coords["lon"])
+                ]
+
+        self.skipped += len(sources) - len(routed)
+        return routed
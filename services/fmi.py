@@ -96,11 +96,103 @@ FMI (Ilmatieteen laitos) API integraatio.
 
 FMI tarjoaa avoimen WFS-rajapinnan, josta voidaan hakea havaintodataa XML-muodossa.
 Tämä moduuli hakee säätiedot mille tahansa paikkakunnalle Suomessa.
+
+Usean paikkakunnan havainnot voidaan hakea yhdellä kyselyllä
+(get_current_weather_many): kyselyyn annetaan monta place-parametria, ja
+vastauksen asemat yhdistetään paikkakuntiin koordinaattien perusteella.
 """
 
-import httpx
-import xmltodict
-from typing import Optional, Dict, Any
+import asyncio
+import math
+import os
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, Iterable, List, Tuple, Union
+
+from cache import TTLCache
+from cities import normalize_city
+from shared_state import create_cache
+from services.geocoding import Geocoder, geocoder as default_geocoder
+from services.http_client import HTTPClientManager, http_client
+
+# XML-nimiavaruudet FMI:n simple-muotoisessa vastauksessa
+BSWFS_NS = "{http://xml.fmi.fi/schema/wfs/2.0}"
+WFS_NS = "{http://www.opengis.net/wfs/2.0}"
+GML_NS = "{http://www.opengis.net/gml/3.2}"
+
+ELEMENT_TAG = f"{BSWFS_NS}BsWfsElement"
+MEMBER_TAG = f"{WFS_NS}member"
+NAME_TAG = f"{BSWFS_NS}ParameterName"
+VALUE_TAG = f"{BSWFS_NS}ParameterValue"
+POSITION_PATH = f"{BSWFS_NS}Location/{GML_NS}Point/{GML_NS}pos"
+
+# Parametrit, joita oikeasti käytetään (FMI palauttaa oletuksena paljon enemmän)
+PARAMETERS = ("t2m", "ws_10min", "rh", "p_sea", "ri_10min")
+
+
+class FMIObservationParser:
+    """
+    Inkrementaalinen jäsennin FMI:n WFS simple -vastaukselle.
+
+    XML syötetään paloina sitä mukaa kuin sitä tulee verkosta, ja jokaisesta
+    wfs:member-elementistä talletetaan vain parametrin viimeisin arvo.
+    Käsitellyt elementit poistetaan heti, joten muistinkäyttö pysyy pienenä
+    vastauksen koosta riippumatta.
+    """
+
+    def __init__(self, parameters: Iterable[str] = PARAMETERS, by_station: bool = False):
+        """
+        Args:
+            parameters: Parametrit, joiden arvot kerätään
+            by_station: Kerätäänkö arvot asemittain (usean paikan kysely)
+        """
+        self.parameters = set(parameters)
+        self.by_station = by_station
+        self.latest: Dict[str, str] = {}
+        # Aseman koordinaatit (lat, lon) -> parametrin viimeisin arvo
+        self.stations: Dict[Tuple[float, float], Dict[str, str]] = {}
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root: Optional[ET.Element] = None
+
+    def feed(self, chunk: bytes):
+        """Syöttää seuraavan palan XML:ää jäsentimelle."""
+        self._parser.feed(chunk)
+        self._process_events()
+
+    def close(self) -> Dict[str, str]:
+        """
+        Lopettaa jäsennyksen.
+
+        Returns:
+            Parametrin nimi -> viimeisin arvo (merkkijonona)
+        """
+        self._parser.close()
+        self._process_events()
+        return self.latest
+
+    def _process_events(self):
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+                continue
+
+            if elem.tag == ELEMENT_TAG:
+                param_name = elem.findtext(NAME_TAG)
+                param_value = elem.findtext(VALUE_TAG)
+                if (
+                    param_name in self.parameters
+                    and param_value
+                    and param_value != "NaN"
+                ):
+                    self.latest[param_name] = param_value
+                    if self.by_station:
+                        lat, lon = elem.findtext(POSITION_PATH).split()
+                        station = self.stations.setdefault((float(lat), float(lon)), {})
+                        station[param_name] = param_value
+            elif elem.tag == MEMBER_TAG and self._root is not None:
+                # Käsitelty member pois muistista
+                self._root.clear()
 
 
 class FMIService:
@@ -109,8 +201,63 @@ class FMIService:
     Hakee säätiedot Ilmatieteen laitoksen avoimesta datasta.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        http: Optional[HTTPClientManager] = None,
+        window_minutes: int = 60,
+        unknown_place_ttl: float = 24 * 3600,
+        geocoder: Optional[Geocoder] = None,
+        bulk_size: int = 20,
+        max_station_distance_km: float = 50.0,
+        unknown_places=None,
+    ):
+        """
+        Args:
+            http: Jaettu HTTP-asiakas (oletuksena sovelluksen yhteinen pooli)
+            window_minutes: Kuinka pitkältä ajalta havaintoja pyydetään
+            unknown_place_ttl: Kuinka kauan FMI:lle tuntematon paikka muistetaan
+            geocoder: Paikkakuntien koordinaatit usean paikan kyselyyn
+                (oletuksena yhteinen geokooderi ja sen välimuisti)
+            bulk_size: Paikkakuntia yhdessä usean paikan kyselyssä
+            max_station_distance_km: Suurin etäisyys paikkakunnasta asemaan
+            unknown_places: Välimuisti tuntemattomille paikoille (oletuksena
+                prosessin oma TTLCache, ks. shared_state.py)
+        """
         self.base_url = "https://opendata.fmi.fi/wfs"
+        self.http = http or http_client
+        self.window_minutes = window_minutes
+        self.geocoder = geocoder or default_geocoder
+        self.bulk_size = bulk_size
+        self.max_station_distance_km = max_station_distance_km
+        # Negatiivinen välimuisti: paikat, joita FMI ei tunne (vastaus 400)
+        self.unknown_places = (
+            unknown_places if unknown_places is not None else TTLCache(max_size=5000)
+        )
+        self.unknown_place_ttl = unknown_place_ttl
+
+    async def is_unknown_place(self, place: str) -> bool:
+        """Onko FMI hiljattain vastannut, ettei paikkaa löydy?"""
+        return await self.unknown_places.aget(normalize_city(place)) is not None
+
+    def _query_params(self, place: Union[str, List[str]]) -> Dict[str, Any]:
+        """
+        WFS-kyselyn parametrit.
+
+        Pyydetään vain tarvittavat parametrit lyhyeltä aikaväliltä, jotta
+        vastaus pysyy pienenä (oletuskysely palauttaa 12 tuntia kaikkia
+        parametreja). Lista paikkoja lähetetään toistettuna place-parametrina.
+        """
+        starttime = datetime.now(timezone.utc) - timedelta(minutes=self.window_minutes)
+        return {
+            "service": "WFS",
+            "version": "2.0.0",
+            "request": "getFeature",
+            "storedquery_id": "fmi::observations::weather::simple",
+            "place": place,
+            "parameters": ",".join(PARAMETERS),
+            "starttime": starttime.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "timestep": "10",
+        }
 
     async def get_current_weather(
         self, place: str = "Oulu"
@@ -118,51 +265,145 @@ class FMIService:
         """
         Hakee nykyisen sään annetulle paikkakunnalle FMI:ltä.
 
+        Vastaus jäsennetään sitä mukaa kuin se saapuu verkosta. Paikoille,
+        joita FMI ei tunne, ei tehdä uutta pyyntöä ennen kuin
+        unknown_place_ttl on kulunut.
+
         Args:
             place (str): Kaupungin nimi (esim. "Helsinki", "Tampere", "Oulu")
 
         Returns:
-            dict | None: Säätiedot tai None jos haku epäonnistui
+            dict | None: Säätiedot, tai None jos FMI ei tunne paikkaa
+
+        Raises:
+            httpx.HTTPError: Jos haku epäonnistuu (virhe näkyy aggregaattorissa
+                lähteen tilana "error")
+            ET.ParseError: Jos vastaus ei ole kelvollista XML:ää
         """
-        try:
-            params = {
-                "service": "WFS",
-                "version": "2.0.0",
-                "request": "getFeature",
-                "storedquery_id": "fmi::observations::weather::simple",
-                "place": place,
-            }
+        if await self.is_unknown_place(place):
+            return None
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(self.base_url, params=params)
-                response.raise_for_status()
+        parser = FMIObservationParser()
+
+        async with self.http.stream(
+            "GET", self.base_url, params=self._query_params(place)
+        ) as response:
+            if response.status_code == 400:
+                # FMI vastaa 400, kun paikkaa ei löydy
+                await self.unknown_places.aset(
+                    normalize_city(place), True, self.unknown_place_ttl
+                )
+                print(f"⚠️ FMI: paikkaa '{place}' ei löytynyt")
+                return None
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                parser.feed(chunk)
+
+        return self._parse_latest_weather(parser.close())
+
+    async def get_current_weather_many(self, places: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Hakee nykyisen sään monelle paikkakunnalle kerralla.
 
-                data = xmltodict.parse(response.text)
-                return self._parse_latest_weather(data)
+        Paikat haetaan bulk_size kappaleen kyselyinä (rinnakkain), ja
+        vastaus jäsennetään kerran asemittain. Jokainen paikkakunta saa
+        lähimmän vastauksessa olevan aseman arvot, jos asema on alle
+        max_station_distance_km päässä.
 
-        except Exception as e:
-            print(f"❌ FMI säätietojen haku epäonnistui ({place}): {e}")
+        Paikat, joille ei saatu tulosta (esim. osa kyselyistä epäonnistui
+        tai joukossa oli FMI:lle tuntematon paikka, jolloin koko kysely
+        palauttaa 400), puuttuvat palautuksesta; ne voi hakea erikseen
+        get_current_weather-metodilla.
+
+        Args:
+            places: Kaupunkien nimet
+
+        Returns:
+            dict: Paikkakunta -> säätiedot
+
+        Raises:
+            Exception: Ensimmäisen kyselyn virhe, jos kaikki kyselyt epäonnistuivat
+        """
+        places = list(places)
+        unknown = await asyncio.gather(*(self.is_unknown_place(place) for place in places))
+        places = [place for place, is_unknown in zip(places, unknown) if not is_unknown]
+        chunks = [
+            places[i:i + self.bulk_size] for i in range(0, len(places), self.bulk_size)
+        ]
+        results: Dict[str, Dict[str, Any]] = {}
+        errors = []
+        for chunk, chunk_results in zip(
+            chunks,
+            await asyncio.gather(
+                *(self._fetch_many(chunk) for chunk in chunks), return_exceptions=True
+            ),
+        ):
+            if isinstance(chunk_results, BaseException):
+                print(f"❌ FMI säätietojen haku epäonnistui ({len(chunk)} paikkaa): {chunk_results}")
+                errors.append(chunk_results)
+            else:
+                results.update(chunk_results)
+        if errors and len(errors) == len(chunks):
+            raise errors[0]
+        return results
+
+    async def _fetch_many(self, places: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Yksi usean paikan kysely ja asemien yhdistäminen paikkakuntiin."""
+        parser = FMIObservationParser(by_station=True)
+
+        async with self.http.stream(
+            "GET", self.base_url, params=self._query_params(places)
+        ) as response:
+            if response.status_code == 400:
+                # Joku paikoista on FMI:lle tuntematon; haetaan erikseen
+                print(f"⚠️ FMI: usean paikan kysely hylättiin ({len(places)} paikkaa)")
+                return {}
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                parser.feed(chunk)
+        parser.close()
+
+        coordinates = await asyncio.gather(
+            *(self.geocoder.get_coordinates(place) for place in places)
+        )
+        results = {}
+        for place, coords in zip(places, coordinates):
+            station = self._nearest_station(coords, parser.stations)
+            if station is not None:
+                results[place] = self._parse_latest_weather(parser.stations[station])
+        return results
+
+    def _nearest_station(
+        self,
+        coords: Optional[Dict[str, float]],
+        stations: Dict[Tuple[float, float], Dict[str, str]],
+    ) -> Optional[Tuple[float, float]]:
+        """Lähin asema paikkakunnan koordinaateista, tai None jos liian kaukana."""
+        if coords is None or not stations:
             return None
 
-    def _parse_latest_weather(self, xml_data: dict) -> Dict[str, Any]:
+        def distance_km(station: Tuple[float, float]) -> float:
+            # Tasoapproksimaatio riittää muutaman kymmenen kilometrin matkoille
+            lat, lon = station
+            dx = (lon - coords["lon"]) * math.cos(math.radians(coords["lat"]))
+            dy = lat - coords["lat"]
+            return 111.2 * math.hypot(dx, dy)
+
+        nearest = min(stations, key=distance_km)
+        if distance_km(nearest) > self.max_station_distance_km:
+            return None
+        return nearest
+
+    def _parse_latest_weather(self, latest_data: Dict[str, str]) -> Dict[str, Any]:
         """
-        Poimii uusimman säädatan FMI:n XML-vastauksesta.
+        Muuntaa FMI:n viimeisimmät parametriarvot yhtenäiseen muotoon.
 
-        FMI palauttaa mittausparametrit erillisinä riveinä.
-        Tässä ne yhdistetään yhdeksi sanakirjaksi.
+        Args:
+            latest_data: FMIObservationParser.close() -palautusarvo
         """
-        members = xml_data.get("wfs:FeatureCollection", {}).get("wfs:member", [])
-        if not members:
+        if not latest_data:
             return {}
 
-        latest_data = {}
-        for member in members:
-            element = member.get("BsWfs:BsWfsElement", {})
-            param_name = element.get("BsWfs:ParameterName")
-            param_value = element.get("BsWfs:ParameterValue")
-            if param_value and param_value != "NaN":
-                latest_data[param_name] = param_value
-
         # Muutetaan datat yhtenäiseen muotoon
         weather_data = {
             "temperature": float(latest_data.get("t2m", 0)),
@@ -210,4 +451,7 @@ class FMIService:
 
 
 # Yksittäinen instanssi muiden moduulien käytettäväksi
-fmi_service = FMIService()
+fmi_service = FMIService(
+    bulk_size=int(os.getenv("FMI_BULK_SIZE", "20")),
+    unknown_places=create_cache("fmi_unknown_places", max_size=5000),
+)
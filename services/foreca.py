@@ -2,80 +2,242 @@
 Foreca Weather API integraatio.
 
 Tämä moduuli hoitaa:
-1. Autentikoinnin (token-haku)
-2. Säätietojen hakemisen
+1. Autentikoinnin (token-haku ja uudelleenkäyttö)
+2. Paikkakuntahaun (kaupungin nimi -> Foreca location id)
+3. Säätietojen hakemisen
 """
 
-import httpx
+import asyncio
 import os
+import time
+from urllib.parse import quote
 from typing import Optional, Dict, Any
 
+from cache import SingleFlight, TTLCache
+from cities import normalize_city
+from shared_state import create_cache
+from services.http_client import HTTPClientManager, http_client
+
+# Valmiiksi tiedossa olevat id:t (ei tallenneta välimuistiin importissa,
+# koska se voi olla workerien yhteinen, ks. shared_state.py)
+KNOWN_LOCATION_IDS = {normalize_city("Oulu"): "100643492"}
+
+
+class ForecaAuthError(Exception):
+    """Foreca ei antanut access tokenia (väärät tunnukset tai palvelu alhaalla)."""
+
+
+class ForecaTokenManager:
+    """
+    Foreca access tokenin hallinta.
+
+    Token haetaan kerran ja sitä käytetään, kunnes se on vanhenemassa.
+    Uusi token haetaan taustalla ennen vanhenemista, ja samanaikaiset
+    uusimiset yhdistetään yhdeksi pyynnöksi.
+    """
+
+    def __init__(
+        self,
+        service: "ForecaService",
+        expire_hours: int = 2,
+        refresh_margin: float = 600.0,
+    ):
+        """
+        Args:
+            service: Foreca-palvelu, jonka tunnuksilla token haetaan
+            expire_hours: Tokenin voimassaoloaika tunteina
+            refresh_margin: Kuinka monta sekuntia ennen vanhenemista uusitaan
+        """
+        self.service = service
+        self.expire_hours = expire_hours
+        self.refresh_margin = refresh_margin
+        self.token: Optional[str] = None
+        self.expires_at = 0.0
+        self._single_flight = SingleFlight()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def get_token(self, force: bool = False) -> Optional[str]:
+        """
+        Palauttaa voimassa olevan tokenin.
+
+        Args:
+            force: Hae uusi token, vaikka vanha olisi voimassa (esim. 401)
+
+        Returns:
+            Token string tai None jos haku epäonnistuu
+        """
+        now = time.time()
+
+        if not force and self.token and now < self.expires_at:
+            # Uusitaan taustalla, kun vanheneminen lähestyy
+            if now >= self.expires_at - self.refresh_margin:
+                self._schedule_refresh()
+            return self.token
+
+        return await self._single_flight.do("token", self._refresh)
+
+    def invalidate(self):
+        """Merkitsee nykyisen tokenin käyttökelvottomaksi."""
+        self.token = None
+        self.expires_at = 0.0
+
+    def _schedule_refresh(self):
+        """Käynnistää taustauusinnan, jos sellainen ei jo ole käynnissä."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(
+                self._single_flight.do("token", self._refresh)
+            )
+
+    async def _refresh(self) -> Optional[str]:
+        """Hakee uuden tokenin Foreca API:sta."""
+        try:
+            response = await self.service.http.post(
+                f"{self.service.base_url}/authorize/token?expire_hours={self.expire_hours}",
+                json={"user": self.service.user, "password": self.service.password}
+            )
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            print(f"❌ Foreca autentikointi epäonnistui: {e}")
+            return None
+
+        self.token = data.get("access_token")
+        expires_in = data.get("expires_in") or self.expire_hours * 3600
+        self.expires_at = time.time() + float(expires_in)
+        return self.token
+
 
 class ForecaService:
     """
     Foreca API -palvelu.
     """
-    
-    def __init__(self):
+
+    def __init__(self, http: Optional[HTTPClientManager] = None, location_ids=None):
+        """
+        Args:
+            http: Jaettu HTTP-asiakas (oletuksena sovelluksen yhteinen pooli)
+            location_ids: Välimuisti paikkakuntien id:ille (oletuksena
+                prosessin oma TTLCache, ks. shared_state.py)
+        """
         self.base_url = "https://pfa.foreca.com"
         self.user = os.getenv("FORECA_USER")
         self.password = os.getenv("FORECA_PASSWORD")
-        self.oulu_location_id = "100643492"
-    
+        self.http = http or http_client
+        self.tokens = ForecaTokenManager(self)
+        # Paikkakuntien id:t välimuistissa (KNOWN_LOCATION_IDS katsotaan ensin)
+        self.location_ids = location_ids if location_ids is not None else TTLCache(max_size=5000)
+        self.location_ttl = 30 * 24 * 3600
+        self._location_lookups = SingleFlight()
+
+    @property
+    def enabled(self) -> bool:
+        """Foreca on käytössä vain, jos tunnukset on asetettu."""
+        return bool(self.user and self.password)
+
     async def get_token(self) -> Optional[str]:
         """
-        Hakee access token Foreca API:sta.
-        
+        Hakee access tokenin (välimuistista, jos voimassa).
+
         Returns:
             Token string tai None jos epäonnistuu
         """
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/authorize/token?expire_hours=2",
-                    json={"user": self.user, "password": self.password}
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data.get("access_token")
-        except Exception as e:
-            print(f"❌ Foreca autentikointi epäonnistui: {e}")
-            return None
-    
-    async def get_current_weather(self) -> Optional[Dict[str, Any]]:
+        return await self.tokens.get_token()
+
+    async def _authorized_get(self, path: str, **kwargs):
         """
-        Hakee nykyisen sään Ouluun.
-        
-        Returns:
-            Dictionary säätiedoilla tai None jos haku epäonnistuu
+        Tekee autentikoidun GET-pyynnön.
+
+        Jos Foreca vastaa 401, token uusitaan ja pyyntö yritetään kerran uudelleen.
+
+        Raises:
+            ForecaAuthError: Jos tokenia ei saada
+            httpx.HTTPStatusError: Jos Foreca vastaa virheellä
         """
-        token = await self.get_token()
+        token = await self.tokens.get_token()
         if not token:
+            raise ForecaAuthError("Foreca-tokenia ei saatu")
+
+        response = await self.http.get(
+            f"{self.base_url}{path}",
+            headers={"Authorization": f"Bearer {token}"},
+            **kwargs
+        )
+        if response.status_code == 401:
+            self.tokens.invalidate()
+            token = await self.tokens.get_token(force=True)
+            if not token:
+                raise ForecaAuthError("Foreca-tokenia ei saatu")
+            response = await self.http.get(
+                f"{self.base_url}{path}",
+                headers={"Authorization": f"Bearer {token}"},
+                **kwargs
+            )
+
+        response.raise_for_status()
+        return response.json()
+
+    async def get_location_id(self, city: str) -> Optional[str]:
+        """
+        Hakee Foreca location id:n kaupungin nimellä.
+
+        Args:
+            city: Kaupungin nimi (esim. "Helsinki", "Tampere")
+
+        Returns:
+            Location id tai None jos paikkaa ei löydy
+        """
+        key = normalize_city(city)
+        location_id = KNOWN_LOCATION_IDS.get(key) or await self.location_ids.aget(key)
+        if location_id is not None:
+            return location_id
+
+        return await self._location_lookups.do(
+            key, lambda: self._search_location(key, city)
+        )
+
+    async def _search_location(self, key: str, city: str) -> Optional[str]:
+        """Hakee paikkakunnan Forecan hakurajapinnasta ja tallentaa id:n."""
+        data = await self._authorized_get(f"/api/v1/location/search/{quote(city)}")
+        locations = data.get("locations", [])
+        if not locations:
+            print(f"⚠️ Foreca: paikkakuntaa '{city}' ei löytynyt")
             return None
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                headers = {"Authorization": f"Bearer {token}"}
-                response = await client.get(
-                    f"{self.base_url}/api/v1/current/{self.oulu_location_id}",
-                    headers=headers
-                )
-                response.raise_for_status()
-                data = response.json()
-                
-                current = data.get("current", {})
-                return {
-                    "temperature": current.get("temperature"),
-                    "weather": current.get("symbolPhrase"),
-                    "wind_speed": current.get("windSpeed"),
-                    "humidity": current.get("relHumidity"),
-                    "pressure": current.get("pressure"),
-                    "precipitation": current.get("precipRate")
-                }
-        except Exception as e:
-            print(f"❌ Foreca säätietojen haku epäonnistui: {e}")
+
+        location_id = str(locations[0]["id"])
+        await self.location_ids.aset(key, location_id, self.location_ttl)
+        return location_id
+
+    async def get_current_weather(self, city: str = "Oulu") -> Optional[Dict[str, Any]]:
+        """
+        Hakee nykyisen sään annetulle paikkakunnalle.
+
+        Args:
+            city: Kaupungin nimi (oletuksena Oulu)
+
+        Returns:
+            Dictionary säätiedoilla tai None jos paikkakuntaa ei löydy
+
+        Raises:
+            ForecaAuthError: Jos tokenia ei saada
+            httpx.HTTPError: Jos haku epäonnistuu (aggregaattori näyttää
+                lähteen tilana "error")
+        """
+        location_id = await self.get_location_id(city)
+        if not location_id:
             return None
 
+        data = await self._authorized_get(f"/api/v1/current/{location_id}")
+
+        current = data.get("current", {})
+        return {
+            "temperature": current.get("temperature"),
+            "weather": current.get("symbolPhrase"),
+            "wind_speed": current.get("windSpeed"),
+            "humidity": current.get("relHumidity"),
+            "pressure": current.get("pressure"),
+            "precipitation": current.get("precipRate")
+        }
+
 
-# Yksittäinen instanssi
-foreca_service = ForecaService()
\ No newline at end of file
+# Yksittäinen instanssi, id-välimuisti jaettu workerien kesken
+foreca_service = ForecaService(location_ids=create_cache("foreca_locations", max_size=5000))
@@ -0,0 +1,294 @@
+"""
+Non-blocking geocoding with a persistent, bounded coordinate cache.
+
+geopy's Nominatim client is synchronous, so lookups run in a small
+dedicated thread pool instead of on the event loop. Concurrent lookups
+for the same city are collapsed into one, and results are kept in a
+bounded LRU cache that is stored in SQLite and reloaded at startup.
+On a miss the SQLite table is checked before Nominatim is asked, so
+several worker processes share each other's lookups. Nominatim calls
+are rate limited (its usage policy allows one request per second).
+"""
+
+import asyncio
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+
+import metrics
+from cache import SingleFlight
+from ratelimit import RateLimiter, RateLimitExceeded
+from cities import normalize_city
+
+
+GEOCODE_LATENCY = metrics.histogram(
+    "weather_geocode_duration_seconds",
+    "Nominatim lookups by result",
+    ("result",),
+)
+GEOCODE_CACHE = metrics.counter(
+    "weather_geocode_cache_requests_total", "Geocode cache lookups by result", ("result",)
+)
+
+
+class GeocodeCache:
+    """Bounded LRU cache of city coordinates, persisted in SQLite."""
+
+    def __init__(self, db_path: str = "weather_data.db", max_size: int = 5000):
+        """
+        Initialize cache. Saved coordinates are loaded from disk by load()
+        (startup preloading, or Geocoder before its first lookup, in its
+        worker pool), so importing the module touches no files.
+
+        Args:
+            db_path: Path to SQLite database file
+            max_size: Maximum number of cities kept in cache
+        """
+        self.db_path = db_path
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self._loaded = False
+
+    def create_table(self):
+        """Create geocode_cache table if it doesn't exist."""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                city TEXT PRIMARY KEY,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """
+        )
+        conn.commit()
+        conn.close()
+
+    def load(self):
+        """Create the table if needed and load the most recently used coordinates."""
+        self.create_table()
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(
+            """
+            SELECT city, lat, lon FROM geocode_cache
+            ORDER BY last_used DESC
+            LIMIT ?
+        """,
+            (self.max_size,),
+        ).fetchall()
+        conn.close()
+
+        # Oldest first, so the most recently used end up at the LRU tail;
+        # entries added before loading are kept as the most recent
+        entries = OrderedDict(
+            (city, {"lat": lat, "lon": lon}) for city, lat, lon in reversed(rows)
+        )
+        for city, coords in list(self._entries.items()):
+            entries[city] = coords
+            entries.move_to_end(city)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+        self._entries = entries
+        self._loaded = True
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self, key: str) -> Optional[Dict[str, float]]:
+        """Get coordinates from memory and mark them as recently used."""
+        coords = self._entries.get(key)
+        if coords is not None:
+            self._entries.move_to_end(key)
+        return coords
+
+    def put(self, key: str, coords: Dict[str, float]):
+        """Add coordinates to memory, evicting the least recently used."""
+        self._entries[key] = coords
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def load_one(self, key: str) -> Optional[Dict[str, float]]:
+        """
+        Read one city's coordinates from disk into memory, e.g. ones another
+        worker process has geocoded since this one started.
+
+        Blocking; run in a worker thread.
+        """
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute(
+            "SELECT lat, lon FROM geocode_cache WHERE city = ?", (key,)
+        ).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        coords = {"lat": row[0], "lon": row[1]}
+        self.put(key, coords)
+        return coords
+
+    def persist(self, key: str, coords: Dict[str, float]):
+        """
+        Save coordinates to disk and trim the table to max_size rows.
+
+        Blocking; run in a worker thread.
+        """
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO geocode_cache (city, lat, lon, last_used)
+            VALUES (?, ?, ?, ?)
+        """,
+            (key, coords["lat"], coords["lon"], time.time()),
+        )
+        conn.execute(
+            """
+            DELETE FROM geocode_cache WHERE city NOT IN (
+                SELECT city FROM geocode_cache ORDER BY last_used DESC LIMIT ?
+            )
+        """,
+            (self.max_size,),
+        )
+        conn.commit()
+        conn.close()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Geocoder:
+    """Async city-to-coordinates lookup on top of Nominatim."""
+
+    def __init__(
+        self,
+        cache: GeocodeCache,
+        user_agent: str = "weather-api-aggregator",
+        max_workers: int = 2,
+        timeout: float = 10.0,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        Initialize geocoder.
+
+        Args:
+            cache: Coordinate cache
+            user_agent: User-Agent for Nominatim
+            max_workers: Threads used for blocking geocoding calls
+            timeout: Nominatim request timeout in seconds
+            limiter: Rate limit for Nominatim requests (default: none)
+        """
+        self.cache = cache
+        self.geolocator = Nominatim(user_agent=user_agent)
+        self.timeout = timeout
+        self.limiter = limiter
+        # Own pool so a cache-miss storm can't starve other worker threads
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="geocode"
+        )
+        self._single_flight = SingleFlight()
+
+    async def get_coordinates(self, city: str) -> Optional[Dict[str, float]]:
+        """
+        Get coordinates for any city.
+
+        Args:
+            city: City name (e.g., "Oulu", "Paris", "New York")
+
+        Returns:
+            Dictionary with lat/lon or None if not found
+        """
+        key = normalize_city(city)
+
+        if not self.cache.loaded:
+            await self._load_cache()
+        coords = self.cache.get(key)
+        if coords is not None:
+            GEOCODE_CACHE.inc("hit")
+            return coords
+
+        GEOCODE_CACHE.inc("miss")
+        return await self._single_flight.do(key, lambda: self._lookup(key, city))
+
+    async def _load_cache(self):
+        """
+        Load saved coordinates in the worker pool (startup preloading
+        normally has, but not with PRELOAD=0), once for all callers.
+        """
+
+        async def load():
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self.cache.load)
+            except sqlite3.Error as e:
+                print(f"⚠️ Geocode cache load failed: {e}")
+
+        await self._single_flight.do(("load",), load)
+
+    async def _lookup(self, key: str, city: str) -> Optional[Dict[str, float]]:
+        """Geocode a city in the worker pool and cache the result."""
+        loop = asyncio.get_running_loop()
+
+        # Another worker process may have geocoded it already
+        try:
+            coords = await loop.run_in_executor(self._executor, self.cache.load_one, key)
+        except sqlite3.Error as e:
+            print(f"⚠️ Geocode cache read failed for '{city}': {e}")
+            coords = None
+        if coords is not None:
+            return coords
+
+        if self.limiter is not None:
+            try:
+                await self.limiter.acquire()
+            except RateLimitExceeded as e:
+                print(f"⚠️ Geocoding skipped for '{city}': {e}")
+                return None
+
+        started = time.perf_counter()
+
+        try:
+            location = await loop.run_in_executor(
+                self._executor,
+                lambda: self.geolocator.geocode(city, timeout=self.timeout),
+            )
+        except (GeocoderTimedOut, GeocoderServiceError) as e:
+            GEOCODE_LATENCY.observe(time.perf_counter() - started, "error")
+            print(f"❌ Geocoding error for '{city}': {e}")
+            return None
+
+        GEOCODE_LATENCY.observe(
+            time.perf_counter() - started, "found" if location else "not_found"
+        )
+        if not location:
+            print(f"⚠️ Geocoding: City '{city}' not found")
+            return None
+
+        coords = {
+            "lat": round(location.latitude, 2),
+            "lon": round(location.longitude, 2),
+        }
+        self.cache.put(key, coords)
+
+        try:
+            await loop.run_in_executor(self._executor, self.cache.persist, key, coords)
+        except sqlite3.Error as e:
+            print(f"⚠️ Geocode cache write failed for '{city}': {e}")
+
+        return coords
+
+
+# Single instance shared by all services
+geocoder = Geocoder(
+    GeocodeCache(max_size=int(os.getenv("GEOCODE_CACHE_SIZE", "5000"))),
+    limiter=RateLimiter(
+        "nominatim.openstreetmap.org",
+        rate=float(os.getenv("GEOCODE_RATE", "1")),
+        max_queue=int(os.getenv("GEOCODE_RATE_QUEUE", "20")),
+    ),
+)
@@ -0,0 +1,480 @@
+"""
+Shared HTTP client for all weather provider services.
+
+One long-lived pooled httpx.AsyncClient is created in the FastAPI lifespan
+and reused by every service, so connections (DNS, TCP, TLS) are kept alive
+between requests instead of being set up again for each call.
+
+Configured with environment variables:
+- HTTP_TIMEOUT: Request timeout in seconds (default: 30)
+- HTTP_MAX_CONNECTIONS: Total connection limit (default: 100)
+- HTTP_MAX_KEEPALIVE: Idle keep-alive connections to keep (default: 20)
+- HTTP_KEEPALIVE_EXPIRY: Seconds an idle connection is kept (default: 30)
+- HTTP_MAX_PER_HOST: Concurrent requests per upstream host (default: 10)
+- HTTP_HTTP2: Use HTTP/2 when the h2 package is installed (default: 1)
+
+Every upstream host also gets a circuit breaker, GET requests are retried
+on connection errors and 5xx responses within a retry budget shared by
+all hosts, and GETs can be hedged (see resilience.py). A request cancelled
+while waiting for the upstream (usually by the aggregator deadline, which
+is shorter than HTTP_TIMEOUT) counts as a failure of the host.
+- HTTP_BREAKER_FAILURES: Consecutive failures that open a circuit (default: 5)
+- HTTP_BREAKER_RESET: Seconds before a probe request is let through (default: 30)
+- HTTP_MAX_RETRIES: Retries per GET request (default: 2)
+- HTTP_RETRY_RATIO: Retry budget as a fraction of requests (default: 0.2)
+- HTTP_HEDGE: Send a second GET after the host's p95 latency (default: 0)
+
+Hosts with a usage policy are rate limited (see ratelimit.py): requests
+wait for a token, user requests before batch and background ones, and
+fail fast with RateLimitExceeded when too many are already waiting. A 429
+pauses the host for its Retry-After time.
+- HTTP_RATE_LIMITS: host=requests per second, comma-separated
+  (default: api.met.no=10,opendata.fmi.fi=5)
+- HTTP_RATE_BURST: Requests a host may get at once after a quiet period (default: 5)
+- HTTP_RATE_QUEUE: Requests waiting per host before failing fast (default: 50)
+"""
+
+import asyncio
+import importlib.util
+import os
+import random
+import time
+import weakref
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+import metrics
+from ratelimit import RateLimiter, parse_limits
+from resilience import CircuitBreaker, LatencyTracker, RetryBudget
+
+# Methods that are safe to send more than once
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+UPSTREAM_IN_FLIGHT = metrics.gauge(
+    "weather_upstream_requests_in_flight", "Upstream HTTP requests in flight", ("host",)
+)
+
+
+def is_failure(response: httpx.Response) -> bool:
+    """Responses that count against an upstream's health."""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def is_retryable(response: httpx.Response) -> bool:
+    """Responses worth trying again (429 is not: the upstream asked us to slow down)."""
+    return response.status_code in (500, 502, 503, 504)
+
+
+def retry_after(response: httpx.Response, default: float = 5.0) -> float:
+    """Seconds from a Retry-After header (delay or HTTP date), or the default."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class _BodyReads(httpx.AsyncByteStream):
+    """Wraps a response body to tell whether a read from the upstream was cancelled."""
+
+    def __init__(self, stream: httpx.AsyncByteStream):
+        self._stream = stream
+        self.cancelled = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        chunks = self._stream.__aiter__()
+        while True:
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+            yield chunk
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+
+class HTTPClientManager:
+    """Owns the shared pooled AsyncClient and per-host connection caps."""
+
+    def __init__(
+        self,
+        timeout: float = 30.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        max_connections_per_host: int = 10,
+        http2: bool = True,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+        max_retries: int = 2,
+        retry_budget: Optional[RetryBudget] = None,
+        hedge: bool = False,
+        rate_limits: Optional[Dict[str, float]] = None,
+        rate_burst: float = 5.0,
+        rate_queue: int = 50,
+    ):
+        """
+        Initialize client manager. The client itself is created in start().
+
+        Args:
+            timeout: Default request timeout in seconds
+            max_connections: Total connection limit for the pool
+            max_keepalive_connections: Idle connections kept alive
+            keepalive_expiry: Seconds an idle connection is kept alive
+            max_connections_per_host: Concurrent requests allowed per host
+            http2: Use HTTP/2 if the h2 package is available
+            breaker_failures: Consecutive failures that open a host's circuit
+            breaker_reset: Seconds an open circuit waits before a probe
+            max_retries: Retries per idempotent request
+            retry_budget: Budget shared by retries and hedges of all hosts
+            hedge: Send a second idempotent request after the host's p95
+            rate_limits: Requests per second per host (hosts not listed
+                are not rate limited)
+            rate_burst: Token bucket size of each rate limited host
+            rate_queue: Requests waiting per host before failing fast
+        """
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_connections_per_host = max_connections_per_host
+        # HTTP/2 needs the optional h2 package (pip install httpx[http2])
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget or RetryBudget()
+        self.hedge = hedge
+        self.rate_limiters: Dict[str, RateLimiter] = {
+            host: RateLimiter(host, rate, burst=rate_burst, max_queue=rate_queue)
+            for host, rate in (rate_limits or {}).items()
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latencies: Dict[str, LatencyTracker] = {}
+        self.retries = 0
+        self.hedges = 0
+        # Hedged attempts cancelled because the other one answered first
+        self._superseded: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+
+    async def start(self):
+        """Create the pooled client (called from the FastAPI lifespan)."""
+        if self._client is None or self._client.is_closed:
+            self._client = self._new_client()
+
+    def _new_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=self.timeout, limits=self.limits, http2=self.http2
+        )
+
+    async def close(self):
+        """Close the pooled client and all its connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._host_limits.clear()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Get the pooled client.
+
+        Created lazily if start() was not called (e.g. in scripts),
+        so services work outside the FastAPI app as well.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = self._new_client()
+        return self._client
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        """Get the concurrency cap for the host of the given URL."""
+        host = httpx.URL(url).host
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return self._host_limits[host]
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """Get the circuit breaker for the host of the given URL."""
+        host = httpx.URL(url).host
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(
+                host, self.breaker_failures, self.breaker_reset
+            )
+            self.latencies[host] = LatencyTracker()
+        return self.breakers[host]
+
+    async def _wait_for_rate_limit(self, url: str):
+        """
+        Wait for the host's rate limit, if it has one.
+
+        Raises:
+            RateLimitExceeded: If too many requests are already waiting
+        """
+        limiter = self.rate_limiters.get(httpx.URL(url).host)
+        if limiter is not None:
+            await limiter.acquire()
+
+    def _check_throttled(self, url: str, response: httpx.Response):
+        """Pause a rate limited host that answered 429."""
+        if response.status_code == 429:
+            limiter = self.rate_limiters.get(httpx.URL(url).host)
+            if limiter is not None:
+                limiter.pause(retry_after(response))
+
+    def circuit_open(self, url: str) -> bool:
+        """True if requests to the host of the given URL are being refused."""
+        return self.breaker(url).is_open
+
+    def _record(self, url: str, started: float, response: Optional[httpx.Response]):
+        """Record the outcome of one attempt (None = transport error)."""
+        breaker = self.breaker(url)
+        if response is None or is_failure(response):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+            self.latencies[breaker.name].record(time.perf_counter() - started)
+
+    async def _backoff(self, attempt: int):
+        """Exponential backoff with jitter before a retry."""
+        await asyncio.sleep(0.1 * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def _attempt(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send one request and record it in the host's breaker and latencies."""
+        await self._wait_for_rate_limit(url)
+        started = time.perf_counter()
+        async with self._host_limit(url):
+            try:
+                with UPSTREAM_IN_FLIGHT.track(httpx.URL(url).host):
+                    response = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                self._record(url, started, None)
+                raise
+            except asyncio.CancelledError:
+                # Usually the caller's deadline ran out first (it is shorter
+                # than the HTTP timeout), so a hung upstream counts as failed.
+                # A hedge that lost to a faster response doesn't.
+                if asyncio.current_task() not in self._superseded:
+                    self._record(url, started, None)
+                raise
+        self._record(url, started, response)
+        self._check_throttled(url, response)
+        return response
+
+    async def _hedged_attempt(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send a request, and a second one if the first is slower than the
+        host's p95 latency. The first successful response wins.
+        """
+        delay = self.latencies[self.breaker(url).name].percentile(0.95)
+        first = asyncio.create_task(self._attempt(method, url, **kwargs))
+        if delay is None:
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or not self.retry_budget.try_spend():
+            return await first
+
+        self.hedges += 1
+        second = asyncio.create_task(self._attempt(method, url, **kwargs))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        # The other request lost the race; its cancellation
+                        # is not the host's fault
+                        self._superseded.update(pending)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send a request through the shared pool.
+
+        Fails immediately with CircuitOpenError while the host's circuit
+        is open, and waits for the host's rate limit. Idempotent requests are retried on connection errors and
+        5xx responses while the retry budget allows, and hedged when
+        hedging is enabled.
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            **kwargs: Passed on to httpx (params, headers, json, timeout...)
+
+        Returns:
+            httpx.Response
+
+        Raises:
+            CircuitOpenError: If the host's circuit is open
+            RateLimitExceeded: If the host's rate limit queue is full
+        """
+        self.breaker(url).check()
+        self.retry_budget.deposit()
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        send = self._hedged_attempt if idempotent and self.hedge else self._attempt
+
+        attempt = 0
+        while True:
+            try:
+                response = await send(method, url, **kwargs)
+            except httpx.TransportError:
+                if not (idempotent and self._may_retry(url, attempt)):
+                    raise
+            else:
+                if not (idempotent and is_retryable(response) and self._may_retry(url, attempt)):
+                    return response
+                await response.aclose()
+            await self._backoff(attempt)
+            attempt += 1
+
+    def _may_retry(self, url: str, attempt: int) -> bool:
+        """Check the retry limit, the host's circuit and the shared budget."""
+        if attempt >= self.max_retries or not self.breaker(url).allow():
+            return False
+        if not self.retry_budget.try_spend():
+            return False
+        self.retries += 1
+        return True
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        """Send a GET request through the shared pool."""
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        """Send a POST request through the shared pool."""
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Stream a response body through the shared pool.
+
+        The per-host slot is held until the body has been consumed. The
+        circuit breaker and rate limit apply as in request(); retries only
+        happen before the response is handed out, and streams are not hedged.
+
+        Raises:
+            CircuitOpenError: If the host's circuit is open
+            RateLimitExceeded: If the host's rate limit queue is full
+        """
+        self.breaker(url).check()
+        self.retry_budget.deposit()
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            await self._wait_for_rate_limit(url)
+            started = time.perf_counter()
+            handed_out = False
+            body: Optional[_BodyReads] = None
+            async with self._host_limit(url):
+                try:
+                    async with self.client.stream(method, url, **kwargs) as response:
+                        body = response.stream = _BodyReads(response.stream)
+                        self._record(url, started, response)
+                        self._check_throttled(url, response)
+                        if not (
+                            idempotent
+                            and is_retryable(response)
+                            and self._may_retry(url, attempt)
+                        ):
+                            handed_out = True
+                            yield response
+                            return
+                except httpx.TransportError:
+                    if handed_out:
+                        # Failed while reading the body
+                        self.breaker(url).record_failure()
+                        raise
+                    self._record(url, started, None)
+                    if not (idempotent and self._may_retry(url, attempt)):
+                        raise
+                except asyncio.CancelledError:
+                    # Cancelled by the caller's deadline while waiting for
+                    # the response or its body: a hung upstream. Not when
+                    # the caller was cancelled while doing something else.
+                    if not handed_out or (body is not None and body.cancelled):
+                        self.breaker(url).record_failure()
+                    raise
+            await self._backoff(attempt)
+            attempt += 1
+
+
+# Single instance shared by all services
+http_client = HTTPClientManager(
+    timeout=float(os.getenv("HTTP_TIMEOUT", "30")),
+    max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+    max_connections_per_host=int(os.getenv("HTTP_MAX_PER_HOST", "10")),
+    http2=os.getenv("HTTP_HTTP2", "1") == "1",
+    breaker_failures=int(os.getenv("HTTP_BREAKER_FAILURES", "5")),
+    breaker_reset=float(os.getenv("HTTP_BREAKER_RESET", "30")),
+    max_retries=int(os.getenv("HTTP_MAX_RETRIES", "2")),
+    retry_budget=RetryBudget(ratio=float(os.getenv("HTTP_RETRY_RATIO", "0.2"))),
+    hedge=os.getenv("HTTP_HEDGE", "0") == "1",
+    rate_limits=parse_limits(os.getenv("HTTP_RATE_LIMITS", "api.met.no=10,opendata.fmi.fi=5")),
+    rate_burst=float(os.getenv("HTTP_RATE_BURST", "5")),
+    rate_queue=int(os.getenv("HTTP_RATE_QUEUE", "50")),
+)
+
+
+def _collect_metrics():
+    """Circuit breaker, rate limit and retry numbers for /metrics."""
+    for host, breaker in list(http_client.breakers.items()):
+        yield (
+            "weather_upstream_circuit_open",
+            "gauge",
+            "1 while requests to the host are refused",
+            {"host": host},
+            int(breaker.is_open),
+        )
+        yield (
+            "weather_upstream_circuit_opened_total",
+            "counter",
+            "Times the host's circuit has opened",
+            {"host": host},
+            breaker.times_opened,
+        )
+    for host, limiter in list(http_client.rate_limiters.items()):
+        yield (
+            "weather_upstream_queue_depth",
+            "gauge",
+            "Requests waiting for the host's rate limit",
+            {"host": host},
+            limiter.queue_depth,
+        )
+    yield ("weather_upstream_retries_total", "counter", "Retried requests", {}, http_client.retries)
+    yield ("weather_upstream_hedges_total", "counter", "Hedged requests", {}, http_client.hedges)
+    yield (
+        "weather_upstream_retry_budget_denied_total",
+        "counter",
+        "Retries and hedges refused by the retry budget",
+        {},
+        http_client.retry_budget.denied,
+    )
+
+
+metrics.register_collector(_collect_metrics)
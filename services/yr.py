@@ -2,13 +2,26 @@
 Yr.no (Norwegian Meteorological Institute) API integration.
 
 Yr.no is free but requires User-Agent header.
-Uses geopy for automatic city-to-coordinates conversion.
+Uses geopy for automatic city-to-coordinates conversion (see services/geocoding.py).
+
+Follows the api.met.no terms of service: forecast documents are reused
+until their Expires time, and then revalidated with If-Modified-Since so
+an unchanged forecast comes back as an empty 304 response.
+
+The whole timeseries of a document is kept in columnar form (see
+forecast.py) and serves both current weather and /weather/forecast, so
+the two never fetch the same forecast twice.
 """
 
-import httpx
-from typing import Optional, Dict, Any
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Tuple
+
+from cache import SingleFlight
+from forecast import ForecastSeries
+from services.geocoding import Geocoder, geocoder as default_geocoder
+from services.http_client import HTTPClientManager, http_client
 
 
 class YrService:
@@ -18,47 +31,45 @@ class YrService:
     Converts any city name to coordinates automatically.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        http: Optional[HTTPClientManager] = None,
+        geocoder: Optional[Geocoder] = None,
+        max_documents: int = 1000,
+    ):
+        """
+        Args:
+            http: Shared HTTP client (default: the app-wide pool)
+            geocoder: City-to-coordinates lookup (default: shared geocoder)
+            max_documents: Forecast documents kept for revalidation
+        """
         self.base_url = "https://api.met.no/weatherapi/locationforecast/2.0/compact"
         self.headers = {
             "User-Agent": "WeatherAPIAggregator/1.0 (github.com/Xmas178/weather-api-aggregator)"
         }
-        # Initialize geocoder
-        self.geolocator = Nominatim(user_agent="weather-api-aggregator")
-        # Cache for coordinates to avoid repeated geocoding
-        self.coords_cache = {}
-
-    def get_coordinates(self, city: str) -> Optional[Dict[str, float]]:
+        self.http = http or http_client
+        # Non-blocking geocoder with persistent coordinate cache
+        self.geocoder = geocoder or default_geocoder
+        # Forecast documents per (lat, lon), least recently used first
+        self.max_documents = max_documents
+        self.documents: "OrderedDict[Tuple[float, float], Dict[str, Any]]" = OrderedDict()
+        # Current weather and forecast requests for the same place share one fetch
+        self._single_flight = SingleFlight()
+
+    async def get_coordinates(self, city: str) -> Optional[Dict[str, float]]:
         """
         Get coordinates for any city using geocoding.
 
+        Runs off the event loop and is served from the coordinate cache
+        when the city has been looked up before.
+
         Args:
             city: City name (e.g., "Oulu", "Paris", "New York")
 
         Returns:
             Dictionary with lat/lon or None if not found
         """
-        # Check cache first
-        if city in self.coords_cache:
-            return self.coords_cache[city]
-
-        try:
-            location = self.geolocator.geocode(city, timeout=10)
-            if location:
-                coords = {
-                    "lat": round(location.latitude, 2),
-                    "lon": round(location.longitude, 2),
-                }
-                # Cache the result
-                self.coords_cache[city] = coords
-                return coords
-            else:
-                print(f"⚠️ Geocoding: City '{city}' not found")
-                return None
-
-        except (GeocoderTimedOut, GeocoderServiceError) as e:
-            print(f"❌ Geocoding error for '{city}': {e}")
-            return None
+        return await self.geocoder.get_coordinates(city)
 
     async def get_current_weather(self, city: str = "Oulu") -> Optional[Dict[str, Any]]:
         """
@@ -68,46 +79,140 @@ class YrService:
             city: City name (works for any city worldwide!)
 
         Returns:
-            Dictionary with weather data or None if fetch fails
+            Dictionary with weather data or None if the city can't be geocoded
+
+        Raises:
+            httpx.HTTPError: If the forecast can't be fetched (reported by
+                the aggregator as status "error")
         """
         # Get coordinates for the city
-        coords = self.get_coordinates(city)
+        coords = await self.get_coordinates(city)
         if not coords:
             return None
 
-        try:
-            params = {"lat": coords["lat"], "lon": coords["lon"]}
+        document = await self.get_forecast_document(coords["lat"], coords["lon"])
+        return self._current_weather(document["forecast"])
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    self.base_url, params=params, headers=self.headers
-                )
-                response.raise_for_status()
-                data = response.json()
+    async def get_forecast(self, city: str, hours: int = 48) -> Optional[Dict[str, Any]]:
+        """
+        Get the forecast timeseries from Yr.no for any city.
+
+        Served from the same forecast document as current weather.
+
+        Args:
+            city: City name
+            hours: How many hours ahead to return
 
-                return self._parse_current_weather(data)
+        Returns:
+            Dictionary with coordinates, "updated" (forecast run time) and
+            "expires" (UTC), and "timeseries"
+            with a "time" list and one list per parameter, or None if the
+            city can't be geocoded
 
-        except Exception as e:
-            print(f"❌ Yr.no weather fetch failed: {e}")
+        Raises:
+            httpx.HTTPError: If the forecast can't be fetched
+        """
+        coords = await self.get_coordinates(city)
+        if not coords:
             return None
 
-    def _parse_current_weather(self, data: dict) -> Dict[str, Any]:
+        document = await self.get_forecast_document(coords["lat"], coords["lon"])
+        return {
+            "lat": coords["lat"],
+            "lon": coords["lon"],
+            "updated": document["updated_at"],
+            "expires": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(document["expires"])),
+            "timeseries": document["forecast"].window(time.time(), hours),
+        }
+
+    async def get_forecast_document(self, lat: float, lon: float) -> Dict[str, Any]:
         """
-        Convert Yr.no data to unified format.
+        Get the forecast document for coordinates, honoring cache headers.
+
+        - Before Expires: returned from memory without a request
+        - After Expires: revalidated with If-Modified-Since; a 304 reuses
+          the already parsed document and only updates its expiry
+
+        Args:
+            lat: Latitude
+            lon: Longitude
+
+        Returns:
+            Document dictionary with the parsed "forecast" (ForecastSeries),
+            "updated_at" (forecast run time), "expires" (epoch seconds) and
+            "last_modified" header value
+        """
+        key = (lat, lon)
+        document = self.documents.get(key)
+
+        if document is not None and document["expires"] > time.time():
+            self.documents.move_to_end(key)
+            return document
+
+        return await self._single_flight.do(key, lambda: self._fetch_document(key, document))
+
+    async def _fetch_document(
+        self, key: Tuple[float, float], document: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Fetch or revalidate a forecast document and store it."""
+        lat, lon = key
+        headers = dict(self.headers)
+        if document is not None and document["last_modified"]:
+            headers["If-Modified-Since"] = document["last_modified"]
+
+        response = await self.http.get(
+            self.base_url, params={"lat": lat, "lon": lon}, headers=headers
+        )
+
+        if response.status_code == 304 and document is not None:
+            # Not modified: keep parsed data, just extend expiry
+            document["expires"] = self._parse_expires(response.headers)
+        else:
+            response.raise_for_status()
+            data = response.json()
+            document = {
+                "forecast": ForecastSeries.from_yr(data),
+                "updated_at": data.get("properties", {}).get("meta", {}).get("updated_at"),
+                "expires": self._parse_expires(response.headers),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+
+        self.documents[key] = document
+        self.documents.move_to_end(key)
+        while len(self.documents) > self.max_documents:
+            self.documents.popitem(last=False)
+
+        return document
+
+    def _parse_expires(self, headers) -> float:
+        """
+        Read the Expires header as epoch seconds.
+
+        Falls back to "already expired" so the next call revalidates.
         """
-        timeseries = data.get("properties", {}).get("timeseries", [])
+        expires = headers.get("Expires")
+        if not expires:
+            return 0.0
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return 0.0
 
-        if not timeseries:
+    def _current_weather(self, forecast: ForecastSeries) -> Dict[str, Any]:
+        """
+        Convert the forecast step covering now to unified format.
+        """
+        if not len(forecast):
             return {}
 
-        current = timeseries[0].get("data", {}).get("instant", {}).get("details", {})
+        current = forecast.row(forecast.index_at(time.time()))
 
         return {
-            "temperature": current.get("air_temperature", 0),
+            "temperature": current["temperature"] if current["temperature"] is not None else 0,
             "weather": "Unknown",
-            "wind_speed": current.get("wind_speed", 0),
-            "humidity": current.get("relative_humidity"),
-            "pressure": current.get("air_pressure_at_sea_level"),
+            "wind_speed": current["wind_speed"] if current["wind_speed"] is not None else 0,
+            "humidity": current["humidity"],
+            "pressure": current["pressure"],
             "precipitation": None,
         }
 
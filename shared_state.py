@@ -0,0 +1,593 @@
+"""
+Shared state for running several worker processes.
+
+With one uvicorn/gunicorn worker, the in-process TTLCache (cache.py) is
+all that's needed. With several, every worker would geocode, call the
+upstreams and write to weather_data.db on its own, so caches, a queue of
+observations and a leader lease can be kept in a backend that all
+workers share:
+
+- memory: in-process only (default, one worker)
+- sqlite: a separate SQLite file on local disk (STATE_DB_PATH), for
+  workers on the same machine; runs multi-worker mode without Redis
+- redis: any Redis-compatible server (REDIS_URL), needs the redis package
+
+One worker holds the leader lease and is the only one that writes
+observations (followers hand theirs over through the shared queue, see
+observation_writer.py) and runs prefetching and retention, so adding
+workers doesn't multiply upstream load or database write contention.
+
+Caches keep TTLCache's interface (get, set, get_stale, delete, clear,
+len, hits/misses) and its async versions (aget, aset, aget_stale,
+adelete). Keys and values are stored as JSON. Code running on the event
+loop uses the async versions, which run the lookup in the default
+executor, so a slow disk or Redis round trip doesn't block other
+requests. Errors count as cache misses.
+
+Creating a backend does no I/O: SQLite files are opened and Redis is
+connected on first use, or by open_backends() from the FastAPI
+lifespan. Importing the app never touches the shared backend.
+
+Configured with environment variables:
+- STATE_BACKEND: memory, sqlite or redis (default: memory)
+- STATE_DB_PATH: SQLite file for the sqlite backend (default: state.db)
+- REDIS_URL: Server for the redis backend (default: redis://localhost:6379/0)
+- REDIS_TIMEOUT: Redis socket timeout in seconds (default: 0.5)
+- LEADER_LEASE_SECONDS: Lease length; renewed every third of it (default: 15)
+"""
+
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Hashable, List, Optional
+
+from cache import TTLCache
+
+# Seconds an expired entry is kept for get_stale() in shared backends
+DEFAULT_KEEP_STALE = 6 * 3600
+
+
+def _encode_key(key: Hashable) -> str:
+    return json.dumps(list(key) if isinstance(key, tuple) else key, ensure_ascii=False)
+
+
+async def _in_executor(func, *args):
+    """Run a blocking backend call in the default executor."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+
+class _AsyncCache:
+    """Async versions of the cache methods for backends that do I/O."""
+
+    async def aget(self, key: Hashable) -> Optional[Any]:
+        return await _in_executor(self.get, key)
+
+    async def aset(self, key: Hashable, value: Any, ttl: float):
+        await _in_executor(self.set, key, value, ttl)
+
+    async def aget_stale(self, key: Hashable, max_age: float) -> Optional[Any]:
+        return await _in_executor(self.get_stale, key, max_age)
+
+    async def adelete(self, key: Hashable):
+        await _in_executor(self.delete, key)
+
+
+class _SQLiteStore:
+    """SQLite connection opened on first use, shared by one object's methods."""
+
+    # CREATE TABLE statement run when the connection is opened
+    SCHEMA = ""
+
+    def __init__(self, path: str, timeout: float):
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        """Open the file and create the table (done on first use otherwise)."""
+        with self._lock:
+            self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Connection to the file; call with self._lock held."""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(self.SCHEMA)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+
+class SQLiteCache(_SQLiteStore, _AsyncCache):
+    """TTL cache in a SQLite file shared by all workers on one machine."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )
+    """
+
+    def __init__(
+        self,
+        path: str,
+        namespace: str,
+        max_size: int = 1000,
+        keep_stale: float = DEFAULT_KEEP_STALE,
+    ):
+        """
+        Args:
+            path: SQLite file (not weather_data.db, to keep cache writes
+                away from observation writes)
+            namespace: Name that separates this cache from others in the file
+            max_size: Maximum number of entries, soonest to expire go first
+            keep_stale: Seconds expired entries are kept for get_stale()
+        """
+        super().__init__(path, timeout=0.1)
+        self.namespace = namespace
+        self.max_size = max_size
+        self.keep_stale = keep_stale
+        self.hits = 0
+        self.misses = 0
+        self._sets = 0
+
+    def _read(self, key: Hashable) -> Optional[tuple]:
+        try:
+            with self._lock:
+                return self._connection().execute(
+                    "SELECT value, expires FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, _encode_key(key)),
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ Shared cache read failed: {e}")
+            return None
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        row = self._read(key)
+        if row is None or row[1] <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def get_stale(self, key: Hashable, max_age: float) -> Optional[Any]:
+        row = self._read(key)
+        if row is None or time.time() - row[1] > max_age:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?)",
+                    (self.namespace, _encode_key(key), json.dumps(value), time.time() + ttl),
+                )
+                self._sets += 1
+                if self._sets % 100 == 0:
+                    self._prune(conn)
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Shared cache write failed: {e}")
+
+    def _prune(self, conn: sqlite3.Connection):
+        """Drop entries past keep_stale, then the soonest to expire over max_size."""
+        conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires < ?",
+            (self.namespace, time.time() - self.keep_stale),
+        )
+        conn.execute(
+            """
+            DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                SELECT key FROM cache_entries WHERE namespace = ?
+                ORDER BY expires DESC LIMIT -1 OFFSET ?
+            )
+        """,
+            (self.namespace, self.namespace, self.max_size),
+        )
+
+    def delete(self, key: Hashable):
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, _encode_key(key)),
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Shared cache delete failed: {e}")
+
+    def clear(self):
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Shared cache clear failed: {e}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+
+
+class _RedisStore:
+    """Redis client given up front, or the shared one for REDIS_URL on first use."""
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis_client()
+        return self._client
+
+    def open(self):
+        """Connect now (done on first use otherwise)."""
+        self.client.ping()
+
+
+class RedisCache(_RedisStore, _AsyncCache):
+    """TTL cache in a Redis-compatible server."""
+
+    def __init__(self, client, namespace: str, keep_stale: float = DEFAULT_KEEP_STALE):
+        """
+        Args:
+            client: redis.Redis (or compatible) client, or None for the
+                shared client of REDIS_URL
+            namespace: Key prefix that separates this cache from others
+            keep_stale: Seconds expired entries are kept for get_stale()
+                (Redis removes them after that, and evicts by its own policy)
+        """
+        super().__init__(client)
+        self.prefix = f"weather:{namespace}:"
+        self.keep_stale = keep_stale
+        self.hits = 0
+        self.misses = 0
+
+    def _read(self, key: Hashable) -> Optional[list]:
+        try:
+            raw = self.client.get(self.prefix + _encode_key(key))
+        except Exception as e:
+            print(f"⚠️ Shared cache read failed: {e}")
+            return None
+        # Stored as [expires, value]
+        return json.loads(raw) if raw is not None else None
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._read(key)
+        if entry is None or entry[0] <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def get_stale(self, key: Hashable, max_age: float) -> Optional[Any]:
+        entry = self._read(key)
+        if entry is None or time.time() - entry[0] > max_age:
+            return None
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        try:
+            self.client.set(
+                self.prefix + _encode_key(key),
+                json.dumps([time.time() + ttl, value]),
+                px=int((ttl + self.keep_stale) * 1000),
+            )
+        except Exception as e:
+            print(f"⚠️ Shared cache write failed: {e}")
+
+    def delete(self, key: Hashable):
+        try:
+            self.client.delete(self.prefix + _encode_key(key))
+        except Exception as e:
+            print(f"⚠️ Shared cache delete failed: {e}")
+
+    def clear(self):
+        try:
+            for name in list(self.client.scan_iter(match=self.prefix + "*")):
+                self.client.delete(name)
+        except Exception as e:
+            print(f"⚠️ Shared cache clear failed: {e}")
+
+    def __len__(self) -> int:
+        # Scans the keyspace; blocking, so not called from the event loop
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+
+class SQLiteQueue(_SQLiteStore):
+    """FIFO queue of JSON items in a shared SQLite file."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS queue_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            queue TEXT NOT NULL,
+            item TEXT NOT NULL
+        )
+    """
+
+    def __init__(self, path: str, name: str):
+        super().__init__(path, timeout=5.0)
+        self.name = name
+
+    def push(self, items: List[Any]):
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT INTO queue_items (queue, item) VALUES (?, ?)",
+                [(self.name, json.dumps(item)) for item in items],
+            )
+            conn.commit()
+
+    def pop(self, max_items: int) -> List[Any]:
+        """Remove and return up to max_items of the oldest items."""
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT id, item FROM queue_items WHERE queue = ? ORDER BY id LIMIT ?",
+                (self.name, max_items),
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    "DELETE FROM queue_items WHERE queue = ? AND id <= ?",
+                    (self.name, rows[-1][0]),
+                )
+                conn.commit()
+        return [json.loads(item) for _, item in rows]
+
+
+class RedisQueue(_RedisStore):
+    """FIFO queue of JSON items in a Redis list."""
+
+    def __init__(self, client, name: str):
+        super().__init__(client)
+        self.key = f"weather:queue:{name}"
+
+    def push(self, items: List[Any]):
+        if items:
+            self.client.rpush(self.key, *(json.dumps(item) for item in items))
+
+    def pop(self, max_items: int) -> List[Any]:
+        """Remove and return up to max_items of the oldest items."""
+        return [json.loads(item) for item in self.client.lpop(self.key, max_items) or []]
+
+
+class SQLiteLease(_SQLiteStore):
+    """Named lease in a shared SQLite file, held by one worker at a time."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path: str, name: str):
+        super().__init__(path, timeout=5.0)
+        self.name = name
+
+    def acquire(self, holder: str, seconds: float) -> bool:
+        """Take or renew the lease; True if `holder` has it afterwards."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """
+                INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires
+                WHERE leases.holder = excluded.holder OR leases.expires < ?
+            """,
+                (self.name, holder, now + seconds, now),
+            )
+            conn.commit()
+            row = conn.execute("SELECT holder FROM leases WHERE name = ?", (self.name,)).fetchone()
+        return row is not None and row[0] == holder
+
+    def release(self, holder: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, holder))
+            conn.commit()
+
+
+class RedisLease(_RedisStore):
+    """
+    Named lease in Redis, held by one worker at a time.
+
+    Taking, renewing and releasing are each one Lua script, so the check
+    of the current holder and the change run atomically on the server: a
+    lease that expires between the two can't be renewed or deleted by its
+    old holder after another worker has taken it.
+    """
+
+    # KEYS[1] = lease key, ARGV[1] = holder, ARGV[2] = milliseconds
+    ACQUIRE_SCRIPT = """
+        if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+            return 1
+        end
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            redis.call('PEXPIRE', KEYS[1], ARGV[2])
+            return 1
+        end
+        return 0
+    """
+
+    # KEYS[1] = lease key, ARGV[1] = holder
+    RELEASE_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, client, name: str):
+        super().__init__(client)
+        self.key = f"weather:lease:{name}"
+
+    def acquire(self, holder: str, seconds: float) -> bool:
+        """Take or renew the lease; True if `holder` has it afterwards."""
+        return bool(self.client.eval(self.ACQUIRE_SCRIPT, 1, self.key, holder, int(seconds * 1000)))
+
+    def release(self, holder: str):
+        self.client.eval(self.RELEASE_SCRIPT, 1, self.key, holder)
+
+
+class LeaderElection:
+    """
+    Keeps trying to hold a lease in the background.
+
+    Without a lease (memory backend) this worker is always the leader.
+    """
+
+    def __init__(self, lease=None, seconds: float = 15.0):
+        """
+        Args:
+            lease: SQLiteLease or RedisLease (None = single worker)
+            seconds: Lease length; renewed every third of it, so a
+                crashed leader is replaced within this time
+        """
+        self.lease = lease
+        self.seconds = seconds
+        self.holder = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.is_leader = lease is None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _try_acquire(self):
+        try:
+            is_leader = await _in_executor(self.lease.acquire, self.holder, self.seconds)
+        except Exception as e:
+            print(f"⚠️ Leader lease check failed: {e}")
+            is_leader = False
+        if is_leader != self.is_leader:
+            print(f"Worker {self.holder} is {'now' if is_leader else 'no longer'} the leader")
+        self.is_leader = is_leader
+
+    async def _run(self):
+        while True:
+            await self._try_acquire()
+            await asyncio.sleep(self.seconds / 3)
+
+    async def start(self):
+        """Try to become leader now, then keep the lease renewed."""
+        if self.lease is not None and (self._task is None or self._task.done()):
+            await self._try_acquire()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop renewing and give up the lease so another worker takes over."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await _in_executor(self.lease.release, self.holder)
+            except Exception as e:
+                # The lease still expires on its own
+                print(f"⚠️ Releasing the leader lease failed: {e}")
+
+
+BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "state.db")
+
+_redis_client = None
+
+# Shared backends created so far, opened by open_backends()
+_backends: List[Any] = []
+
+
+def redis_client():
+    """Shared Redis client for REDIS_URL (created on first use)."""
+    global _redis_client
+    if _redis_client is None:
+        import redis
+
+        _redis_client = redis.Redis.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            socket_timeout=float(os.getenv("REDIS_TIMEOUT", "0.5")),
+        )
+    return _redis_client
+
+
+def _register(backend):
+    _backends.append(backend)
+    return backend
+
+
+def create_cache(namespace: str, max_size: int = 1000):
+    """
+    Create a cache in the configured backend (no I/O until first use).
+
+    Args:
+        namespace: Name that separates this cache from others
+        max_size: Maximum number of entries (memory and sqlite)
+
+    Returns:
+        TTLCache, SQLiteCache or RedisCache
+    """
+    if BACKEND == "sqlite":
+        return _register(SQLiteCache(STATE_DB_PATH, namespace, max_size))
+    if BACKEND == "redis":
+        return _register(RedisCache(None, namespace))
+    return TTLCache(max_size=max_size)
+
+
+def create_queue(name: str):
+    """Create a shared queue, or None for the memory backend (nothing to share)."""
+    if BACKEND == "sqlite":
+        return _register(SQLiteQueue(STATE_DB_PATH, name))
+    if BACKEND == "redis":
+        return _register(RedisQueue(None, name))
+    return None
+
+
+def create_lease(name: str):
+    """Create a shared lease, or None for the memory backend."""
+    if BACKEND == "sqlite":
+        return _register(SQLiteLease(STATE_DB_PATH, name))
+    if BACKEND == "redis":
+        return _register(RedisLease(None, name))
+    return None
+
+
+async def open_backends():
+    """
+    Open the shared backends created so far (called from the FastAPI
+    lifespan, before leader election starts). A backend that can't be
+    opened is reported and retried on first use.
+    """
+    for backend in _backends:
+        try:
+            await _in_executor(backend.open)
+        except Exception as e:
+            print(f"⚠️ Opening shared state backend ({BACKEND}) failed: {e}")
+
+
+# Single instance for the app: the leader writes observations and runs
+# prefetching and retention
+leader_election = LeaderElection(
+    create_lease("leader"), seconds=float(os.getenv("LEADER_LEASE_SECONDS", "15"))
+)
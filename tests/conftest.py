@@ -0,0 +1,123 @@
+"""Make the app's top-level modules importable from the tests."""
+
+import fnmatch
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from shared_state import RedisLease  # noqa: E402
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the part of redis.Redis that shared_state.py
+    uses. Values come back as bytes like from a real server, and the
+    lease scripts run under one lock, as atomically as on the server.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._expires = {}
+        self._lists = {}
+
+    def _live(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._values
+
+    def _get(self, key):
+        return self._values[key] if self._live(key) else None
+
+    def _set(self, key, value, nx=False, px=None):
+        if nx and self._live(key):
+            return None
+        self._values[key] = value if isinstance(value, bytes) else str(value).encode()
+        self._expires.pop(key, None)
+        if px is not None:
+            self._expires[key] = time.monotonic() + int(px) / 1000
+        return True
+
+    def ping(self):
+        return True
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        with self._lock:
+            return self._set(key, value, nx, px)
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                removed += self._live(key) or key in self._lists
+                self._values.pop(key, None)
+                self._expires.pop(key, None)
+                self._lists.pop(key, None)
+            return removed
+
+    def scan_iter(self, match="*"):
+        with self._lock:
+            keys = [key for key in list(self._values) if self._live(key)] + list(self._lists)
+        return iter([key.encode() for key in keys if fnmatch.fnmatchcase(key, match)])
+
+    def rpush(self, key, *values):
+        with self._lock:
+            items = self._lists.setdefault(key, [])
+            items.extend(value.encode() for value in values)
+            return len(items)
+
+    def lpop(self, key, count=None):
+        with self._lock:
+            items = self._lists.get(key)
+            if not items:
+                return None
+            popped, self._lists[key] = items[:count or 1], items[count or 1:]
+            return popped if count is not None else popped[0]
+
+    def eval(self, script, numkeys, *keys_and_args):
+        key, holder = keys_and_args[0], str(keys_and_args[1]).encode()
+        with self._lock:
+            if script == RedisLease.ACQUIRE_SCRIPT:
+                milliseconds = keys_and_args[2]
+                if self._set(key, holder, nx=True, px=milliseconds):
+                    return 1
+                if self._get(key) == holder:
+                    self._expires[key] = time.monotonic() + int(milliseconds) / 1000
+                    return 1
+                return 0
+            if script == RedisLease.RELEASE_SCRIPT:
+                if self._get(key) == holder:
+                    del self._values[key]
+                    self._expires.pop(key, None)
+                    return 1
+                return 0
+        raise NotImplementedError("LocalRedis only runs the lease scripts")
+
+
+@pytest.fixture
+def local_redis():
+    return LocalRedis()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Test client for the app; the lifespan doesn't run, so no database is opened."""
+    from fastapi.testclient import TestClient
+
+    # main.py serves ./frontend
+    monkeypatch.chdir(REPO_ROOT)
+    from main import app
+
+    return TestClient(app)
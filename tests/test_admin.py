@@ -0,0 +1,15 @@
+"""Tests for the admin token check on /admin/* endpoints."""
+
+
+def test_admin_endpoints_are_closed_without_admin_token(client, monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    for path in ("/admin/storage", "/admin/startup"):
+        assert client.get(path).status_code == 403
+        assert client.get(path, headers={"X-Admin-Token": ""}).status_code == 403
+
+
+def test_admin_endpoints_need_the_right_token(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert client.get("/admin/startup").status_code == 403
+    assert client.get("/admin/startup", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/startup", headers={"X-Admin-Token": "secret"}).status_code == 200
@@ -0,0 +1,175 @@
+"""Tests for aggregator.WeatherAggregator."""
+
+import asyncio
+import time
+
+from aggregator import STATUS_OK, STATUS_SKIPPED, WeatherAggregator
+from routing import FINLAND, ProviderRouter
+
+HELSINKI = {"lat": 60.17, "lon": 24.94}
+
+
+def make_aggregator(geocode, **kwargs) -> WeatherAggregator:
+    async def provider(city):
+        return {"temperature": 1.0}
+
+    return WeatherAggregator(
+        {"FMI": provider, "Yr": provider},
+        router=ProviderRouter(geocode, {"FMI": FINLAND}),
+        **kwargs,
+    )
+
+
+def test_slow_routing_stays_within_the_deadline():
+    async def slow_geocode(city):
+        await asyncio.sleep(1.0)
+        return HELSINKI
+
+    async def main():
+        aggregator = make_aggregator(slow_geocode)
+        started = time.perf_counter()
+        results = await aggregator.fetch("Helsinki", deadline=0.2)
+        return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(main())
+    assert elapsed < 0.5
+    # Couldn't route in time, so every source was asked
+    assert results["FMI"]["status"] == STATUS_OK
+    assert results["Yr"]["status"] == STATUS_OK
+
+
+def test_routing_skips_sources_outside_their_region():
+    async def geocode(city):
+        return {"lat": 35.68, "lon": 139.69}
+
+    async def main():
+        return await make_aggregator(geocode).fetch("Tokyo")
+
+    results = asyncio.run(main())
+    assert results["FMI"]["status"] == STATUS_SKIPPED
+    assert results["Yr"]["status"] == STATUS_OK
+
+
+def test_upstream_failure_is_an_error_not_empty():
+    """A 503 from Yr.no is reported as an error and counted."""
+    import httpx
+
+    from aggregator import PROVIDER_ERRORS, STATUS_EMPTY, STATUS_ERROR
+    from services.http_client import HTTPClientManager
+    from services.yr import YrService
+
+    class Geocoder:
+        async def get_coordinates(self, city):
+            return HELSINKI if city == "Helsinki" else None
+
+    async def handler(request):
+        return httpx.Response(503)
+
+    async def main():
+        http = HTTPClientManager(max_retries=0)
+        http._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        service = YrService(http=http, geocoder=Geocoder())
+        aggregator = WeatherAggregator({"Yr": service.get_current_weather})
+        try:
+            return await aggregator.fetch("Helsinki"), await aggregator.fetch("Atlantis")
+        finally:
+            await http.close()
+
+    errors_before = PROVIDER_ERRORS._values.get(("Yr", STATUS_ERROR), 0)
+    failed, unknown = asyncio.run(main())
+    assert failed["Yr"]["status"] == STATUS_ERROR
+    assert "503" in failed["Yr"]["error"]
+    assert PROVIDER_ERRORS._values[("Yr", STATUS_ERROR)] == errors_before + 1
+    # No coordinates: nothing to fetch, not an upstream failure
+    assert unknown["Yr"]["status"] == STATUS_EMPTY
+
+
+def test_workers_share_results_through_a_shared_cache(tmp_path):
+    from shared_state import SQLiteCache
+
+    calls = []
+
+    async def provider(city):
+        calls.append(city)
+        return {"temperature": 1.0}
+
+    def worker():
+        return WeatherAggregator(
+            {"Yr": provider},
+            ttls={"Yr": 60},
+            cache=SQLiteCache(str(tmp_path / "state.db"), "responses"),
+        )
+
+    async def main():
+        await worker().fetch("Helsinki")
+        return await worker().fetch("Helsinki")
+
+    results = asyncio.run(main())
+    assert calls == ["Helsinki"]
+    assert results["Yr"]["cached"] is True
+
+
+def test_batch_reports_a_cancelled_city_as_an_error():
+    from aggregator import combine_batch
+
+    async def provider(city):
+        if city == "Oulu":
+            raise asyncio.CancelledError()
+        return {"temperature": 1.0}
+
+    aggregator = WeatherAggregator({"Yr": provider})
+
+    async def main():
+        return await aggregator.fetch_many(["Helsinki", "Oulu"])
+
+    results = asyncio.run(main())
+    assert isinstance(results["Oulu"], asyncio.CancelledError)
+
+    response = combine_batch(results)
+    assert response["errors"] == 1
+    assert "CancelledError" in response["results"]["Oulu"]["error"]
+    assert response["results"]["Helsinki"]["data"]["temperature"] == 1.0
+
+
+def test_fetch_bulk_stays_within_the_deadline_when_routing_is_slow():
+    async def slow_geocode(city):
+        await asyncio.sleep(0.5)
+        return HELSINKI
+
+    async def slow_bulk(cities):
+        await asyncio.sleep(2.0)
+        return {city: {"temperature": 1.0} for city in cities}
+
+    async def main():
+        aggregator = make_aggregator(slow_geocode, bulk_providers={"FMI": slow_bulk})
+        started = time.perf_counter()
+        await aggregator.fetch_bulk(["Helsinki", "Espoo"], deadline=1.0)
+        return time.perf_counter() - started
+
+    # Routing takes half of the budget, the bulk call gets the rest
+    assert asyncio.run(main()) < 1.3
+
+
+def test_fetch_many_shares_one_deadline_between_bulk_and_single_fetches():
+    async def geocode(city):
+        return HELSINKI
+
+    async def slow_bulk(cities):
+        await asyncio.sleep(2.0)
+        return {}
+
+    async def slow_provider(city):
+        await asyncio.sleep(0.8)
+        return {"temperature": 1.0}
+
+    async def main():
+        aggregator = WeatherAggregator(
+            {"FMI": slow_provider, "Yr": slow_provider},
+            router=ProviderRouter(geocode, {"FMI": FINLAND}),
+            bulk_providers={"FMI": slow_bulk},
+        )
+        started = time.perf_counter()
+        await aggregator.fetch_many(["Helsinki", "Espoo"], deadline=1.0)
+        return time.perf_counter() - started
+
+    assert asyncio.run(main()) < 1.3
@@ -0,0 +1,79 @@
+"""Tests for cache.SingleFlight."""
+
+import asyncio
+
+import pytest
+
+from cache import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert calls == 1
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def work():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        leader = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+
+        # E.g. the leader's /weather request hit its deadline
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "result"
+
+
+def test_cancelled_follower_does_not_cancel_leader():
+    async def work():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        leader = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        return await leader
+
+    assert asyncio.run(main()) == "result"
+
+
+def test_exception_reaches_every_caller_and_clears_key():
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(
+            flight.do("key", work), flight.do("key", work), return_exceptions=True
+        )
+        return results, flight.in_flight("key")
+
+    results, in_flight = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert not in_flight
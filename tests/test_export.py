@@ -0,0 +1,14 @@
+"""Tests for history export formats."""
+
+import sys
+
+
+def test_arrow_formats_answer_501_without_pyarrow(client, monkeypatch):
+    # Installs from requirements.txt alone don't have pyarrow
+    for module in ("pyarrow", "pyarrow.parquet"):
+        monkeypatch.setitem(sys.modules, module, None)
+
+    for fmt in ("arrow", "parquet"):
+        response = client.get(f"/weather/export/Oulu?format={fmt}")
+        assert response.status_code == 501
+        assert "pyarrow" in response.json()["detail"]
@@ -0,0 +1,37 @@
+"""Tests for services.geocoding."""
+
+import asyncio
+import threading
+
+from services.geocoding import GeocodeCache, Geocoder
+
+
+def test_saved_coordinates_are_loaded_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "weather_data.db")
+    saved = GeocodeCache(path)
+    saved.create_table()
+    saved.persist("oulu", {"lat": 65.01, "lon": 25.47})
+
+    cache = GeocodeCache(path)
+    load = cache.load
+    load_threads = []
+
+    def record_load():
+        load_threads.append(threading.current_thread())
+        load()
+
+    cache.load = record_load
+    geocoder = Geocoder(cache)
+
+    def no_nominatim(*args, **kwargs):
+        raise AssertionError("Nominatim should not be asked")
+
+    geocoder.geolocator.geocode = no_nominatim
+
+    async def main():
+        return await asyncio.gather(*(geocoder.get_coordinates("Oulu") for _ in range(3)))
+
+    assert asyncio.run(main()) == [{"lat": 65.01, "lon": 25.47}] * 3
+    # Loaded once, in the geocoding worker pool
+    assert len(load_threads) == 1
+    assert load_threads[0] is not threading.main_thread()
@@ -0,0 +1,137 @@
+"""Tests for services.http_client: breakers, deadlines and hedging."""
+
+import asyncio
+
+import httpx
+import pytest
+
+from resilience import OPEN
+from services.http_client import HTTPClientManager
+
+URL = "https://upstream.test/data"
+
+
+def make_manager(handler, **kwargs) -> HTTPClientManager:
+    kwargs.setdefault("max_retries", 0)
+    manager = HTTPClientManager(**kwargs)
+    manager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return manager
+
+
+async def hang(request):
+    await asyncio.sleep(60)
+
+
+def test_deadline_cancelled_requests_open_the_breaker():
+    """A hung upstream is cut off by the caller's deadline, not the HTTP timeout."""
+
+    async def main():
+        manager = make_manager(hang, breaker_failures=3)
+        try:
+            for _ in range(3):
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(manager.get(URL), 0.02)
+            return manager.breaker(URL)
+        finally:
+            await manager.close()
+
+    breaker = asyncio.run(main())
+    assert breaker.failures == 3
+    assert breaker.state == OPEN
+
+
+def test_deadline_cancelled_streams_open_the_breaker():
+    async def read(manager):
+        async with manager.stream("GET", URL) as response:
+            await response.aread()
+
+    async def main():
+        manager = make_manager(hang, breaker_failures=2)
+        try:
+            for _ in range(2):
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(read(manager), 0.02)
+            return manager.breaker(URL)
+        finally:
+            await manager.close()
+
+    assert asyncio.run(main()).state == OPEN
+
+
+class HangingBody(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        yield b"<wfs>"
+        await asyncio.sleep(60)
+
+
+def test_stream_cancelled_while_reading_the_body_is_a_failure():
+    async def handler(request):
+        return httpx.Response(200, stream=HangingBody())
+
+    async def read(manager):
+        async with manager.stream("GET", URL) as response:
+            async for _ in response.aiter_bytes():
+                pass
+
+    async def main():
+        manager = make_manager(handler)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(read(manager), 0.05)
+            return manager.breaker(URL)
+        finally:
+            await manager.close()
+
+    assert asyncio.run(main()).failures == 1
+
+
+def test_stream_cancelled_while_the_caller_does_other_work_is_not_a_failure():
+    async def handler(request):
+        return httpx.Response(400, text="unknown place")
+
+    async def read_then_wait(manager, read_body):
+        async with manager.stream("GET", URL) as response:
+            if read_body:
+                await response.aread()
+            # E.g. FMI saving an unknown place to a shared cache
+            await asyncio.sleep(60)
+
+    async def main():
+        manager = make_manager(handler)
+        try:
+            for read_body in (True, False):
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(read_then_wait(manager, read_body), 0.05)
+            return manager.breaker(URL)
+        finally:
+            await manager.close()
+
+    assert asyncio.run(main()).failures == 0
+
+
+def test_losing_hedge_is_not_a_failure():
+    calls = 0
+
+    async def handler(request):
+        nonlocal calls
+        calls += 1
+        # First request is slow, the hedged one answers at once
+        await asyncio.sleep(1.0 if calls == 1 else 0)
+        return httpx.Response(200, text="ok")
+
+    async def main():
+        manager = make_manager(handler, hedge=True)
+        try:
+            breaker = manager.breaker(URL)
+            for _ in range(20):
+                manager.latencies[breaker.name].record(0.001)
+            response = await manager.get(URL)
+            await asyncio.sleep(0)
+            return response, breaker
+        finally:
+            await manager.close()
+
+    response, breaker = asyncio.run(main())
+    assert response.text == "ok"
+    assert calls == 2
+    assert breaker.failures == 0
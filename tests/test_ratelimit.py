@@ -0,0 +1,78 @@
+"""Tests for ratelimit.RateLimiter."""
+
+import asyncio
+import time
+
+import pytest
+
+from ratelimit import BACKGROUND, BATCH, INTERACTIVE, RateLimiter, RateLimitExceeded
+
+
+def test_waiters_are_served_most_urgent_first():
+    async def main():
+        limiter = RateLimiter("host", rate=50)
+        await limiter.acquire(INTERACTIVE)
+        served = []
+
+        async def caller(name, priority):
+            await limiter.acquire(priority)
+            served.append(name)
+
+        tasks = []
+        for name, priority in [("background", BACKGROUND), ("batch 1", BATCH),
+                               ("interactive", INTERACTIVE), ("batch 2", BATCH)]:
+            tasks.append(asyncio.create_task(caller(name, priority)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return served
+
+    assert asyncio.run(main()) == ["interactive", "batch 1", "batch 2", "background"]
+
+
+def test_full_queue_fails_fast_or_sheds_a_less_urgent_waiter():
+    async def main():
+        limiter = RateLimiter("host", rate=10, max_queue=1)
+        await limiter.acquire(INTERACTIVE)
+        background = asyncio.create_task(limiter.acquire(BACKGROUND))
+        await asyncio.sleep(0)
+
+        # More urgent: takes the background caller's place
+        interactive = asyncio.create_task(limiter.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        with pytest.raises(RateLimitExceeded):
+            await background
+
+        # Same priority: nobody to shed, so the new caller fails
+        with pytest.raises(RateLimitExceeded):
+            await limiter.acquire(INTERACTIVE)
+        await interactive
+        return limiter.rejected
+
+    assert asyncio.run(main()) == 2
+
+
+def test_cancelled_waiter_does_not_use_a_token():
+    async def main():
+        limiter = RateLimiter("host", rate=20)
+        await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire())
+        second = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        first.cancel()
+        started = time.monotonic()
+        await second
+        return time.monotonic() - started
+
+    # The next token (50 ms away) goes to the second caller
+    assert asyncio.run(main()) < 0.09
+
+
+def test_pause_holds_requests_back():
+    async def main():
+        limiter = RateLimiter("host", rate=100, burst=5)
+        limiter.pause(0.1)
+        started = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.09
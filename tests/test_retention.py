@@ -0,0 +1,19 @@
+"""Tests for retention.RetentionPolicy."""
+
+import pytest
+
+from retention import RetentionPolicy
+
+
+def test_policy_accepts_tiers_in_order():
+    RetentionPolicy(raw_days=30, hourly_days=365, daily_days=0)
+    RetentionPolicy(raw_days=30, hourly_days=30, daily_days=30)
+
+
+@pytest.mark.parametrize(
+    "raw_days, hourly_days, daily_days",
+    [(400, 365, 0), (30, 365, 100)],
+)
+def test_policy_rejects_a_tier_kept_longer_than_the_next(raw_days, hourly_days, daily_days):
+    with pytest.raises(ValueError):
+        RetentionPolicy(raw_days, hourly_days, daily_days)
@@ -0,0 +1,165 @@
+"""Tests for the shared state backends and leader election (shared_state.py)."""
+
+import asyncio
+import os
+
+import pytest
+
+import shared_state
+from shared_state import (
+    LeaderElection,
+    RedisCache,
+    RedisLease,
+    RedisQueue,
+    SQLiteCache,
+    SQLiteLease,
+    SQLiteQueue,
+)
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path, local_redis):
+    """Factory for (kind, name) -> backend object, both workers seeing the same state."""
+    path = str(tmp_path / "state.db")
+
+    def create(kind, name):
+        if request.param == "sqlite":
+            return {"cache": SQLiteCache, "queue": SQLiteQueue, "lease": SQLiteLease}[kind](path, name)
+        return {"cache": RedisCache, "queue": RedisQueue, "lease": RedisLease}[kind](local_redis, name)
+
+    return create
+
+
+def test_creating_backends_does_no_io(tmp_path):
+    path = tmp_path / "state.db"
+    SQLiteCache(str(path), "responses")
+    SQLiteQueue(str(path), "observations")
+    SQLiteLease(str(path), "leader")
+    # Redis clients are only looked up on first use
+    RedisCache(None, "responses")
+    RedisLease(None, "leader")
+    assert not path.exists()
+
+
+def test_cache_is_shared_between_workers(backend):
+    first, second = backend("cache", "responses"), backend("cache", "responses")
+
+    async def scenario():
+        await first.aset(("oulu", "FMI"), {"temperature": 1.5}, 60)
+        assert await second.aget(("oulu", "FMI")) == {"temperature": 1.5}
+        await first.aset(("oulu", "YR"), {"temperature": 2.0}, -1)
+        assert await second.aget(("oulu", "YR")) is None
+        assert await second.aget_stale(("oulu", "YR"), 60) == {"temperature": 2.0}
+        await second.adelete(("oulu", "FMI"))
+        assert await first.aget(("oulu", "FMI")) is None
+
+    asyncio.run(scenario())
+    assert (second.hits, second.misses) == (1, 1)
+
+
+def test_queue_hands_items_over_in_order(backend):
+    follower, leader = backend("queue", "observations"), backend("queue", "observations")
+    follower.push([["Oulu", "FMI", {"temperature": 1}, 1], ["Oulu", "YR", {"temperature": 2}, 2]])
+    follower.push([["Turku", "FMI", {"temperature": 3}, 3]])
+
+    assert [item[0:2] for item in leader.pop(2)] == [["Oulu", "FMI"], ["Oulu", "YR"]]
+    assert [item[0:2] for item in leader.pop(10)] == [["Turku", "FMI"]]
+    assert leader.pop(10) == []
+
+
+def test_lease_is_held_by_one_worker(backend):
+    first, second = backend("lease", "leader"), backend("lease", "leader")
+    assert first.acquire("a", 60)
+    assert not second.acquire("b", 60)
+    # Renewing keeps it
+    assert first.acquire("a", 60)
+
+    # Only the holder can release it
+    second.release("b")
+    assert not second.acquire("b", 60)
+    first.release("a")
+    assert second.acquire("b", 60)
+
+
+def test_expired_lease_goes_to_another_worker_and_old_holder_cant_renew(backend):
+    first, second = backend("lease", "leader"), backend("lease", "leader")
+    assert first.acquire("a", 0.05)
+
+    async def wait():
+        await asyncio.sleep(0.1)
+
+    asyncio.run(wait())
+    assert second.acquire("b", 60)
+    assert not first.acquire("a", 60)
+    first.release("a")
+    assert not first.acquire("a", 60)
+
+
+def test_follower_takes_over_when_leader_stops(backend):
+    async def scenario():
+        leader = LeaderElection(backend("lease", "leader"), seconds=0.3)
+        follower = LeaderElection(backend("lease", "leader"), seconds=0.3)
+        await leader.start()
+        await follower.start()
+        assert leader.is_leader and not follower.is_leader
+
+        await leader.stop()
+        assert not leader.is_leader
+        # Follower checks every third of the lease
+        await asyncio.sleep(0.2)
+        assert follower.is_leader
+        await follower.stop()
+
+    asyncio.run(scenario())
+
+
+def test_follower_takes_over_when_leader_dies(backend):
+    async def scenario():
+        leader = LeaderElection(backend("lease", "leader"), seconds=0.3)
+        follower = LeaderElection(backend("lease", "leader"), seconds=0.3)
+        await leader.start()
+        await follower.start()
+
+        # A crashed worker stops renewing without releasing the lease
+        leader._task.cancel()
+        await asyncio.sleep(0.15)
+        assert not follower.is_leader
+        await asyncio.sleep(0.3)
+        assert follower.is_leader
+        await follower.stop()
+
+    asyncio.run(scenario())
+
+
+def test_open_backends_opens_created_sqlite_backends(tmp_path, monkeypatch):
+    path = str(tmp_path / "state.db")
+    monkeypatch.setattr(shared_state, "BACKEND", "sqlite")
+    monkeypatch.setattr(shared_state, "STATE_DB_PATH", path)
+    monkeypatch.setattr(shared_state, "_backends", [])
+
+    shared_state.create_cache("responses")
+    shared_state.create_lease("leader")
+    assert not os.path.exists(path)
+
+    asyncio.run(shared_state.open_backends())
+    assert os.path.exists(path)
+
+
+def test_redis_cache_treats_an_outage_as_a_miss():
+    class DownRedis:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise ConnectionError("Connection refused")
+
+            return fail
+
+    cache = RedisCache(DownRedis(), "responses")
+
+    async def scenario():
+        await cache.aset("oulu", {"temperature": 1.5}, 60)
+        assert await cache.aget("oulu") is None
+        await cache.adelete("oulu")
+        cache.clear()
+
+    asyncio.run(scenario())
+    assert cache.misses == 1
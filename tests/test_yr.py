@@ -0,0 +1,36 @@
+"""Tests for services.yr: forecast documents shared between callers."""
+
+import asyncio
+import json
+
+import httpx
+
+from benchmarks.fixtures import yr_compact_json
+from services.http_client import HTTPClientManager
+from services.yr import YrService
+
+
+def test_forecast_survives_cancelled_current_weather_fetch():
+    """A /weather deadline cancelling the Yr fetch must not fail a concurrent forecast."""
+    body = json.dumps(yr_compact_json(hours=48)).encode()
+
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, content=body, headers={"Content-Type": "application/json"})
+
+    async def main():
+        http = HTTPClientManager(hedge=False)
+        http._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        service = YrService(http=http)
+        try:
+            current = asyncio.create_task(service.get_forecast_document(65.01, 25.47))
+            await asyncio.sleep(0)
+            forecast = asyncio.create_task(service.get_forecast_document(65.01, 25.47))
+            await asyncio.sleep(0.01)
+            current.cancel()
+            return await forecast
+        finally:
+            await http.close()
+
+    document = asyncio.run(main())
+    assert len(document["forecast"]) == 48
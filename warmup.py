@@ -0,0 +1,126 @@
+"""
+Startup warm-up and import-time report.
+
+Importing the app modules is cheap on its own: database and geocoding
+setup are deferred to first use and pandas is only imported by
+WeatherAnalytics.get_dataframe. That keeps cold starts fast, but moves
+the cost to the first request. preload() pays it up front, in the FastAPI
+lifespan before the server accepts requests:
+
+- imports the app modules (and pandas when PRELOAD_PANDAS=1)
+- migrates the database and opens a pooled connection
+- loads the geocoding cache
+
+The timings are kept in startup_report (served at /admin/startup).
+
+Usage:
+    python warmup.py            # Import-time report for a cold process
+    python warmup.py --pandas   # Same, including pandas
+"""
+
+import argparse
+import importlib
+import json
+import sys
+import time
+from typing import Dict, Iterable
+
+# Third-party packages first, so the app modules are timed on their own
+MODULES = (
+    "httpx",
+    "geopy.geocoders",
+    "database",
+    "services.http_client",
+    "services.geocoding",
+    "services.fmi",
+    "services.yr",
+    "services.foreca",
+    "aggregator",
+    "observation_writer",
+    "analytics",
+    "retention",
+    "prefetch",
+)
+
+# Filled by preload()
+startup_report: Dict = {"preloaded": False}
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def import_times(modules: Iterable[str]) -> Dict[str, float]:
+    """
+    Import modules in order and time each import.
+
+    Times include dependencies not imported earlier in the list; modules
+    that were already imported count as 0.
+
+    Args:
+        modules: Module names
+
+    Returns:
+        Dictionary of module name -> import time in milliseconds
+    """
+    times = {}
+    for name in modules:
+        if name in sys.modules:
+            times[name] = 0.0
+            continue
+        started = time.perf_counter()
+        importlib.import_module(name)
+        times[name] = _elapsed_ms(started)
+    return times
+
+
+def preload(include_pandas: bool = False) -> Dict:
+    """
+    Import app modules and run deferred setup ahead of the first request.
+
+    Args:
+        include_pandas: Also import pandas (only needed for get_dataframe)
+
+    Returns:
+        Report with import times and setup times in milliseconds
+    """
+    started = time.perf_counter()
+    modules = MODULES + ("pandas",) if include_pandas else MODULES
+    imports = import_times(modules)
+
+    from database import weather_db
+    from services.geocoding import geocoder
+
+    step = time.perf_counter()
+    weather_db.migrate()
+    database_ms = _elapsed_ms(step)
+
+    step = time.perf_counter()
+    geocoder.cache.load()
+    geocode_cache_ms = _elapsed_ms(step)
+
+    startup_report.update(
+        {
+            "preloaded": True,
+            "pandas": "pandas" in sys.modules,
+            "imports_ms": imports,
+            "database_ms": database_ms,
+            "geocode_cache_ms": geocode_cache_ms,
+            "total_ms": _elapsed_ms(started),
+        }
+    )
+    return startup_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time report")
+    parser.add_argument("--pandas", action="store_true", help="Include pandas")
+    args = parser.parse_args()
+
+    report = preload(include_pandas=args.pandas)
+    print(json.dumps(report, indent=2))
+    print("For a per-module breakdown: python -X importtime -c 'import main'")
+
+
+if __name__ == "__main__":
+    main()